@@ -0,0 +1,175 @@
+import logging
+from typing import Any, Iterable, List, Optional, Set
+from urllib.parse import urljoin, urlparse, urlunparse, parse_qsl, urlencode
+
+import lxml.html
+
+# query parameters that only track where a visitor came from, and never change the page content
+TRACKING_PARAMS = [
+    'utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content', 'utm_id',
+    'gclid', 'dclid', 'fbclid', 'msclkid', 'yclid', 'mc_cid', 'mc_eid', '_ga', '_gl',
+    'igshid', 'ref_src', 'hsa_acc', 'hsa_cam', 'hsa_grp', 'hsa_ad', 'hsa_src', 'hsa_net', 'hsa_ver',
+]
+INDEX_PAGES = ('index.html', 'index.htm', 'index.php', 'default.aspx')
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+def find_canonical_link(html: Any, base_url: str) -> Optional[str]:
+    """
+    Return the (absolute) target of the page's <link rel="canonical">, or None if it has none.
+    html is the page's HTML, or an already parsed lxml document.
+    """
+    if isinstance(html, (str, bytes)):
+        try:
+            doc = lxml.html.fromstring(html)
+        except Exception:
+            return None
+    else:
+        doc = html
+    for link in doc.xpath('//head/link[@rel and @href]'):
+        if 'canonical' in link.get('rel', '').lower().split():
+            return urljoin(base_url, link.get('href').strip())
+    return None
+
+class UrlCanonicalizer:
+    """
+    Maps the different URLs a site uses for the same page to a single canonical URL, so that each page is
+    fetched and indexed only once (and always gets the same document ID).
+
+    canonicalize() applies URL rewriting rules:
+    - scheme and host are lower-cased, default ports, fragments and empty query strings are removed
+    - query parameters: if allowed_params is set, only those are kept. Otherwise, if keep_query_params is True
+      all parameters except denied_params (and common tracking parameters like utm_*) are kept, sorted by name;
+      if False, the query is removed.
+    - trailing index pages (like index.html) are removed
+    - trailing_slash: 'strip' removes a trailing slash from the path, 'add' adds one to paths without a file extension,
+      'keep' leaves the path as is
+    - lowercase_path: lower-case the path too (for sites with case-insensitive URLs)
+
+    resolve() also uses what a fetch of the page revealed: the redirect target, and the page's <link rel="canonical">
+    (only if it points to the same host, and not to the homepage from a deeper page - a common misconfiguration).
+
+    Args:
+        keep_query_params (bool): keep query parameters (except denied ones).
+        allowed_params (list): if not empty, the only query parameters kept.
+        denied_params (list): query parameters to always remove, in addition to TRACKING_PARAMS.
+        trailing_slash (str): 'strip', 'add' or 'keep'.
+        lowercase_path (bool): lower-case the URL path.
+        use_rel_canonical (bool): use <link rel="canonical"> in resolve().
+    """
+    def __init__(self, keep_query_params: bool = False, allowed_params: List[str] = [], denied_params: List[str] = [],
+                 trailing_slash: str = 'strip', lowercase_path: bool = False, use_rel_canonical: bool = True):
+        if trailing_slash not in ('strip', 'add', 'keep'):
+            raise ValueError(f"Invalid trailing_slash value '{trailing_slash}', must be one of strip, add or keep")
+        self.keep_query_params = keep_query_params
+        self.allowed_params = set(allowed_params)
+        self.denied_params = set(TRACKING_PARAMS + list(denied_params))
+        self.trailing_slash = trailing_slash
+        self.lowercase_path = lowercase_path
+        self.use_rel_canonical = use_rel_canonical
+
+    def _keep_param(self, name: str) -> bool:
+        if self.allowed_params:
+            return name in self.allowed_params
+        return self.keep_query_params and name not in self.denied_params and not name.startswith('utm_')
+
+    def canonicalize(self, url: str) -> str:
+        if '://' not in url:
+            url = 'http://' + url
+        p = urlparse(url)
+        scheme = p.scheme.lower()
+        host = (p.hostname or '').rstrip('.')
+        if ':' in host:     # IPv6
+            host = f"[{host}]"
+        try:
+            port = p.port
+        except ValueError:      # malformed port; leave the URL alone
+            return url
+        if port is not None and str(port) != DEFAULT_PORTS.get(scheme):
+            host = f"{host}:{port}"
+        if p.username:
+            host = f"{p.username}:{p.password}@{host}" if p.password else f"{p.username}@{host}"
+
+        path = p.path or '/'
+        if self.lowercase_path:
+            path = path.lower()
+        last = path.rsplit('/', 1)[-1]
+        if last.lower() in INDEX_PAGES:
+            path = path[:-len(last)]
+        if self.trailing_slash == 'strip' and len(path) > 1:
+            path = path.rstrip('/') or '/'
+        elif self.trailing_slash == 'add' and not path.endswith('/') and '.' not in path.rsplit('/', 1)[-1]:
+            path += '/'
+
+        query = ''
+        if p.query and (self.keep_query_params or self.allowed_params):
+            params = [(k, v) for k, v in parse_qsl(p.query, keep_blank_values=True) if self._keep_param(k)]
+            query = urlencode(sorted(params))
+        return urlunparse((scheme, host, path, p.params, query, ''))
+
+    def resolve(self, url: str, final_url: Optional[str] = None, html: Any = None) -> str:
+        """
+        Return the canonical URL of a page that was fetched from `url`, given the URL the fetch ended up at
+        (after redirects) and the page's HTML (or parsed lxml document).
+        """
+        canonical = self.canonicalize(final_url or url)
+        if self.use_rel_canonical and html is not None:
+            rel = find_canonical_link(html, final_url or url)
+            if rel and rel.startswith('http'):
+                rel = self.canonicalize(rel)
+                rel_p, page_p = urlparse(rel), urlparse(canonical)
+                if rel_p.netloc != page_p.netloc:
+                    logging.debug(f"Ignoring cross-host canonical link {rel} of {url}")
+                elif rel_p.path in ('', '/') and page_p.path not in ('', '/'):
+                    logging.debug(f"Ignoring canonical link {rel} of {url} pointing to the homepage")
+                else:
+                    canonical = rel
+        return canonical
+
+class IndexedUrls:
+    """
+    The canonical URLs of the pages indexed in this run, so that a page reached under several URLs is indexed only once.
+    With Ray, call share() so that all the actors that get a copy check against the same set.
+    """
+    def __init__(self):
+        self.urls: Set[str] = set()
+        self.backend = None
+
+    def share(self) -> None:
+        """
+        Move the set to a Ray actor shared by all copies of this object (ray must be initialized).
+        """
+        import ray
+        self.backend = ray.remote(num_cpus=0)(IndexedUrls).remote()
+
+    def seen(self, url: str) -> bool:
+        """
+        Whether a page was already claimed under this canonical URL (or one of its aliases).
+        """
+        if self.backend is not None:
+            import ray
+            return ray.get(self.backend.seen.remote(url))
+        return url in self.urls
+
+    def claim(self, url: str, aliases: Iterable[str] = ()) -> bool:
+        """
+        Record that the page with this canonical URL is indexed, also under the other URLs it was reached with.
+        Returns False if it was already claimed, in which case it should not be indexed again.
+        """
+        if self.backend is not None:
+            import ray
+            return ray.get(self.backend.claim.remote(url, list(aliases)))
+        if url in self.urls:
+            return False
+        self.urls.add(url)
+        self.urls.update(aliases)
+        return True
+
+    def release(self, url: str, aliases: Iterable[str] = ()) -> None:
+        """
+        Undo a claim() whose page failed to index, so that it can be indexed again (e.g. under another of its URLs).
+        """
+        if self.backend is not None:
+            self.backend.release.remote(url, list(aliases))
+            return
+        self.urls.discard(url)
+        self.urls.difference_update(aliases)
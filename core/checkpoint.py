@@ -0,0 +1,131 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Optional, Set, Tuple
+
+DONE = 'done'
+ERROR = 'error'
+
+class CrawlCheckpoint:
+    """
+    On-disk (SQLite) store of a crawl's progress, so that a job that died can be resumed.
+
+    It keeps:
+    - the discovery state of each seed URL: the URLs visited so far, and the frontier of URLs still to be expanded
+    - the final list of URLs to index, once discovery has completed
+    - the index status of each URL (done or error)
+
+    Writes are batched and committed at most every `interval` seconds (or on flush()).
+    Index statuses can be marked from several threads.
+
+    Args:
+        path (str): path of the SQLite file.
+        resume (bool): if True, keep the existing state; otherwise start from an empty store.
+        interval (float): minimum number of seconds between commits.
+    """
+    def __init__(self, path: str, resume: bool = False, interval: float = 60):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.interval = interval
+        self.last_commit = time.time()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS visited (seed TEXT, url TEXT, PRIMARY KEY (seed, url));
+            CREATE TABLE IF NOT EXISTS frontier (seed TEXT, url TEXT, depth INTEGER);
+            CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS status (url TEXT PRIMARY KEY, status TEXT);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        if not resume:
+            self.conn.executescript("""
+                DELETE FROM visited; DELETE FROM frontier; DELETE FROM urls; DELETE FROM status; DELETE FROM meta;
+            """)
+        self.conn.commit()
+        if resume:
+            logging.info(f"Resuming crawl from checkpoint {path} ({len(self.completed())} URLs already indexed)")
+
+    def _maybe_commit(self) -> None:
+        if time.time() - self.last_commit >= self.interval:
+            self.flush()
+
+    def due(self) -> bool:
+        """
+        True if it's time to save a new snapshot of the frontier.
+        """
+        return time.time() - self.last_commit >= self.interval
+
+    def flush(self) -> None:
+        with self.lock:
+            self.conn.commit()
+            self.last_commit = time.time()
+
+    def close(self) -> None:
+        self.flush()
+        self.conn.close()
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+        self._maybe_commit()
+
+    # discovery state
+    def add_visited(self, seed: str, urls: Iterable[str]) -> None:
+        with self.lock:
+            self.conn.executemany("INSERT OR IGNORE INTO visited (seed, url) VALUES (?, ?)", ((seed, u) for u in urls))
+
+    def save_frontier(self, seed: str, items: Iterable[Tuple[str, int]]) -> None:
+        """
+        Replace the frontier of this seed, and commit.
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM frontier WHERE seed=?", (seed,))
+            self.conn.executemany("INSERT INTO frontier (seed, url, depth) VALUES (?, ?, ?)", ((seed, u, d) for u, d in items))
+            self.flush()
+
+    def load_frontier(self, seed: str) -> Optional[Tuple[Set[str], List[Tuple[str, int]]]]:
+        """
+        Return the visited URLs and frontier saved for this seed, or None if there is no saved state.
+        """
+        visited = set(r[0] for r in self.conn.execute("SELECT url FROM visited WHERE seed=?", (seed,)))
+        if len(visited) == 0:
+            return None
+        frontier = [(r[0], r[1]) for r in self.conn.execute("SELECT url, depth FROM frontier WHERE seed=?", (seed,))]
+        return visited, frontier
+
+    def discovery_done(self, seed: str) -> bool:
+        return self.get_meta(f'discovered:{seed}') is not None
+
+    def set_discovery_done(self, seed: str) -> None:
+        self.conn.execute("DELETE FROM frontier WHERE seed=?", (seed,))
+        self.set_meta(f'discovered:{seed}', '1')
+        self.flush()
+
+    # URLs to index
+    def set_urls(self, urls: Iterable[str]) -> None:
+        self.conn.execute("DELETE FROM urls")
+        self.conn.executemany("INSERT OR IGNORE INTO urls (url) VALUES (?)", ((u,) for u in urls))
+        self.set_meta('urls_collected', '1')
+        self.flush()
+
+    def get_urls(self) -> Optional[List[str]]:
+        """
+        Return the list of URLs to index saved by a previous run, or None if discovery did not complete.
+        """
+        if self.get_meta('urls_collected') is None:
+            return None
+        return [r[0] for r in self.conn.execute("SELECT url FROM urls")]
+
+    # index status
+    def mark(self, url: str, status: str) -> None:
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO status (url, status) VALUES (?, ?)", (url, status))
+            self._maybe_commit()
+
+    def completed(self) -> Set[str]:
+        return set(r[0] for r in self.conn.execute("SELECT url FROM status WHERE status=?", (DONE,)))
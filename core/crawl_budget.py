@@ -0,0 +1,140 @@
+import heapq
+import math
+import re
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from core.recrawl_state import normalize_lastmod
+
+class CrawlBudgetExhausted(Exception):
+    """
+    Raised to stop a crawl once its deadline passed or its page budget was used up.
+    """
+    pass
+
+class CrawlBudget:
+    """
+    Wall-clock deadline and page budget of a crawl job (0 for no limit), counted from when the budget is created.
+    Only pages that were indexed successfully (as reported with record()) count towards the page budget.
+
+    Args:
+        deadline_minutes (float): stop dispatching pages this many minutes after the start.
+        max_pages (int): stop dispatching pages once this many were indexed.
+    """
+    def __init__(self, deadline_minutes: float = 0, max_pages: int = 0):
+        self.deadline = time.time() + deadline_minutes * 60 if deadline_minutes > 0 else None
+        self.max_pages = max_pages
+        self.released = 0
+        self.indexed = 0
+
+    def exhausted(self) -> Optional[str]:
+        """
+        Return why the budget is exhausted, or None if it is not.
+        """
+        if self.deadline is not None and time.time() >= self.deadline:
+            return "deadline reached"
+        if self.max_pages > 0 and self.indexed >= self.max_pages:
+            return f"page budget of {self.max_pages} indexed pages used up"
+        return None
+
+    def take(self) -> None:
+        """
+        Account for one page released for indexing, or raise CrawlBudgetExhausted if the budget is exhausted.
+        """
+        reason = self.exhausted()
+        if reason:
+            raise CrawlBudgetExhausted(reason)
+        self.released += 1
+
+    def record(self, indexed: bool) -> None:
+        """
+        Account for the result of a released page: only successfully indexed pages use up the page budget.
+        """
+        if indexed:
+            self.indexed += 1
+
+class PriorityScorer:
+    """
+    Scores how valuable it is to index a URL early. The score is the sum of:
+    - the sitemap <priority> (0 to 1, 0.5 if missing), times priority_weight
+    - the lastmod recency, 1 for a page modified now and halving every recency_half_life_days (0 if unknown), times recency_weight
+    - 1 / (1 + depth), where depth is the number of links from the seed URL, or else the number of path segments, times depth_weight
+    - the boost of every regex in `boosts` that matches the URL (negative boosts push URLs back)
+
+    Args:
+        boosts (dict): regex -> boost.
+    """
+    def __init__(self, boosts: Dict[str, float] = {}, priority_weight: float = 1.0, recency_weight: float = 1.0,
+                 depth_weight: float = 1.0, recency_half_life_days: float = 30.0):
+        self.boosts = [(re.compile(r), float(b)) for r, b in boosts.items()]
+        self.priority_weight = priority_weight
+        self.recency_weight = recency_weight
+        self.depth_weight = depth_weight
+        self.half_life = max(recency_half_life_days, 1e-3) * 86400
+        self.now = datetime.now(timezone.utc)
+
+    def _recency(self, lastmod: Optional[str]) -> float:
+        try:
+            modified = datetime.fromisoformat(normalize_lastmod(lastmod))     # type: ignore
+        except (TypeError, ValueError):
+            return 0.0
+        age = max((self.now - modified).total_seconds(), 0.0)
+        return math.pow(0.5, age / self.half_life)
+
+    def score(self, url: str, priority: Optional[float] = None, lastmod: Optional[str] = None,
+              depth: Optional[int] = None) -> float:
+        if depth is None:
+            depth = len([s for s in urlparse(url).path.split('/') if s])
+        s = self.priority_weight * (priority if priority is not None else 0.5)
+        s += self.recency_weight * self._recency(lastmod)
+        s += self.depth_weight / (1 + depth)
+        s += sum(b for r, b in self.boosts if r.match(url))
+        return s
+
+class CrawlScheduler:
+    """
+    Orders discovered URLs by priority score, within a crawl budget.
+
+    Up to `window` discovered URLs are held back, and the highest-scoring ones are released first: one whenever
+    the window overflows, and all the rest (still in priority order) at the end of discovery. A larger window
+    reorders more URLs but delays the start of indexing while it fills up. URLs are released until the budget is
+    exhausted (by the deadline, or by the pages indexed successfully, see CrawlBudget.record()); then ready() raises
+    CrawlBudgetExhausted and the URLs still held back are deferred.
+
+    Args:
+        scorer (PriorityScorer): computes URL scores.
+        budget (CrawlBudget): deadline and page budget.
+        window (int): maximum number of URLs held back.
+    """
+    def __init__(self, scorer: PriorityScorer, budget: CrawlBudget, window: int = 1000):
+        self.scorer = scorer
+        self.budget = budget
+        self.window = max(window, 0)
+        self.heap: List[Tuple[float, int, str]] = []
+        self.seq = 0
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def push(self, url: str, priority: Optional[float] = None, lastmod: Optional[str] = None,
+             depth: Optional[int] = None) -> None:
+        # seq keeps discovery order among URLs with equal scores
+        heapq.heappush(self.heap, (-self.scorer.score(url, priority, lastmod, depth), self.seq, url))
+        self.seq += 1
+
+    def ready(self, flush: bool = False, extra: int = 0) -> Iterator[str]:
+        """
+        Release the best URLs: those above the window, `extra` more (e.g. for idle workers), or all of them if flush is True.
+        """
+        while self.heap and (flush or len(self.heap) > self.window or extra > 0):
+            self.budget.take()
+            extra -= 1
+            yield heapq.heappop(self.heap)[2]
+
+    def deferred(self) -> List[Tuple[str, float]]:
+        """
+        Return the URLs held back and not released, with their scores, best first.
+        """
+        return [(url, -neg_score) for neg_score, _, url in sorted(self.heap)]
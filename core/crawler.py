@@ -1,14 +1,17 @@
 from omegaconf import OmegaConf, DictConfig
 import requests
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin
 import logging
-from typing import Set, Optional, List, Any
+from typing import Set, Optional, List, Any, Tuple, Callable
+from concurrent.futures import Future
 from core.indexer import Indexer
 from core.pdf_convert import PDFConverter
-from core.utils import img_extensions, doc_extensions, archive_extensions
+from core.frontier import FrontierCrawler
+from core.checkpoint import CrawlCheckpoint
+from core.work_queue import ShardedWorkQueue
+from core.index_queue import IndexQueue
+import os
 from slugify import slugify
-from urllib.parse import urlparse
 
 
 get_headers = {
@@ -19,55 +22,19 @@ get_headers = {
     "Connection": "keep-alive",
 }
 
-def url_is_relative(url: str) -> bool:
-    parsed_url = urlparse(url)
-    return not parsed_url.scheme and not parsed_url.netloc
-
 def recursive_crawl(url: str, depth: int, pos_regex: List[Any], neg_regex: List[Any], 
                     indexer: Indexer, visited: Optional[Set[str]]=None, 
-                    verbose: bool = False) -> Set[str]:
-    if visited is None:
-        visited = set()
-
-    # For archive or image - we don't extract links from them, nor are they included in the crawled URLs list
-    url_without_fragment = url.split("#")[0]
-    if any([url_without_fragment.endswith(ext) for ext in (archive_extensions + img_extensions)]):
-        return visited
-
-    # add the current URL
-    visited.add(url)
-
-    # for document files (like PPT, DOCX, etc) we don't extract links from the URL, but the link itself is included. 
-    if any([url_without_fragment.endswith(ext) for ext in doc_extensions]):
-        return visited
-
-    # if we reached the maximum depth, stop and return the visited URLs
-    if depth <= 0:
-        return visited
-
-    try:
-        res = indexer.fetch_page_contents(url)
-        new_urls = [urljoin(url, u) if url_is_relative(u) else u for u in res['links']]  # convert all new URLs to absolute URLs
-        new_urls = [u for u in new_urls 
-                    if      u not in visited and u.startswith('http') 
-                    and     (len(pos_regex)==0 or any([r.match(u) for r in pos_regex]))
-                    and     (len(neg_regex)==0 or (not any([r.match(u) for r in neg_regex]))) 
-                   ]
-        new_urls = list(set(new_urls))
-        visited.update(new_urls)
-
-        if len(new_urls) > 0:
-            logging.info(f"collected {len(visited)} URLs so far")
-            if verbose:
-                print(f"URLs so far: {visited}")
-
-        for new_url in new_urls:
-            visited = recursive_crawl(new_url, depth-1, pos_regex, neg_regex, indexer, visited, verbose)
-    except Exception as e:
-        logging.error(f"Error {e} in recursive_crawl for {url}")
-        pass
-
-    return set(visited)
+                    verbose: bool = False, **kwargs: Any) -> Set[str]:
+    """
+    Crawl a website starting at url, following links up to depth hops, and return the set of URLs found.
+    This is now a thin wrapper over the iterative FrontierCrawler; extra kwargs are passed on to it.
+    """
+    frontier = FrontierCrawler(indexer, pos_regex, neg_regex, max_depth=depth, verbose=verbose, **kwargs)
+    if visited:
+        frontier.visited.update(visited)
+    visited_urls = set(frontier.crawl([url]))
+    frontier.visited.close()
+    return visited_urls
 
 
 class Crawler(object):
@@ -92,44 +59,114 @@ class Crawler(object):
         self.cfg: DictConfig = DictConfig(cfg)
         self.indexer = Indexer(cfg, endpoint, customer_id, corpus_id, api_key)
         self.verbose = cfg.vectara.get("verbose", False)
+        self.pdf_converter: Optional[PDFConverter] = None
 
-    def url_to_file(self, url: str, title: str) -> str:
+    def _raise_for_status(self, url: str, status_code: int, reason: str) -> None:
+        if status_code != 200:
+            if status_code == 404:
+                raise Exception(f"Error 404 - URL not found: {url}")
+            elif status_code == 401:
+                raise Exception(f"Error 403 - Unauthorized: {url}")
+            elif status_code == 403:
+                raise Exception(f"Error 403 - Access forbidden: {url}")
+            elif status_code == 405:
+                raise Exception(f"Error 405 - Method not allowed: {url}")
+            else:
+                raise Exception(
+                    f"Invalid URL: {url} (status code={status_code}, reason={reason})"
+                )
+
+    def get_pdf_converter(self) -> PDFConverter:
+        if self.pdf_converter is None:
+            self.pdf_converter = PDFConverter(
+                use_pdfkit=False,
+                max_workers=self.cfg.vectara.get("pdf_workers", 4),
+                timeout=self.cfg.vectara.get("pdf_timeout", 120),
+            )
+        return self.pdf_converter
+
+    def submit_url_to_file(self, url: str, title: str) -> Tuple[str, Future]:
         """
-        Crawl a single webpage and create a PDF file to reflect its rendered content.
+        Crawl a single webpage and queue the creation of a PDF file to reflect its rendered content.
+        If vectara.pdf_renderer is 'playwright', the page is fetched once and printed to PDF by the Indexer's
+        Chromium browser (synchronously); otherwise the URL is validated and the conversion is queued on the PDFConverter pool.
 
         Args:
             url (str): URL of the page to crawl.
             title (str): Title to use in case HTML does not have its own title.
 
         Returns:
-            str: Name of the PDF file created.
+            Tuple[str, Future]: name of the PDF file, and a Future whose result is True once the file is created successfully.
         """
+        filename = self.get_pdf_converter().tmp_path(slugify(url) + ".pdf")
+        if self.cfg.vectara.get("pdf_renderer", "wkhtmltopdf") == "playwright":
+            res = self.indexer.fetch_page_pdf(url, filename, default_title=title or '')
+            if res['status'] is None:
+                raise Exception(f"Failed to convert {url} to PDF")
+            self._raise_for_status(url, res['status'], res['reason'])
+            future: Future = Future()
+            future.set_result(True)
+            return filename, future
+
         # first verify the URL is valid
         response = requests.get(url, headers=get_headers)
-        if response.status_code != 200:
-            if response.status_code == 404:
-                raise Exception(f"Error 404 - URL not found: {url}")
-            elif response.status_code == 401:
-                raise Exception(f"Error 403 - Unauthorized: {url}")
-            elif response.status_code == 403:
-                raise Exception(f"Error 403 - Access forbidden: {url}")
-            elif response.status_code == 405:
-                raise Exception(f"Error 405 - Method not allowed: {url}")
-            else:
-                raise Exception(
-                    f"Invalid URL: {url} (status code={response.status_code}, reason={response.reason})"
-                )
+        self._raise_for_status(url, response.status_code, response.reason)
 
         if title is None or len(title)==0:
             soup = BeautifulSoup(response.text, "html.parser")
             title = str(soup.title)
 
         # convert to local file (PDF)
-        filename = slugify(url) + ".pdf"
-        if not PDFConverter(use_pdfkit=False).from_url(url, filename, title=title):
-            raise Exception(f"Failed to convert {url} to PDF")
+        return filename, self.get_pdf_converter().submit(url, filename, title=title)
+
+    def url_to_file(self, url: str, title: str) -> str:
+        """
+        Crawl a single webpage and create a PDF file to reflect its rendered content.
 
+        Args:
+            url (str): URL of the page to crawl.
+            title (str): Title to use in case HTML does not have its own title.
+
+        Returns:
+            str: Name of the PDF file created.
+        """
+        filename, future = self.submit_url_to_file(url, title)
+        if not future.result():
+            raise Exception(f"Failed to convert {url} to PDF")
         return filename
 
+    def open_checkpoint(self) -> Optional[CrawlCheckpoint]:
+        """
+        Open the crawl checkpoint store, if crawling.checkpoint_dir is configured.
+        If crawling.resume is set (see ingest.py --resume), the previous state is kept so the crawl can continue from it.
+        """
+        checkpoint_dir = self.cfg.crawling.get("checkpoint_dir", None)
+        if not checkpoint_dir:
+            return None
+        path = os.path.join(checkpoint_dir, f"{self.cfg.crawling.crawler_type}_{self.indexer.corpus_id}.db")
+        return CrawlCheckpoint(path, resume=self.cfg.crawling.get("resume", False),
+                               interval=self.cfg.crawling.get("checkpoint_interval", 60))
+
+    def make_ray_queue(self, actors: List[Any], submit: Callable[[Any, Any], Any],
+                       on_result: Optional[Callable[[Any, Any], None]] = None, **kwargs: Any) -> IndexQueue:
+        """
+        Make an IndexQueue that streams work items to Ray actors and collects their results as they complete.
+        Items still running after crawling.ray_task_timeout seconds (default 0, no timeout) are given to another actor,
+        up to crawling.ray_task_retries times. Extra kwargs are passed on to IndexQueue.
+        """
+        return IndexQueue(actors, submit, on_result or (lambda item, result: None), remote=True,
+                          timeout=self.cfg.crawling.get("ray_task_timeout", 0),
+                          max_retries=self.cfg.crawling.get("ray_task_retries", 1), **kwargs)
+
+    def open_work_queue(self) -> Optional[ShardedWorkQueue]:
+        """
+        Open the work queue shared with the other processes of a sharded crawl job, if crawling.shard_queue is configured.
+        """
+        shard_queue = self.cfg.crawling.get("shard_queue", None)
+        if not shard_queue:
+            return None
+        return ShardedWorkQueue(shard_queue, lease_seconds=self.cfg.crawling.get("shard_lease_seconds", 600),
+                                max_attempts=self.cfg.crawling.get("shard_max_attempts", 3))
+
     def crawl(self) -> None:
         raise Exception("Not implemented")
@@ -0,0 +1,196 @@
+import logging
+import re
+from typing import Collection, Dict, Iterator, List, Optional, Tuple, Union
+
+import lxml.html
+from lxml import etree
+
+# This module implements extractors of the main content of documentation pages, for the documentation systems
+# that the docs crawler knows: each one selects the article container of the page and drops navigation, sidebars,
+# footers and permalinks, with XPath expressions compiled once. Pages are parsed with lxml only (no browser,
+# no Goose/justext), and their text is split into one section per heading.
+
+HEADINGS = {'h1', 'h2', 'h3'}
+
+XPATH_NAME = re.compile(r'^[A-Za-z_][\w.-]*$')
+
+def xpath_literal(value: str) -> str:
+    """
+    Quote a string as an XPath 1.0 literal, which has no escapes: a string with both kinds of quotes is built with concat().
+    """
+    if '"' not in value:
+        return f'"{value}"'
+    if "'" not in value:
+        return f"'{value}'"
+    return 'concat(' + """, '"', """.join(f'"{part}"' for part in value.split('"')) + ')'
+
+def has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), {xpath_literal(' ' + name + ' ')})"
+
+def removal_xpaths(ids: Collection[str] = (), tags: Collection[str] = (), classes: Collection[str] = ()) -> List[str]:
+    """
+    XPaths of the elements with the given ids, tags and classes (e.g. from html_processing), which may hold any characters.
+    """
+    return ([f'//*[@id={xpath_literal(i)}]' for i in ids]
+            + [f'//{t}' if XPATH_NAME.match(t) else f'//*[name()={xpath_literal(t)}]' for t in tags]
+            + [f'//*[{has_class(c)}]' for c in classes])
+
+def parse_html(html: Union[str, bytes]) -> etree._Element:
+    """
+    Parse an HTML page with lxml, including pages that start with an XML declaration of their encoding
+    (which lxml rejects in a str). Raises etree.ParserError if the page is empty.
+    """
+    try:
+        return lxml.html.document_fromstring(html)
+    except ValueError:      # a str with an XML encoding declaration
+        return lxml.html.document_fromstring(html.encode('utf-8') if isinstance(html, str) else html)
+
+def iter_text(root: etree._Element, removed: Collection[etree._Element] = ()) -> Iterator[str]:
+    """
+    Yield the text nodes under root in document order, skipping the subtrees in removed (but not their tails),
+    so that the text on either side of a removed element stays a separate piece rather than being glued together.
+    """
+    walker = etree.iterwalk(root, events=('start', 'end', 'comment', 'pi'))
+    for event, el in walker:
+        if event == 'start':
+            if el in removed:
+                walker.skip_subtree()
+            elif el.text:
+                yield el.text
+        elif el.tail and el is not root:     # after an element, comment or processing instruction
+            yield el.tail
+
+# removed on every docs system
+COMMON_REMOVE = ['//script', '//style', '//noscript', '//template', '//nav', '//footer', '//aside',
+                 '//*[@role="navigation"]', '//*[@aria-hidden="true"]', '//button']
+
+# docs system -> (XPaths of the main content container, tried in order; XPaths of elements to drop)
+DOCS_SYSTEMS: Dict[str, Tuple[List[str], List[str]]] = {
+    'docusaurus': (
+        [f'//article//div[{has_class("theme-doc-markdown")}]', '//article', '//main'],
+        [f'//*[{has_class("theme-doc-breadcrumbs")}]', f'//*[{has_class("theme-doc-toc-mobile")}]',
+         f'//*[{has_class("theme-doc-footer")}]', f'//*[{has_class("pagination-nav")}]', f'//a[{has_class("hash-link")}]'],
+    ),
+    'sphinx': (
+        ['//div[@role="main"]', f'//div[{has_class("body")}]', f'//div[{has_class("document")}]'],
+        [f'//a[{has_class("headerlink")}]', f'//div[{has_class("sphinxsidebar")}]', f'//div[{has_class("related")}]',
+         f'//div[{has_class("footer")}]'],
+    ),
+    'readthedocs': (
+        ['//div[@itemprop="articleBody"]', '//div[@role="main"]', f'//div[{has_class("body")}]'],
+        [f'//a[{has_class("headerlink")}]', f'//div[{has_class("wy-nav-side")}]', f'//div[{has_class("wy-breadcrumbs")}]',
+         f'//div[{has_class("rst-footer-buttons")}]', f'//div[{has_class("rst-versions")}]'],
+    ),
+    'mkdocs': (
+        [f'//article[{has_class("md-content__inner")}]', '//div[@role="main"]', '//main'],
+        [f'//a[{has_class("headerlink")}]', f'//*[{has_class("md-sidebar")}]', f'//*[{has_class("md-footer")}]',
+         f'//*[{has_class("md-source-file")}]', f'//*[{has_class("md-content__button")}]'],
+    ),
+    'javadoc': (
+        ['//main', f'//div[{has_class("contentContainer")}]'],
+        [f'//div[{has_class("top-nav")}]', f'//div[{has_class("sub-nav")}]', f'//div[{has_class("subNav")}]',
+         f'//div[{has_class("topNav")}]', f'//div[{has_class("bottomNav")}]'],
+    ),
+    'hugo': (
+        ['//main//article', '//article', '//main', '//div[@role="main"]'],
+        [f'//*[{has_class("td-sidebar")}]', f'//*[{has_class("td-toc")}]', f'//*[{has_class("breadcrumb")}]'],
+    ),
+    'jekyll': (
+        ['//main//article', '//article', '//main', f'//div[{has_class("main-content")}]'],
+        [f'//*[{has_class("side-bar")}]', f'//*[{has_class("anchor-heading")}]', f'//*[{has_class("breadcrumb-nav")}]'],
+    ),
+}
+
+class DocsExtractor:
+    """
+    Extracts the main content of pages generated by one documentation system.
+
+    Args:
+        content_xpaths (list): XPaths of the main content container; the first one that matches is used.
+        remove_xpaths (list): XPaths of elements (navigation, sidebars, permalinks...) dropped from the page.
+        name (str): name of the documentation system, for logging.
+    """
+    def __init__(self, content_xpaths: List[str], remove_xpaths: List[str], name: str = 'custom'):
+        self.name = name
+        self.content_xpaths = content_xpaths
+        self.remove_xpaths = COMMON_REMOVE + remove_xpaths
+        self._compile()
+
+    def _compile(self) -> None:
+        self.content = [etree.XPath(x) for x in self.content_xpaths]
+        self.remove = etree.XPath(' | '.join(self.remove_xpaths))
+        self.extra_remove: Dict[tuple, Optional[etree.XPath]] = {}
+
+    def _extra_remove(self, remove_code: bool, html_processing: dict) -> Optional[etree.XPath]:
+        # compiled once per distinct html_processing setting
+        key = (remove_code, tuple(html_processing.get('ids_to_remove', [])), tuple(html_processing.get('tags_to_remove', [])),
+               tuple(html_processing.get('classes_to_remove', [])))
+        if key not in self.extra_remove:
+            xpaths = ['//code'] if remove_code else []
+            xpaths += removal_xpaths(key[1], key[2], key[3])
+            self.extra_remove[key] = etree.XPath(' | '.join(xpaths)) if xpaths else None
+        return self.extra_remove[key]
+
+    def extract(self, html: str, remove_code: bool = False, html_processing: dict = {}) -> Optional[Tuple[str, List[str], List[str]]]:
+        """
+        Return (title, section titles, section texts) of the page, with one section per heading (the text before
+        the first heading is a section with an empty title), or None if the page has no main content container.
+        """
+        try:
+            doc = parse_html(html)
+        except Exception as e:
+            logging.info(f"Failed to parse page with the {self.name} extractor: {e}")
+            return None
+        container = next((found[0] for xpath in self.content for found in [xpath(doc)] if found), None)
+        if container is None:
+            return None
+        page_title = (doc.findtext('.//title') or '').strip()
+
+        # removed elements are skipped rather than dropped from the tree, which would glue the text around them
+        extra_remove = self._extra_remove(remove_code, html_processing)
+        removed = set(self.remove(container) + (extra_remove(container) if extra_remove is not None else []))
+        removed.discard(container)
+
+        # one pass over the container, in document order, starting a new section at each heading
+        titles: List[str] = ['']
+        sections: List[List[str]] = [[]]
+        walker = etree.iterwalk(container, events=('start', 'end', 'comment', 'pi'))
+        for event, el in walker:
+            if event == 'start':
+                if el in removed:
+                    walker.skip_subtree()
+                elif el.tag in HEADINGS:
+                    titles.append(' '.join(' '.join(iter_text(el, removed)).split()))
+                    sections.append([])
+                    walker.skip_subtree()
+                elif el.text:
+                    sections[-1].append(el.text)
+            elif el.tail and el is not container:
+                sections[-1].append(el.tail)
+
+        texts = [' '.join(' '.join(parts).split()) for parts in sections]
+        result = [(t, s) for t, s in zip(titles, texts) if s]
+        if not result:
+            return None
+        title = next((t for t in titles if t), page_title)
+        return title, [t for t, _ in result], [s for _, s in result]
+
+    def __getstate__(self) -> dict:
+        # compiled XPaths can't be pickled (e.g. for Ray actors), so they are compiled again
+        return {'name': self.name, 'content_xpaths': self.content_xpaths, 'remove_xpaths': self.remove_xpaths}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._compile()
+
+def get_docs_extractor(docs_system: str, content_xpaths: Optional[List[str]] = None,
+                       remove_xpaths: Optional[List[str]] = None) -> Optional[DocsExtractor]:
+    """
+    Return the extractor for a documentation system, or None if it is not a known one and no XPaths are given.
+    content_xpaths and remove_xpaths, if given, replace and extend those of the documentation system respectively.
+    """
+    known_content, known_remove = DOCS_SYSTEMS.get(docs_system.lower(), ([], []))
+    content_xpaths = list(content_xpaths) if content_xpaths else known_content
+    if not content_xpaths:
+        return None
+    return DocsExtractor(content_xpaths, known_remove + list(remove_xpaths or []), name=docs_system)
@@ -0,0 +1,354 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+import lxml.html
+
+from core.canonical import UrlCanonicalizer
+from core.checkpoint import CrawlCheckpoint
+from core.host_scheduler import HostScheduler
+from core.robots import RobotsCache
+from core.revalidation import ValidatorStore
+from core.indexer import Indexer, get_headers
+from core.utils import img_extensions, doc_extensions, archive_extensions, create_session_with_retries
+from core.url_set import UrlSet
+from core.url_filter import UrlFilter
+
+MAX_HTML_SIZE = 20 * 1024 * 1024    # don't parse links out of pages larger than this
+
+def url_is_relative(url: str) -> bool:
+    parsed_url = urlparse(url)
+    return not parsed_url.scheme and not parsed_url.netloc
+
+def extract_links(html: Any, base_url: str) -> List[str]:
+    """
+    Extract all (absolute) link targets from raw HTML (or an already parsed lxml document).
+    """
+    if isinstance(html, (str, bytes)):
+        try:
+            doc = lxml.html.fromstring(html)
+        except Exception:
+            return []
+    else:
+        doc = html
+    base = doc.xpath('//base/@href')
+    if base:
+        base_url = urljoin(base_url, base[0])
+    return [urljoin(base_url, href.strip()) for href in doc.xpath('//a/@href')]
+
+class FrontierCrawler:
+    """
+    Iterative breadth-first crawler, used to discover the pages of a website.
+
+    Pages are fetched by a pool of `num_fetchers` threads that download the raw HTML and extract links from it.
+    Pages whose raw HTML has no links (typically JS-rendered apps) are rendered with the Indexer's playwright browser
+    instead (on the calling thread, since playwright is not thread-safe). With render_js='always' every page is rendered,
+    and with render_js='never' pages are never rendered.
+
+    Politeness: each host gets at most `max_host_connections` concurrent requests, at least `min_host_delay` seconds apart
+    (and at most `max_host_rate` per second). If a RobotsCache is given, URLs disallowed by robots.txt are skipped and
+    the host's Crawl-delay is honored.
+    The crawl stops following links at `max_depth` hops from the seed URLs, or once `max_pages` URLs were collected (0 = no limit).
+
+    If a checkpoint is given, the visited set and frontier are saved to it periodically, and a crawl of the same seeds
+    resumes from the saved state.
+
+    If a canonicalizer is given, all URLs are canonicalized before they are checked against the visited set, and
+    each fetched page is resolved to its canonical URL (following redirects and <link rel="canonical">). Pages that
+    turn out to be aliases of an already collected page are dropped, so each page is collected only once.
+    Without a canonicalizer, a normalize function (e.g. one that removes fragments and query strings) can be given
+    instead, which is applied to all URLs before they are checked against the visited set.
+
+    If a page_fn is given, it is used to fetch every collected page (including pages at max_depth and document files)
+    instead of the built-in fetchers: it gets a URL and returns the page's links and its canonical URL. This lets a
+    caller index each page from the same fetch that discovers its links. page_fn is called from the fetcher threads
+    if page_fn_threadsafe is True, and from the calling thread otherwise (e.g. if it uses the Indexer's playwright browser).
+
+    If a ValidatorStore is given, pages are fetched with conditional requests, and for pages that did not change since
+    the previous run (304 Not Modified), the links saved in the store are used instead.
+
+    If on_collect is given, it is called (from the calling thread) with each collected URL and its link depth from the
+    seeds, so that a caller can start processing URLs while the crawl continues: once the page was fetched (and is
+    known not to be an alias), or right away for pages whose links are not followed. When resuming from a checkpoint,
+    it is first called with every URL collected before the interruption (with depth None).
+
+    Args:
+        indexer (Indexer): the indexer, used for rendering pages with playwright.
+        pos_regex (list): compiled regexes; if not empty, links must match one of them.
+        neg_regex (list): compiled regexes; links matching any of them are ignored.
+    """
+    def __init__(self, indexer: Indexer, pos_regex: List[Any], neg_regex: List[Any],
+                 max_depth: int = 3, max_pages: int = 0, num_fetchers: int = 8,
+                 max_host_connections: int = 4, min_host_delay: float = 0.0, max_host_rate: float = 0.0,
+                 render_js: str = 'auto', verbose: bool = False, checkpoint: Optional[CrawlCheckpoint] = None,
+                 canonicalizer: Optional[UrlCanonicalizer] = None, robots: Optional[RobotsCache] = None,
+                 page_fn: Optional[Callable[[str], Tuple[List[str], str]]] = None, page_fn_threadsafe: bool = False,
+                 on_collect: Optional[Callable[[str, Optional[int]], None]] = None,
+                 validators: Optional[ValidatorStore] = None, normalize: Optional[Callable[[str], str]] = None):
+        self.indexer = indexer
+        self.url_filter = UrlFilter(pos_regex, neg_regex)
+        self.skip_extensions = tuple(archive_extensions + img_extensions)
+        self.doc_extensions = tuple(doc_extensions)
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.num_fetchers = max(num_fetchers, 1)
+        self.robots = robots
+        self.scheduler = HostScheduler(robots, max_host_connections, max_host_rate, min_host_delay)
+        self.render_js = render_js
+        self.verbose = verbose
+        self.checkpoint = checkpoint
+        self.canonicalizer = canonicalizer
+        self.normalize = normalize
+        self.page_fn = page_fn
+        self.page_fn_threadsafe = page_fn_threadsafe
+        self.on_collect = on_collect
+        self.validators = validators
+        self.timeout = indexer.timeout
+        self.thread_local = threading.local()
+
+        self.visited = UrlSet()
+        self.aliases = UrlSet() if canonicalizer else None
+        self.host_queues: Dict[str, deque] = OrderedDict()
+        self.unsaved_visited: List[str] = []
+
+    def _session(self):
+        if not hasattr(self.thread_local, 'session'):
+            self.thread_local.session = create_session_with_retries(retries=2)
+        return self.thread_local.session
+
+    def _limit_reached(self) -> bool:
+        return self.max_pages > 0 and len(self.visited) >= self.max_pages
+
+    def _accept(self, url: str) -> bool:
+        if not self.url_filter.accept(url) or url in self.visited:
+            return False
+        if self.robots and not self.robots.allowed(url):
+            logging.debug(f"Skipping {url}: disallowed by robots.txt")
+            return False
+        return True
+
+    def _add(self, url: str, depth: int) -> None:
+        """
+        Add a URL to the collected set, and queue it for link extraction if needed.
+        """
+        # For archive or image - we don't extract links from them, nor are they included in the crawled URLs list
+        url_without_fragment = url.split("#")[0]
+        if url_without_fragment.endswith(self.skip_extensions):
+            return
+        self.visited.add(url)
+        if self.checkpoint:
+            self.unsaved_visited.append(url)
+
+        # for document files (like PPT, DOCX, etc) we don't extract links from the URL, but the link itself is included.
+        # if we reached the maximum depth we don't extract links either.
+        # (with a page_fn, all pages are fetched since page_fn also indexes them)
+        if self.page_fn is None and (depth <= 0 or url_without_fragment.endswith(self.doc_extensions)):
+            if self.on_collect:
+                self.on_collect(url, self.max_depth - depth)
+            return
+        self._enqueue(url, depth)
+
+    def _enqueue(self, url: str, depth: int) -> None:
+        host = urlparse(url).netloc
+        if host not in self.host_queues:
+            self.host_queues[host] = deque()
+        self.host_queues[host].append((url, depth))
+
+    def _next_ready(self) -> Optional[Tuple[str, int]]:
+        """
+        Pick the next URL to fetch, round-robin over hosts that are within their politeness budget.
+        """
+        for host in list(self.host_queues.keys()):
+            queue = self.host_queues[host]
+            if len(queue) == 0:
+                del self.host_queues[host]
+                continue
+            if not self.scheduler.try_acquire(queue[0][0]):
+                continue
+            # move host to the end, so that hosts are interleaved
+            self.host_queues.move_to_end(host)
+            return queue.popleft()
+        return None
+
+    def _canonical_links(self, links: List[str]) -> List[str]:
+        if self.canonicalizer is not None:
+            return [self.canonicalizer.canonicalize(link) if link.startswith('http') else link for link in links]
+        if self.normalize is not None:
+            return [self.normalize(link) if link.startswith('http') else link for link in links]
+        return links
+
+    def _fetch_links(self, url: str) -> Optional[Tuple[List[str], str]]:
+        """
+        Download a page and extract its links from the raw HTML.
+        Returns the links and the canonical URL of the page, or None if the page needs to be rendered with a browser
+        to find its links.
+        """
+        if self.page_fn is not None:
+            return self._page_links(url) if self.page_fn_threadsafe else None
+        if self.render_js == 'always':
+            return None
+        try:
+            headers = {**get_headers, **self.validators.conditional_headers(url)} if self.validators else get_headers
+            # closed on every path, so that a partly read stream does not keep its pooled connection busy
+            with self._session().get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+                if response.status_code == 304 and self.validators and self.validators.not_modified(url):
+                    links = self.validators.links(url)
+                    if links is None:
+                        return ([], url) if self.render_js == 'never' else None
+                    return self._canonical_links(links), self.validators.page_url(url)
+                content_type = response.headers.get('Content-Type', '')
+                if response.status_code != 200 or 'html' not in content_type:
+                    if response.status_code == 200 and self.validators:
+                        self.validators.record(url, response, links=[])
+                    return [], url
+                html = response.raw.read(MAX_HTML_SIZE, decode_content=True)
+                try:
+                    doc = lxml.html.fromstring(html)
+                except Exception:
+                    doc = None
+                links = extract_links(doc, response.url) if doc is not None else []
+                page_url = self.canonicalizer.resolve(url, response.url, doc) if self.canonicalizer else url
+                if self.validators:
+                    # pages that need rendering to find their links are saved without links
+                    saved_links = links if len(links) > 0 or self.render_js == 'never' else None
+                    self.validators.record(url, response, size=len(html), links=saved_links, page_url=page_url)
+        except Exception as e:
+            logging.info(f"Failed to fetch {url} for link extraction ({e})")
+            return [], url
+        if len(links) == 0 and self.render_js == 'auto':
+            return None
+        return self._canonical_links(links), page_url
+
+    def _page_links(self, url: str) -> Tuple[List[str], str]:
+        try:
+            links, page_url = self.page_fn(url)
+        except Exception as e:
+            logging.error(f"Error {e} processing {url}")
+            return [], url
+        links = [urljoin(url, u) if url_is_relative(u) else u for u in links]
+        return self._canonical_links(links), page_url
+
+    def _render_links(self, url: str) -> Tuple[List[str], str]:
+        if self.page_fn is not None:
+            return self._page_links(url)
+        res = self.indexer.fetch_page_contents(url)
+        links = [urljoin(url, u) if url_is_relative(u) else u for u in res['links']]
+        page_url = self.canonicalizer.resolve(url, res['url'], res['html']) if self.canonicalizer else url
+        return self._canonical_links(links), page_url
+
+    def _is_alias(self, url: str, canonical: str, depth: int) -> bool:
+        """
+        Record that the page fetched from url has a different canonical URL.
+        Returns True if the canonical page was already collected, so this page is a duplicate.
+        """
+        if not self.url_filter.accept(canonical):
+            return False    # keep the page under the URL we found it at
+        self.aliases.add(url)
+        if canonical in self.visited:
+            return True
+        self.visited.add(canonical)
+        if self.checkpoint:
+            self.unsaved_visited.append(canonical)
+        if self.on_collect:
+            self.on_collect(canonical, self.max_depth - depth)
+        return False
+
+    def _save_checkpoint(self, key: str, in_flight: Dict[Any, Tuple[str, int]]) -> None:
+        self.checkpoint.add_visited(key, self.unsaved_visited)
+        self.unsaved_visited = []
+        frontier = list(in_flight.values()) + [item for queue in self.host_queues.values() for item in queue]
+        self.checkpoint.save_frontier(key, frontier)
+
+    def crawl(self, seeds: List[str]) -> UrlSet:
+        """
+        Crawl from the seed URLs, and return the set of all URLs collected.
+        """
+        key = ' '.join(seeds)
+        state = self.checkpoint.load_frontier(key) if self.checkpoint else None
+        if state:
+            visited, frontier = state
+            self.visited.update(visited)
+            for url, depth in frontier:
+                self._enqueue(url, depth)
+            logging.info(f"Resuming crawl of {key} with {len(visited)} URLs collected and {len(frontier)} in the frontier")
+            if self.on_collect:
+                for url in visited:
+                    self.on_collect(url, None)
+        else:
+            for url in self._canonical_links(seeds):
+                if self.robots and not self.robots.allowed(url):
+                    logging.warning(f"Not crawling {url}: disallowed by robots.txt")
+                    continue
+                self._add(url, self.max_depth)
+
+        in_flight: Dict[Any, Tuple[str, int]] = {}
+        with ThreadPoolExecutor(max_workers=self.num_fetchers) as executor:
+            while len(in_flight) > 0 or len(self.host_queues) > 0:
+                while len(in_flight) < self.num_fetchers and not self._limit_reached():
+                    item = self._next_ready()
+                    if item is None:
+                        break
+                    in_flight[executor.submit(self._fetch_links, item[0])] = item
+
+                if len(in_flight) == 0:
+                    if self._limit_reached():
+                        break
+                    time.sleep(0.05)    # all hosts with queued URLs are waiting for their politeness delay
+                    continue
+
+                done, _ = wait(list(in_flight.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    url, depth = in_flight.pop(future)
+                    result = future.result()
+                    if result is None:
+                        try:
+                            result = self._render_links(url)
+                        except Exception as e:
+                            logging.error(f"Error {e} rendering {url} for link extraction")
+                            result = [], url
+                    self.scheduler.release(url)
+                    links, page_url = result
+                    if page_url != url and self._is_alias(url, page_url, depth):
+                        logging.info(f"Skipping {url}: duplicate of {page_url}")
+                        continue
+                    if self.on_collect and not (self.aliases is not None and url in self.aliases):
+                        self.on_collect(url, self.max_depth - depth)
+                    if depth <= 0 or url.split("#")[0].endswith(self.doc_extensions):
+                        continue
+
+                    n_before = len(self.visited)
+                    for link in set(links):
+                        if self._limit_reached():
+                            break
+                        if self._accept(link):
+                            self._add(link, depth-1)
+                    if len(self.visited) > n_before:
+                        logging.info(f"collected {len(self.visited)} URLs so far")
+                        if self.verbose:
+                            print(f"URLs so far: {list(self.visited)}")
+
+                if self.checkpoint and self.checkpoint.due():
+                    self._save_checkpoint(key, in_flight)
+
+        if self.checkpoint:
+            self.checkpoint.add_visited(key, self.unsaved_visited)
+            self.unsaved_visited = []
+            self.checkpoint.set_discovery_done(key)
+        if self.on_collect:
+            # URLs that were collected but not fetched, since max_pages was reached
+            for queue in self.host_queues.values():
+                for url, depth in queue:
+                    self.on_collect(url, self.max_depth - depth)
+
+        if self._limit_reached():
+            logging.info(f"Stopped crawling after reaching max_pages={self.max_pages}")
+        if self.aliases is not None and len(self.aliases) > 0:
+            logging.info(f"Dropping {len(self.aliases)} URLs that redirect to, or declare, another canonical URL")
+            canonical = UrlSet(u for u in self.visited if u not in self.aliases)
+            self.visited.close()
+            self.visited = canonical
+        return self.visited
@@ -0,0 +1,162 @@
+import logging
+import time
+from collections import deque
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+# Circuit states for a host
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class HostState:
+    """
+    Health information tracked for a single host.
+    """
+    def __init__(self, window: int):
+        self.load_times: deque = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.total_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.cooldown = 0.0
+        self.times_opened = 0
+        self.skipped = 0
+
+class HostHealth:
+    """
+    Track per-host page load health, so that a slow or dead host does not stall a crawl.
+
+    - Navigation timeouts are learned per host from the p95 of recent successful load times,
+      and clamped to the range [min_timeout, max_timeout].
+    - After `failure_threshold` consecutive failures the host's circuit opens, and requests to
+      that host are refused for `cooldown` seconds.
+    - Once the cooldown expires, a single probe request is allowed (half-open). If it succeeds the
+      circuit closes; if it fails the circuit opens again with a doubled cooldown.
+
+    Note: this class is not thread-safe; it is meant to be used alongside the (single threaded) browser.
+    """
+    def __init__(self, max_timeout: float = 90, min_timeout: float = 10, failure_threshold: int = 5,
+                 cooldown: float = 300, timeout_multiplier: float = 3.0, min_samples: int = 10,
+                 window: int = 100, adaptive_timeout: bool = True):
+        self.max_timeout = max_timeout
+        self.min_timeout = min(min_timeout, max_timeout)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.timeout_multiplier = timeout_multiplier
+        self.min_samples = min_samples
+        self.window = window
+        self.adaptive_timeout = adaptive_timeout
+        self.hosts: Dict[str, HostState] = {}
+
+    @staticmethod
+    def host_of(url: str) -> str:
+        return urlparse(url).netloc.lower()
+
+    def _state(self, url: str) -> HostState:
+        host = self.host_of(url)
+        if host not in self.hosts:
+            self.hosts[host] = HostState(self.window)
+        return self.hosts[host]
+
+    def timeout_for(self, url: str) -> float:
+        """
+        Return the navigation timeout (in seconds) to use for this URL, based on the host's history.
+        """
+        hs = self._state(url)
+        if not self.adaptive_timeout or len(hs.load_times) < self.min_samples:
+            return self.max_timeout
+        samples = sorted(hs.load_times)
+        p95 = samples[min(len(samples)-1, int(0.95 * len(samples)))]
+        return max(self.min_timeout, min(self.max_timeout, p95 * self.timeout_multiplier))
+
+    def is_open(self, url: str) -> bool:
+        """
+        True if the circuit for this URL's host is open and still cooling down.
+        Does not change state, so it can be used to decide whether to defer a URL.
+        """
+        hs = self._state(url)
+        return hs.state == OPEN and time.time() - hs.opened_at < hs.cooldown
+
+    def allow_request(self, url: str) -> bool:
+        """
+        Decide whether a request to this URL's host should be attempted now.
+        An open circuit past its cooldown moves to half-open and allows a single probe.
+        """
+        hs = self._state(url)
+        if hs.state == CLOSED:
+            return True
+        if hs.state == OPEN and time.time() - hs.opened_at >= hs.cooldown:
+            hs.state = HALF_OPEN
+            logging.info(f"Host {self.host_of(url)} is half-open, probing with {url}")
+            return True
+        hs.skipped += 1
+        return False
+
+    def record_skip(self, url: str) -> None:
+        self._state(url).skipped += 1
+
+    def record_success(self, url: str, load_time: float) -> None:
+        hs = self._state(url)
+        hs.load_times.append(load_time)
+        hs.consecutive_failures = 0
+        if hs.state != CLOSED:
+            logging.info(f"Host {self.host_of(url)} recovered, closing circuit")
+            hs.state = CLOSED
+            hs.cooldown = 0.0
+
+    def record_failure(self, url: str) -> None:
+        hs = self._state(url)
+        hs.consecutive_failures += 1
+        hs.total_failures += 1
+        if hs.state == HALF_OPEN:
+            self._open(url, hs, hs.cooldown * 2)
+        elif hs.state == CLOSED and hs.consecutive_failures >= self.failure_threshold:
+            self._open(url, hs, self.cooldown)
+
+    def _open(self, url: str, hs: HostState, cooldown: float) -> None:
+        hs.state = OPEN
+        hs.opened_at = time.time()
+        hs.cooldown = cooldown
+        hs.times_opened += 1
+        logging.warning(f"Host {self.host_of(url)} failed {hs.consecutive_failures} consecutive times, "
+                        f"opening circuit for {cooldown:.0f} seconds")
+
+    def tripped_hosts(self) -> List[Dict]:
+        """
+        Return a summary of all hosts whose circuit was opened at least once during the crawl.
+        """
+        return [
+            {'host': host, 'state': hs.state, 'times_opened': hs.times_opened,
+             'failures': hs.total_failures, 'skipped': hs.skipped}
+            for host, hs in self.hosts.items() if hs.times_opened > 0
+        ]
+
+    def report(self, tripped: Optional[List[Dict]] = None) -> None:
+        """
+        Log the hosts that were tripped during the crawl.
+        """
+        tripped = self.tripped_hosts() if tripped is None else tripped
+        if len(tripped) == 0:
+            return
+        logging.info(f"{len(tripped)} host(s) had their circuit opened during this crawl:")
+        for t in tripped:
+            logging.info(f"  {t['host']}: state={t['state']}, opened {t['times_opened']} times, "
+                         f"{t['failures']} failures, {t['skipped']} URLs skipped")
+
+def merge_host_reports(reports: List[List[Dict]]) -> List[Dict]:
+    """
+    Merge the tripped-host reports of several workers (e.g. Ray actors) into a single report.
+    """
+    merged: Dict[str, Dict] = {}
+    for report in reports:
+        for t in report:
+            if t['host'] not in merged:
+                merged[t['host']] = dict(t)
+            else:
+                m = merged[t['host']]
+                for k in ['times_opened', 'failures', 'skipped']:
+                    m[k] += t[k]
+                if t['state'] != CLOSED:
+                    m['state'] = t['state']
+    return list(merged.values())
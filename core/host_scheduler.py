@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import urlparse
+
+from core.robots import RobotsCache
+
+POLL_INTERVAL = 0.1     # seconds between retries of a shared scheduler whose host has no free connection
+
+def interleave_by_host(urls: List[str]) -> List[str]:
+    """
+    Reorder URLs round-robin over their hosts (keeping the order within each host), so that consecutive
+    requests go to different hosts and per-host delays overlap instead of adding up.
+    """
+    by_host: Dict[str, List[str]] = OrderedDict()
+    for url in urls:
+        by_host.setdefault(urlparse(url).netloc, []).append(url)
+    queues = list(by_host.values())
+    interleaved = []
+    for i in range(max((len(q) for q in queues), default=0)):
+        interleaved.extend(q[i] for q in queues if i < len(q))
+    return interleaved
+
+class HostScheduler:
+    """
+    Per-host politeness budget: each host gets at most `max_host_connections` concurrent requests, spaced at least
+    `delay` seconds apart, where the delay is the largest of min_host_delay, 1/max_host_rate and the host's robots.txt
+    Crawl-delay (if a RobotsCache is given). Hosts have independent budgets, so crawling many hosts is not slowed down
+    by the strictest one.
+
+    Use try_acquire()/release() from a dispatcher loop, or the blocking slot() context manager from worker threads.
+    With Ray, call share() so that all the actors that get a copy of the scheduler draw from the same per-host budgets.
+
+    Args:
+        robots (RobotsCache): if given, robots.txt Crawl-delay is honored.
+        max_host_connections (int): maximum concurrent requests per host.
+        max_host_rate (float): maximum requests per second per host (0 for no limit).
+        min_host_delay (float): minimum seconds between requests to the same host.
+    """
+    def __init__(self, robots: Optional[RobotsCache] = None, max_host_connections: int = 4,
+                 max_host_rate: float = 0.0, min_host_delay: float = 0.0):
+        self.robots = robots
+        self.max_host_connections = max(max_host_connections, 1)
+        self.min_delay = max(min_host_delay, 1.0 / max_host_rate if max_host_rate > 0 else 0.0)
+        self.active: Dict[str, int] = {}
+        self.next_time: Dict[str, float] = {}
+        self.delays: Dict[str, float] = {}
+        self.cond = threading.Condition()
+        self.backend = None
+
+    def share(self) -> None:
+        """
+        Move the per-host budgets to a Ray actor shared by all copies of this scheduler (ray must be initialized).
+        """
+        import ray
+        # threaded, so that fetching one host's robots.txt does not hold up requests to the others
+        self.backend = ray.remote(num_cpus=0, max_concurrency=16)(HostScheduler).remote(
+            self.robots, self.max_host_connections, min_host_delay=self.min_delay)
+
+    def delay_for(self, url: str) -> float:
+        host = urlparse(url).netloc
+        delay = self.delays.get(host)
+        if delay is None:
+            delay = max(self.min_delay, self.robots.crawl_delay(url) if self.robots else 0.0)
+            self.delays[host] = delay
+        return delay
+
+    def _ready(self, host: str, now: float) -> bool:
+        return self.active.get(host, 0) < self.max_host_connections and self.next_time.get(host, 0) <= now
+
+    def reserve(self, url: str) -> float:
+        """
+        Take a request slot for this URL's host if one is available now, without blocking. Returns 0 if the slot
+        was taken, or else the number of seconds to wait before trying again.
+        """
+        host = urlparse(url).netloc
+        delay = self.delay_for(url)
+        with self.cond:
+            now = time.time()
+            if not self._ready(host, now):
+                if self.active.get(host, 0) >= self.max_host_connections:
+                    return POLL_INTERVAL
+                return max(self.next_time[host] - now, 1e-3)
+            self.active[host] = self.active.get(host, 0) + 1
+            self.next_time[host] = now + delay
+            return 0.0
+
+    def try_acquire(self, url: str) -> bool:
+        """
+        Take a request slot for this URL's host if one is available now, without blocking.
+        """
+        if self.backend is not None:
+            import ray
+            return ray.get(self.backend.reserve.remote(url)) == 0
+        return self.reserve(url) == 0
+
+    def release(self, url: str) -> None:
+        if self.backend is not None:
+            self.backend.release.remote(url)
+            return
+        host = urlparse(url).netloc
+        with self.cond:
+            self.active[host] -= 1
+            self.cond.notify_all()
+
+    @contextmanager
+    def slot(self, url: str) -> Iterator[None]:
+        """
+        Block until this URL's host has budget for another request, and hold the slot while the request runs.
+        """
+        if self.backend is not None:
+            import ray
+            while True:
+                wait = ray.get(self.backend.reserve.remote(url))
+                if wait == 0:
+                    break
+                time.sleep(wait)
+            try:
+                yield
+            finally:
+                self.release(url)
+            return
+        host = urlparse(url).netloc
+        delay = self.delay_for(url)
+        with self.cond:
+            while True:
+                now = time.time()
+                if self._ready(host, now):
+                    break
+                if self.active.get(host, 0) >= self.max_host_connections:
+                    self.cond.wait()
+                else:
+                    self.cond.wait(timeout=self.next_time[host] - now)
+            self.active[host] = self.active.get(host, 0) + 1
+            self.next_time[host] = now + delay
+        try:
+            yield
+        finally:
+            self.release(url)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state['cond']
+        state['active'] = {}
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.cond = threading.Condition()
@@ -0,0 +1,116 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+from lxml import etree
+
+from core.docs_extract import parse_html
+
+def decode_html(content: bytes) -> str:
+    """
+    Decode the raw bytes of an HTML page: as UTF-8 if they are valid UTF-8, and otherwise with the charset declared
+    in the page (which lxml reads from its <meta> tags), since without a charset HTTP defaults to ISO-8859-1,
+    which turns UTF-8 pages into mojibake.
+    """
+    try:
+        return content.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        pass
+    try:
+        encoding = parse_html(content).getroottree().docinfo.encoding or 'windows-1252'
+    except (etree.ParserError, ValueError):
+        encoding = 'windows-1252'
+    try:
+        return content.decode(encoding, 'replace')
+    except LookupError:     # an unknown charset
+        return content.decode('windows-1252', 'replace')
+
+class HtmlCache:
+    """
+    Bounded on-disk cache of the raw HTML of pages, so that a page downloaded while discovering URLs can be indexed
+    without fetching it again.
+
+    Pages are written by one process (the crawler), and read and discarded by the indexing workers (which may be
+    Ray actors on the same node, or on other nodes if `directory` is on shared storage). Once the cache holds more
+    than `max_bytes`, the oldest pages are evicted; a worker that misses a page fetches it again.
+
+    Args:
+        directory (str): folder for the cached pages; a temporary folder (removed by close()) if None.
+        max_bytes (int): maximum total size of the cached pages.
+    """
+    def __init__(self, directory: Optional[str] = None, max_bytes: int = 1 << 30):
+        self.temporary = directory is None
+        self.directory = tempfile.mkdtemp(prefix='html_cache_') if directory is None else directory
+        os.makedirs(self.directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.entries: Deque[Tuple[str, int]] = deque()      # (path, size), oldest first
+        self.size = 0
+        self.stats = {'stored': 0, 'evicted': 0}
+        self.lock = threading.Lock()
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.html')
+
+    def put(self, url: str, content: bytes) -> None:
+        """
+        Save the raw bytes of a page (they are decoded by get()).
+        """
+        data = content
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(url)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)      # readers never see a partial page
+        with self.lock:
+            self.entries.append((path, len(data)))
+            self.size += len(data)
+            self.stats['stored'] += 1
+            while self.size > self.max_bytes and self.entries:
+                old_path, old_size = self.entries.popleft()
+                self.size -= old_size
+                if old_path != path and os.path.exists(old_path):
+                    os.remove(old_path)
+                    self.stats['evicted'] += 1
+
+    def get(self, url: str) -> Optional[str]:
+        """
+        Return the cached HTML of this URL, decoded, or None if it is not in the cache.
+        """
+        try:
+            with open(self._path(url), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        return decode_html(data)
+
+    def discard(self, url: str) -> None:
+        """
+        Remove a page that is no longer needed (e.g. once it was indexed).
+        """
+        try:
+            os.remove(self._path(url))
+        except OSError:
+            pass
+
+    def close(self) -> None:
+        logging.info(f"HTML cache: stored {self.stats['stored']} pages, evicted {self.stats['evicted']} before they were indexed")
+        if self.temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __getstate__(self) -> dict:
+        # workers only read and discard pages, so they don't need the eviction queue
+        state = self.__dict__.copy()
+        del state['lock']
+        state['entries'] = deque()
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
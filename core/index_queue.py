@@ -0,0 +1,169 @@
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+class IndexQueue:
+    """
+    Streams URLs (or other work items) to index workers as soon as they are discovered, instead of waiting for
+    discovery to complete, and hands back results as they complete, in any order.
+
+    put() queues an item for a free worker. When `max_pending` items are queued or in flight, put() blocks until one
+    finishes, so discovery slows down to the pace of indexing instead of buffering items.
+    Results are passed to on_result() on the thread that calls put()/join(), so callers need no locking.
+
+    Workers are either Ray actors (remote=True), in which case submit(worker, item) must return an ObjectRef,
+    or local objects, in which case submit(worker, item) runs the work synchronously and returns its result.
+
+    With Ray, each actor is given one item at a time, and the others wait in the queue, so an actor stuck on a slow
+    item never holds up items that another actor could take. With `host_of`, queued items are grouped by host, and
+    a free actor takes an item from the host with the fewest items in flight, so a slow host does not take up the
+    whole pool while other hosts have work. An item still running after `timeout` seconds is given to another actor
+    (up to `max_retries` times), since the actor may be stuck; the result of the timed out attempt is ignored, except
+    for the results of other items it carries (a list of (item, result) pairs, like the PDFs that finished converting
+    in the meantime, see PageCrawlWorker.process), which are still passed to on_result().
+
+    Args:
+        workers (list): Ray actor handles or local worker objects.
+        submit (callable): submit(worker, item) starts processing item on the worker.
+        on_result (callable): on_result(item, result) is called with each finished result.
+        remote (bool): whether workers are Ray actors.
+        max_pending (int): maximum number of items queued or in flight (Ray only); defaults to twice the number of workers.
+        timeout (float): seconds after which an item in flight is given to another actor (Ray only); 0 for no timeout.
+        max_retries (int): maximum number of times an item is given to another actor after a timeout.
+        host_of (callable): host_of(item) returns the host of an item, to spread work across hosts.
+        label (callable): label(item) returns how the item is named in the logs.
+    """
+    def __init__(self, workers: List[Any], submit: Callable[[Any, Any], Any], on_result: Callable[[Any, Any], None],
+                 remote: bool = False, max_pending: Optional[int] = None, timeout: float = 0, max_retries: int = 1,
+                 host_of: Optional[Callable[[Any], str]] = None, label: Callable[[Any], str] = str):
+        self.workers = workers
+        self.submit = submit
+        self.on_result = on_result
+        self.remote = remote
+        self.max_pending = max_pending or 2 * len(workers)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.host_of = host_of
+        self.label = label
+        self.backlog: Dict[str, Deque[Tuple[Any, int]]] = {}     # host -> (item, attempt), waiting for a free actor
+        self.backlog_size = 0
+        self.in_flight: Dict[Any, tuple] = {}           # ObjectRef -> (item, worker, host, deadline, attempt)
+        self.abandoned: Dict[Any, tuple] = {}           # ObjectRef -> (item, worker), for timed out items still running
+        self.load: Dict[int, int] = {id(w): 0 for w in workers}
+        self.host_load: Dict[str, int] = {}
+        self.count = 0
+        self.stats = {'done': 0, 'failed': 0, 'timed_out': 0}
+        self.start = time.time()
+
+    def _finished(self, item: Any, result: Any) -> None:
+        self.stats['done'] += 1
+        if isinstance(result, int) and result == -1:
+            self.stats['failed'] += 1
+        if self.stats['done'] % 100 == 0:
+            rate = self.stats['done'] / max(time.time() - self.start, 1e-3)
+            logging.info(f"Processed {self.stats['done']} of {self.count} queued items ({rate:.1f}/sec, "
+                         f"{self.stats['failed']} failed, {self.stats['timed_out']} timed out)")
+        self.on_result(item, result)
+
+    def _dispatch(self) -> None:
+        # hand queued items to idle actors, from the host with the fewest items in flight
+        idle = [w for w in self.workers if self.load[id(w)] == 0]
+        while idle and self.backlog_size > 0:
+            host = min(self.backlog, key=lambda h: self.host_load.get(h, 0))
+            items = self.backlog.pop(host)
+            item, attempt = items.popleft()
+            if items:
+                self.backlog[host] = items      # back to the end, so hosts with equal load take turns
+            self.backlog_size -= 1
+            worker = idle.pop()
+            deadline = time.time() + self.timeout if self.timeout > 0 else None
+            self.in_flight[self.submit(worker, item)] = (item, worker, host, deadline, attempt)
+            self.load[id(worker)] += 1
+            self.host_load[host] = self.host_load.get(host, 0) + 1
+
+    def _handle(self, ref: Any) -> None:
+        import ray
+        if ref in self.abandoned:
+            # a timed out item finally finished; its actor is free again, but the item was already given to another
+            item, worker = self.abandoned.pop(ref)
+            self.load[id(worker)] -= 1
+            try:
+                result = ray.get(ref)
+            except Exception:
+                return
+            if isinstance(result, list):
+                self.on_result(item, [(i, r) for i, r in result if i != item])
+            return
+        item, worker, host, _, _ = self.in_flight.pop(ref)
+        self.load[id(worker)] -= 1
+        self.host_load[host] -= 1
+        try:
+            result = ray.get(ref)
+        except Exception as e:
+            logging.error(f"Error while processing {self.label(item)}: {e}")
+            result = -1
+        self._finished(item, result)
+
+    def _expire(self) -> None:
+        now = time.time()
+        for ref, (item, worker, host, deadline, attempt) in list(self.in_flight.items()):
+            if deadline is None or deadline > now:
+                continue
+            # the actor stays busy until the item finishes, so the item goes to another actor
+            del self.in_flight[ref]
+            self.abandoned[ref] = (item, worker)
+            self.host_load[host] -= 1
+            self.stats['timed_out'] += 1
+            if attempt < self.max_retries:
+                logging.warning(f"{self.label(item)} is still running after {self.timeout} seconds, giving it to another worker")
+                self.backlog.setdefault(host, deque()).appendleft((item, attempt + 1))
+                self.backlog_size += 1
+            else:
+                logging.error(f"{self.label(item)} is still running after {self.timeout} seconds, giving up on it")
+                self._finished(item, -1)
+
+    def _wait(self, timeout: Optional[float] = None) -> None:
+        import ray
+        refs = list(self.in_flight.keys()) + list(self.abandoned.keys())
+        if refs:
+            deadlines = [d for _, _, _, d, _ in self.in_flight.values() if d is not None]
+            if deadlines:
+                until_deadline = max(min(deadlines) - time.time(), 0)
+                timeout = until_deadline if timeout is None else min(timeout, until_deadline)
+            ready, _ = ray.wait(refs, num_returns=len(refs) if timeout == 0 else 1, timeout=timeout)
+            for ref in ready:
+                self._handle(ref)
+        self._expire()
+        self._dispatch()
+
+    def idle_slots(self) -> int:
+        """
+        Return how many items can be put() right now without blocking, after handling the results already available.
+        Always 0 for local workers, since they do the work inside put().
+        """
+        if not self.remote:
+            return 0
+        self._wait(timeout=0)
+        return self.max_pending - len(self.in_flight) - self.backlog_size
+
+    def put(self, item: Any) -> None:
+        self.count += 1
+        if self.count % 100 == 0:
+            logging.info(f"Queued {self.count} items for indexing so far")
+        if not self.remote:
+            self._finished(item, self.submit(self.workers[0], item))
+            return
+        host = self.host_of(item) if self.host_of else ''
+        self.backlog.setdefault(host, deque()).append((item, 0))
+        self.backlog_size += 1
+        self._dispatch()
+        while len(self.in_flight) + self.backlog_size > self.max_pending:
+            self._wait()
+
+    def join(self) -> None:
+        """
+        Wait for all queued items to be processed (items given up after a timeout may still be running).
+        """
+        while len(self.in_flight) + self.backlog_size > 0:
+            self._wait()
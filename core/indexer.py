@@ -5,6 +5,8 @@ from typing import Tuple, Dict, Any, List, Optional
 import uuid
 import pandas as pd
 import shutil
+from collections import OrderedDict
+from urllib.parse import urlparse, urljoin
 
 import time
 import unicodedata
@@ -21,6 +23,12 @@ from core.utils import (
     url_to_filename
 )
 from core.extract import get_article_content
+from core.docs_extract import DocsExtractor, parse_html
+from core.host_health import HostHealth
+from core.canonical import IndexedUrls, UrlCanonicalizer
+from core.near_dup import NearDuplicateDetector
+from core.revalidation import ValidatorStore
+from core.warc import WarcWriter, WarcArchive, PAGE, DOWNLOAD
 
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 
@@ -95,9 +103,28 @@ class Indexer(object):
         self.remove_boilerplate = cfg.vectara.get("remove_boilerplate", False)
         self.post_load_timeout = cfg.vectara.get("post_load_timeout", 5)
         self.timeout = cfg.vectara.get("timeout", 90)
+        self.reuse_browser_context = cfg.vectara.get("reuse_browser_context", False)
+        self.context_max_pages = cfg.vectara.get("context_max_pages", 50)
+        self.max_open_contexts = cfg.vectara.get("max_open_contexts", 4)
         self.detected_language: Optional[str] = None
+        self.canonicalizer: Optional[UrlCanonicalizer] = None    # set by crawlers that deduplicate pages by canonical URL
+        self.indexed_urls = IndexedUrls()
+        self.near_duplicates: Optional[NearDuplicateDetector] = None
+        self.validators: Optional[ValidatorStore] = None     # set by crawlers that revalidate pages across runs
+        # capture fetched pages to WARC files, or replay them from WARC files instead of fetching them
+        self.warc_writer = WarcWriter(cfg.vectara.warc_capture_dir) if cfg.vectara.get("warc_capture_dir") else None
+        self.warc_archive = WarcArchive(cfg.vectara.warc_replay_dir) if cfg.vectara.get("warc_replay_dir") else None
+        if cfg.vectara.get("near_duplicates", False):
+            self.near_duplicates = NearDuplicateDetector(max_distance=cfg.vectara.get("near_duplicate_distance", 3))
         self.x_source = f'vectara-ingest-{self.cfg.crawling.crawler_type}'
         self.logger = logging.getLogger()
+        self.host_health = HostHealth(
+            max_timeout=self.timeout,
+            min_timeout=cfg.vectara.get("min_timeout", 10),
+            failure_threshold=cfg.vectara.get("host_failure_threshold", 5),
+            cooldown=cfg.vectara.get("host_cooldown", 300),
+            adaptive_timeout=cfg.vectara.get("adaptive_timeout", True),
+        )
 
         self.summarize_tables = cfg.vectara.get("summarize_tables", False)
         if cfg.vectara.get("openai_api_key", None) is None:
@@ -124,9 +151,12 @@ class Indexer(object):
     def setup(self, use_playwright: bool = True) -> None:
         self.session = create_session_with_retries()
         # Create playwright browser so we can reuse it across all Indexer operations
+        self.browser_contexts: OrderedDict = OrderedDict()
+        self.pdf_browser = None
+        self.pdf_browser_use_count = 0
         if use_playwright:
             self.p = sync_playwright().start()
-            self.browser = self.p.firefox.launch(headless=True)
+            self.browser = self._launch_browser()
             self.browser_use_count = 0
         self.tmp_file = 'tmp_' + str(uuid.uuid4())
         if self.store_docs:
@@ -135,15 +165,87 @@ class Indexer(object):
                 shutil.rmtree(self.store_docs_folder)
             os.makedirs(self.store_docs_folder)
 
+    def _launch_browser(self):
+        if self.reuse_browser_context:
+            # Request routing disables the browser HTTP cache, so with shared contexts images are blocked via a preference instead
+            return self.p.firefox.launch(headless=True, firefox_user_prefs={'permissions.default.image': 2})
+        return self.p.firefox.launch(headless=True)
+
+    def _get_context(self, url: str):
+        """
+        Return a browser context to render this URL in.
+        If reuse_browser_context is set, pages of the same host share a context (and thus its HTTP cache, so that
+        JS bundles and CSS are not downloaded again for every page). Each shared context is closed after
+        context_max_pages pages, and at most max_open_contexts are kept open (least recently used is closed first).
+        """
+        if not self.reuse_browser_context:
+            return self.browser.new_context()
+
+        host = urlparse(url).netloc.lower()
+        if host in self.browser_contexts:
+            context, uses = self.browser_contexts.pop(host)
+            if uses < self.context_max_pages:
+                self.browser_contexts[host] = (context, uses + 1)
+                return context
+            context.close()
+
+        while len(self.browser_contexts) >= self.max_open_contexts:
+            _, (old_context, _) = self.browser_contexts.popitem(last=False)
+            old_context.close()
+        context = self.browser.new_context()
+        self.browser_contexts[host] = (context, 1)
+        return context
+
+    def _release_context(self, context) -> None:
+        if not self.reuse_browser_context:
+            context.close()
+
+    def close_browser_contexts(self) -> None:
+        for context, _ in self.browser_contexts.values():
+            try:
+                context.close()
+            except Exception:
+                pass
+        self.browser_contexts = OrderedDict()
+        self._close_pdf_browser()
+
+    def _close_pdf_browser(self) -> None:
+        # the Chromium browser for PDF rendering is launched again on its next use
+        if self.pdf_browser is not None:
+            try:
+                self.pdf_browser.close()
+            except Exception:
+                pass
+        self.pdf_browser = None
+        self.pdf_browser_use_count = 0
+
     def store_file(self, filename: str, orig_filename) -> None:
         if self.store_docs:
             dest_path = f"{self.store_docs_folder}/{orig_filename}"
             shutil.copyfile(filename, dest_path)
 
 
+    def http_get(self, url: str, fetch: str = PAGE, session: Any = None, **kwargs) -> Any:
+        """
+        GET a URL with `session` (default: the Indexer's pooled session; kwargs are passed to session.get), capturing
+        the response to WARC if enabled.
+        In WARC replay mode, the response is served from the archive instead, or None is returned if it was not captured.
+        """
+        if self.warc_archive:
+            response = self.warc_archive.get_response(url, fetch)
+            if response is None:
+                self.logger.info(f"{url} is not in the WARC archive, skipping")
+            return response
+        response = (session or self.session).get(url, **kwargs)
+        if self.warc_writer and not kwargs.get('stream', False):
+            self.warc_writer.write_response(url, response.status_code, dict(response.headers), response.content, fetch)
+        return response
+
     def url_triggers_download(self, url: str) -> bool:
+        if self.warc_archive:
+            return self.warc_archive.has_download(url)
         download_triggered = False
-        context = self.browser.new_context()
+        context = self._get_context(url)
 
         # Define the event listener for download
         def on_download(download):
@@ -154,12 +256,12 @@ class Indexer(object):
         page.set_extra_http_headers(get_headers)
         page.on('download', on_download)
         try:
-            page.goto(url, wait_until="domcontentloaded")
+            page.goto(url, timeout=self.host_health.timeout_for(url)*1000, wait_until="domcontentloaded")
         except Exception:
             pass
 
         page.close()
-        context.close()
+        self._release_context(context)
         return download_triggered
 
     def fetch_page_contents(self, url: str, remove_code: bool = False, debug: bool = False) -> dict:
@@ -176,24 +278,42 @@ class Indexer(object):
             - 'url': final URL of the page (if redirect)
             - 'links': list of links in the page
         '''
+        if self.warc_archive:
+            res = self.warc_archive.get_rendered(url)
+            if res is None:
+                self.logger.info(f"{url} is not in the WARC archive, skipping")
+                return {'text': '', 'html': '', 'title': '', 'url': url, 'links': []}
+            return res
+
         page = context = None
         text = ''
         html = ''
         title = ''
         links = []
         out_url = url
+        if not self.host_health.allow_request(url):
+            self.logger.info(f"Skipping {url} since its host is currently failing (circuit open)")
+            return {
+                'text': text, 'html': html, 'title': title,
+                'url': out_url, 'links': links
+            }
+
+        timeout = self.host_health.timeout_for(url)
         try:
-            context = self.browser.new_context()
+            context = self._get_context(url)
             page = context.new_page()
             page.set_extra_http_headers(get_headers)
-            page.route("**/*", lambda route: route.abort()  # do not load images as they are unnecessary for our purpose
-                if route.request.resource_type == "image" 
-                else route.continue_() 
-            ) 
+            if not self.reuse_browser_context:
+                page.route("**/*", lambda route: route.abort()  # do not load images as they are unnecessary for our purpose
+                    if route.request.resource_type == "image" 
+                    else route.continue_() 
+                ) 
             if debug:
                 page.on('console', lambda msg: self.logger.info(f"playwright debug: {msg.text})"))
 
-            page.goto(url, timeout=self.timeout*1000, wait_until="domcontentloaded")
+            st = time.time()
+            page.goto(url, timeout=timeout*1000, wait_until="domcontentloaded")
+            self.host_health.record_success(url, time.time()-st)
             page.wait_for_timeout(self.post_load_timeout*1000)  # Wait an additional time to handle AJAX or animations
             links_script = """Array.from(document.querySelectorAll('a')).map(a => a.href)"""
             links = page.evaluate(links_script)
@@ -237,29 +357,101 @@ class Indexer(object):
             }}""")
 
         except PlaywrightTimeoutError:
-            self.logger.info(f"Page loading timed out for {url} after {self.timeout} seconds")
+            self.logger.info(f"Page loading timed out for {url} after {timeout:.0f} seconds")
+            self.host_health.record_failure(url)
 
         except Exception as e:
             self.logger.info(f"Page loading failed for {url} with exception '{e}'")
+            self.host_health.record_failure(url)
             if not self.browser.is_connected():
-                self.browser = self.p.firefox.launch(headless=True)
+                self.browser_contexts = OrderedDict()
+                self.browser = self._launch_browser()
+                page = context = None
         
         finally:
             if page:
                 page.close()
             if context:
-                context.close()
+                self._release_context(context)
             self.browser_use_count += 1
             if self.browser_use_count >= self.browser_use_limit:
+                self.close_browser_contexts()
                 self.browser.close()
-                self.browser = self.p.firefox.launch(headless=True)
+                self.browser = self._launch_browser()
                 self.browser_use_count = 0
                 self.logger.info(f"browser reset after {self.browser_use_limit} uses to avoid memory issues")
             
-        return {
+        res = {
             'text': text, 'html': html, 'title': title,
             'url': out_url, 'links': links
         }
+        if self.warc_writer and html:
+            self.warc_writer.write_rendered(url, res)
+        return res
+
+    def fetch_page_pdf(self, url: str, filename: str, default_title: str = '') -> dict:
+        '''
+        Render a URL with a (persistent) headless Chromium browser and save it as a PDF file.
+        The page is fetched only once: the response status and title come from the same navigation that produces the PDF.
+        Args:
+            url (str): URL to render.
+            filename (str): name of the PDF file to create.
+            default_title (str): title of the PDF if the page has none.
+        Returns:
+            dict with
+            - 'status': HTTP status code of the page (None if the page could not be loaded)
+            - 'reason': HTTP status text of the page
+            - 'title': title of the page
+            - 'url': final URL of the page (if redirect)
+        '''
+        status = None
+        reason = ''
+        title = ''
+        out_url = url
+        if not self.host_health.allow_request(url):
+            self.logger.info(f"Skipping {url} since its host is currently failing (circuit open)")
+            return {'status': status, 'reason': reason, 'title': title, 'url': out_url}
+
+        # page.pdf() is only supported by Chromium, so we keep a separate Chromium browser just for PDF rendering
+        if self.pdf_browser is None or not self.pdf_browser.is_connected():
+            self.pdf_browser = self.p.chromium.launch(headless=True)
+        timeout = self.host_health.timeout_for(url)
+        context = page = None
+        try:
+            context = self.pdf_browser.new_context()
+            page = context.new_page()
+            page.set_extra_http_headers(get_headers)
+            st = time.time()
+            response = page.goto(url, timeout=timeout*1000, wait_until="domcontentloaded")
+            self.host_health.record_success(url, time.time()-st)
+            page.wait_for_timeout(self.post_load_timeout*1000)
+            if response is not None:
+                status = response.status
+                reason = response.status_text
+            title = page.title()
+            out_url = page.url
+            if not title and default_title:
+                page.evaluate("t => { document.title = t; }", default_title)   # Chromium uses it as the PDF title
+                title = default_title
+            if status == 200:
+                page.pdf(path=filename, print_background=True)
+        except PlaywrightTimeoutError:
+            self.logger.info(f"Page loading timed out for {url} after {timeout:.0f} seconds")
+            self.host_health.record_failure(url)
+        except Exception as e:
+            self.logger.info(f"Rendering PDF failed for {url} with exception '{e}'")
+            self.host_health.record_failure(url)
+        finally:
+            if page:
+                page.close()
+            if context:
+                context.close()
+            self.pdf_browser_use_count += 1
+            if self.pdf_browser_use_count >= self.browser_use_limit:
+                self._close_pdf_browser()
+                self.logger.info(f"PDF browser reset after {self.browser_use_limit} uses to avoid memory issues")
+
+        return {'status': status, 'reason': reason, 'title': title, 'url': out_url}
 
     # delete document; returns True if successful, False otherwise
     def delete_doc(self, doc_id: str) -> bool:
@@ -439,37 +631,101 @@ class Indexer(object):
         self.logger.info(f"Indexing document {document['documentId']} failed, response = {result}")
         return False
     
-    def index_url(self, url: str, metadata: Dict[str, Any], html_processing: dict = {}) -> bool:
+    def index_url(self, url: str, metadata: Dict[str, Any], html_processing: dict = {}, html: Optional[str] = None,
+                  extractor: Optional[DocsExtractor] = None) -> bool:
         """
         Index a url by rendering it with scrapy-playwright, extracting paragraphs, then uploading to the Vectara corpus.
         Args:
             url (str): URL for where the document originated. 
             metadata (dict): Metadata for the document.
+            html (str): if given, the HTML of the page (e.g. already downloaded by the crawler), which is indexed
+                        instead of fetching and rendering the page; only suitable for pages that don't need JavaScript.
+            extractor (DocsExtractor): if given, extracts the main content of the page, split in one section per heading,
+                        instead of the generic text extraction (which is used if the page has no main content container).
         Returns:
             bool: True if the upload was successful, False otherwise.
         """
+        return self.crawl_and_index_url(url, metadata, html_processing, html, extractor)['indexed']
+
+    def page_contents_from_html(self, url: str, html: str) -> Dict[str, Any]:
+        """
+        Extract the same contents as fetch_page_contents() from the static HTML of a page, without a browser.
+        """
+        try:
+            doc = parse_html(html)
+        except Exception:
+            return {'text': '', 'html': html, 'title': '', 'url': url, 'links': []}
+        body = doc.find('body')
+        text = ' '.join((body if body is not None else doc).text_content().split())
+        links = [urljoin(url, href.strip()) for href in doc.xpath('//a/@href')]
+        return {'text': text, 'html': html, 'title': (doc.findtext('.//title') or '').strip(), 'url': url, 'links': links}
+
+    def crawl_and_index_url(self, url: str, metadata: Dict[str, Any], html_processing: dict = {}, html: Optional[str] = None,
+                            extractor: Optional[DocsExtractor] = None) -> dict:
+        """
+        Index a url like index_url(), and also return the links found on the rendered page, so that a crawler can
+        discover new pages from the same render it indexes.
+        Returns:
+            dict with
+            - 'indexed': True if the upload was successful, False otherwise
+            - 'duplicate': True if the page was not indexed because it was already indexed under its canonical URL
+            - 'url': the URL the page was indexed under (its canonical URL, if the Indexer has a canonicalizer)
+            - 'links': list of (absolute) links in the page
+        """
         st = time.time()
         url = url.split("#")[0]     # remove fragment, if exists
+        doc_url = self.canonicalizer.canonicalize(url) if self.canonicalizer else url
+        links: List[str] = []
+        titles: Optional[List[str]] = None
+
+        if self.canonicalizer and self.indexed_urls.seen(doc_url):
+            # known duplicate, so not even fetched
+            self.logger.info(f"Skipping {url} since its canonical URL {doc_url} was already indexed")
+            return {'indexed': False, 'duplicate': True, 'url': doc_url, 'links': links}
+
+        if self.host_health.is_open(url):
+            self.logger.info(f"Skipping {url} since its host is currently failing (circuit open)")
+            self.host_health.record_skip(url)
+            return {'indexed': False, 'url': doc_url, 'links': links}
 
         # if file is going to download, then handle it as local file
-        if self.url_triggers_download(url):
+        if html is None and self.url_triggers_download(url):
             file_path = self.tmp_file
-            response = self.session.get(url, headers=get_headers, stream=True)
+            headers = {**get_headers, **self.validators.conditional_headers(url)} if self.validators else get_headers
+            response = self.http_get(url, DOWNLOAD, headers=headers, stream=True)
+            if response is None:
+                return {'indexed': False, 'url': doc_url, 'links': links}
+            if response.status_code == 304 and self.validators and self.validators.not_modified(url):
+                response.close()
+                if self.validators.unchanged(url):
+                    self.logger.info(f"Skipping {url} since it did not change since it was last indexed")
+                    return {'indexed': True, 'url': doc_url, 'links': links}
+                # unchanged, but its last indexing failed, so download it again
+                response = self.http_get(url, DOWNLOAD, headers=get_headers, stream=True)
             if response.status_code == 200:
+                size = 0
                 with open(file_path, 'wb') as f:
                     for chunk in response.iter_content(chunk_size=8192): 
                         f.write(chunk)
+                        size += len(chunk)
                 self.logger.info(f"File downloaded successfully and saved as {file_path}")
+                if self.warc_writer:
+                    with open(file_path, 'rb') as f:
+                        self.warc_writer.write_response(url, response.status_code, dict(response.headers), f.read(), DOWNLOAD)
+                if self.validators:
+                    self.validators.record(url, response, size=size)
                 res =  self.index_file(file_path, url, metadata)
                 safe_remove_file(file_path)
-                return res            
+                return {'indexed': res, 'url': doc_url, 'links': links}
             else:
                 self.logger.info(f"Failed to download file. Status code: {response.status_code}")
-                return False
+                return {'indexed': False, 'url': doc_url, 'links': links}
 
         # If MD, RST of IPYNB file, then we don't need playwright - can just download content directly and convert to text
-        if url.lower().endswith(".md") or url.lower().endswith(".ipynb"):
-            response = self.session.get(url, timeout=self.timeout)
+        if html is None and (url.lower().endswith(".md") or url.lower().endswith(".ipynb")):
+            response = self.http_get(url, timeout=self.timeout)
+            if response is None:
+                return {'indexed': False, 'url': doc_url, 'links': links}
             response.raise_for_status()
             dl_content = response.content.decode('utf-8')
             if url.lower().endswith('md'):
@@ -484,15 +740,18 @@ class Indexer(object):
 
         else:
             try:
-                # Use Playwright to get the page content
-                res = self.fetch_page_contents(url, self.remove_code)
+                # Use Playwright to get the page content, unless its HTML was given
+                res = self.fetch_page_contents(url, self.remove_code) if html is None else self.page_contents_from_html(url, html)
+                links = res['links']
                 html = res['html']
                 text = res['text']
 
                 extracted_title = res['title']
+                if self.canonicalizer:
+                    doc_url = self.canonicalizer.resolve(url, res['url'], html)
 
                 if text is None or len(text)<3:
-                    return False
+                    return {'indexed': False, 'url': doc_url, 'links': links}
 
                 # Detect language if needed
                 if self.detected_language is None:
@@ -501,34 +760,57 @@ class Indexer(object):
 
                 #
                 # By default, 'text' is extracted above.
+                # If there is an extractor for the docs system, use it to get the main content, one section per heading
                 # If remove_boilerplate is True, then use it directly
                 # If no boilerplate remove but need to remove code, then we need to use html_to_text
                 #
-                if self.remove_boilerplate:
-                    url = res['url']
-                    if self.verbose:
-                        self.logger.info(f"Removing boilerplate from content of {url}, and extracting important text only")
-                    text, extracted_title = get_article_content(html, url, self.detected_language, self.remove_code)
+                extracted = extractor.extract(html, self.remove_code, html_processing) if extractor else None
+                if extracted:
+                    extracted_title, titles, parts = extracted
                 else:
-                    text = html_to_text(html, self.remove_code, html_processing)
-
-                parts = [text]
+                    if self.remove_boilerplate:
+                        url = res['url']
+                        if self.verbose:
+                            self.logger.info(f"Removing boilerplate from content of {url}, and extracting important text only")
+                        text, extracted_title = get_article_content(html, url, self.detected_language, self.remove_code)
+                    else:
+                        text = html_to_text(html, self.remove_code, html_processing)
+                    parts = [text]
                 self.logger.info(f"retrieving content took {time.time()-st:.2f} seconds")
             except Exception as e:
                 import traceback
                 self.logger.info(f"Failed to crawl {url}, skipping due to error {e}, traceback={traceback.format_exc()}")
-                return False
+                return {'indexed': False, 'url': doc_url, 'links': links}
         
+        if self.canonicalizer:
+            # the same page may be reached under several URLs; index it only once, with an ID based on its canonical URL
+            # (with Ray, the set of indexed pages is shared by all workers)
+            aliases = [self.canonicalizer.canonicalize(url)]
+            if not self.indexed_urls.claim(doc_url, aliases):
+                self.logger.info(f"Skipping {url} since its canonical URL {doc_url} was already indexed")
+                return {'indexed': False, 'duplicate': True, 'url': doc_url, 'links': links}
+            url = doc_url
         doc_id = slugify(url)
-        succeeded = self.index_segments(doc_id=doc_id, texts=parts,
-                                        doc_metadata=metadata, doc_title=extracted_title)
-        return succeeded
+        succeeded = False
+        try:
+            succeeded = self.index_segments(doc_id=doc_id, texts=parts, titles=titles,
+                                            doc_metadata=metadata, doc_title=extracted_title)
+        finally:
+            if self.canonicalizer and not succeeded:
+                self.indexed_urls.release(doc_url, aliases)     # so that a retry or another alias can index it
+        return {'indexed': succeeded, 'url': doc_url, 'links': links}
 
     def index_segments(self, doc_id: str, texts: List[str], titles: Optional[List[str]] = None, metadatas: Optional[List[Dict[str, Any]]] = None, 
                        doc_metadata: Dict[str, Any] = {}, doc_title: str = "") -> bool:
         """
         Index a document (by uploading it to the Vectara corpus) from the set of segments (parts) that make up the document.
         """
+        if self.near_duplicates:
+            original = self.near_duplicates.check(doc_id, "\n".join(texts), doc_metadata.get('url', ''))
+            if original:
+                self.logger.info(f"Skipping {doc_id} since it is a near-duplicate of {original}")
+                return True
+
         if titles is None:
             titles = ["" for _ in range(len(texts))]
         if metadatas is None:
@@ -0,0 +1,134 @@
+import logging
+import re
+from array import array
+from hashlib import blake2b
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+_WORD = re.compile(r'\w+')
+_BITS = np.arange(64, dtype=np.uint64)
+
+def _hash64(s: str) -> int:
+    # a stable hash (unlike hash(), which is salted per process), so fingerprints match across Ray actors
+    return int.from_bytes(blake2b(s.encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'little')
+
+def simhash(text: str, shingle_size: int = 3, min_words: int = 20) -> Optional[int]:
+    """
+    Compute the 64-bit SimHash of a text, over shingles of `shingle_size` consecutive words (lowercased).
+    Texts that differ only a little have fingerprints that differ in a few bits.
+    Returns None for texts with fewer than min_words words, which are too short to compare reliably.
+    """
+    words = _WORD.findall(text.lower())
+    if len(words) < max(min_words, 1):
+        return None
+    n = max(len(words) - shingle_size + 1, 1)
+    hashes = np.fromiter((_hash64(' '.join(words[i:i+shingle_size])) for i in range(n)), dtype=np.uint64, count=n)
+    # for each bit, count the shingles that have it set; the fingerprint has the bits set by a majority of shingles
+    bit_counts = ((hashes[:, None] >> _BITS) & np.uint64(1)).sum(axis=0)
+    return int(np.packbits(bit_counts * 2 > n, bitorder='little').view('<u8')[0])
+
+class FingerprintIndex:
+    """
+    A compact index of 64-bit fingerprints, to find fingerprints within `max_distance` bits of a new one.
+
+    Each fingerprint is split into max_distance+1 bands; two fingerprints within max_distance bits agree exactly on
+    at least one band, so only fingerprints sharing a band with the new one need to be compared.
+    Fingerprints are kept in an array of 64-bit integers, so memory use is a few dozen bytes per document.
+    """
+    def __init__(self, max_distance: int = 3):
+        self.max_distance = max_distance
+        num_bands = min(max_distance + 1, 64)
+        self.bands = [(i * 64 // num_bands, (i + 1) * 64 // num_bands) for i in range(num_bands)]
+        self.buckets: Dict[Tuple[int, int], List[int]] = {}
+        self.fingerprints = array('Q')
+        self.doc_ids: List[str] = []
+        self.urls: List[str] = []
+        self.num_checked = 0
+        self.duplicates: List[Tuple[str, str, str, int]] = []    # (doc_id, url, doc_id of original, distance)
+
+    def _keys(self, fp: int) -> List[Tuple[int, int]]:
+        return [(i, (fp >> start) & ((1 << (end - start)) - 1)) for i, (start, end) in enumerate(self.bands)]
+
+    def find_or_add(self, doc_id: str, fp: int, url: str = '') -> Optional[Tuple[str, int]]:
+        """
+        Return the doc ID of an indexed near-duplicate of this fingerprint, and its distance, if there is one.
+        Otherwise add the fingerprint to the index and return None.
+        """
+        self.num_checked += 1
+        keys = self._keys(fp)
+        for key in keys:
+            for inx in self.buckets.get(key, []):
+                distance = bin(fp ^ self.fingerprints[inx]).count('1')
+                if distance <= self.max_distance and self.doc_ids[inx] != doc_id:
+                    self.duplicates.append((doc_id, url, self.doc_ids[inx], distance))
+                    return self.doc_ids[inx], distance
+        inx = len(self.fingerprints)
+        self.fingerprints.append(fp)
+        self.doc_ids.append(doc_id)
+        self.urls.append(url)
+        for key in keys:
+            self.buckets.setdefault(key, []).append(inx)
+        return None
+
+    def stats(self) -> Tuple[int, List[Tuple[str, str, str, int]]]:
+        return self.num_checked, self.duplicates
+
+class NearDuplicateDetector:
+    """
+    Detects documents whose text is nearly identical to a document indexed before (print views, paginated listings,
+    locale variants with the same text, ...), using SimHash fingerprints of the text.
+    Two documents are near-duplicates if their fingerprints differ in at most `max_distance` of 64 bits.
+
+    By default the fingerprints are kept in this process. Call share() (after ray.init) before passing the Indexer
+    to Ray actors, so that all actors check against the same fingerprints.
+
+    Args:
+        max_distance (int): maximum number of differing fingerprint bits for two documents to be near-duplicates.
+        shingle_size (int): number of consecutive words per shingle.
+        min_words (int): documents with fewer words are never considered near-duplicates.
+    """
+    def __init__(self, max_distance: int = 3, shingle_size: int = 3, min_words: int = 20):
+        self.shingle_size = shingle_size
+        self.min_words = min_words
+        self.max_distance = max_distance
+        self.index = FingerprintIndex(max_distance)
+        self.backend = None
+
+    def share(self) -> None:
+        """
+        Move the fingerprint index to a Ray actor shared by all copies of this detector (ray must be initialized).
+        """
+        import ray
+        self.backend = ray.remote(num_cpus=0)(FingerprintIndex).remote(self.max_distance)
+
+    def check(self, doc_id: str, text: str, url: str = '') -> Optional[str]:
+        """
+        Return the doc ID of an already indexed near-duplicate of this document, or None if there is none
+        (in which case the document is recorded as indexed).
+        """
+        fp = simhash(text, self.shingle_size, self.min_words)
+        if fp is None:
+            return None
+        if self.backend is not None:
+            import ray
+            found = ray.get(self.backend.find_or_add.remote(doc_id, fp, url))
+        else:
+            found = self.index.find_or_add(doc_id, fp, url)
+        return found[0] if found else None
+
+    def report(self, path: Optional[str] = None) -> None:
+        """
+        Log how many documents were suppressed as near-duplicates, and optionally list them in a file
+        (tab-separated: doc ID, URL, doc ID of the original, distance).
+        """
+        if self.backend is not None:
+            import ray
+            num_checked, duplicates = ray.get(self.backend.stats.remote())
+        else:
+            num_checked, duplicates = self.index.stats()
+        logging.info(f"Near-duplicate detection: {len(duplicates)} of {num_checked} documents were skipped as near-duplicates")
+        if path and len(duplicates) > 0:
+            with open(path, 'w') as f:
+                for doc_id, url, original, distance in duplicates:
+                    f.write(f"{doc_id}\t{url}\t{original}\t{distance}\n")
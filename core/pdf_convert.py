@@ -1,25 +1,45 @@
 import logging
+import os
+import shutil
 import subprocess
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 import pdfkit
 
 class PDFConverter:
     """
     Helper class for converting web pages to PDF.
+
+    Conversions run on a bounded pool of worker threads, each driving its own wkhtmltopdf process,
+    so callers can submit() conversions and keep working while PDFs render.
+    At most max_workers conversions run concurrently, and at most max_queue more wait in the queue;
+    beyond that submit() blocks until a slot frees up.
+    PDF files created with tmp_path() live in a temporary directory that is removed by close().
+
+    Args:
+        use_pdfkit (bool): use pdfkit instead of calling wkhtmltopdf directly.
+        max_workers (int): number of concurrent conversions.
+        max_queue (int): number of conversions that can wait for a free worker.
+        timeout (int): timeout in seconds for each conversion.
     """
-    def __init__(self, use_pdfkit: bool = False):
+    def __init__(self, use_pdfkit: bool = False, max_workers: int = 1, max_queue: int = 8, timeout: int = 120):
         self.use_pdfkit = use_pdfkit
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self.executor = None
+        self.tmp_dir = None
 
-    def from_url(self, url: str, filename: str, title: str = "No Title") -> bool:
+    def tmp_path(self, name: str) -> str:
         """
-        Convert a webpage to PDF and save it to a file.
-
-        Args:
-            url (str): The URL of the webpage to convert.
-            filename (str): The name of the file to save the PDF to.
-
-        Returns:
-            name of file
+        Return a path for the given file name inside this converter's temporary directory.
         """
+        if self.tmp_dir is None:
+            self.tmp_dir = tempfile.mkdtemp(prefix='pdf_convert_')
+        return os.path.join(self.tmp_dir, name)
+
+    def _convert(self, url: str, filename: str, title: str) -> bool:
         try:
             if self.use_pdfkit:
                 pdfkit.from_url(
@@ -31,7 +51,7 @@ class PDFConverter:
             else:
                 cmd = ["wkhtmltopdf", "--quiet", "--load-error-handling", "ignore", '--title', title, url, filename]
                 try:
-                    subprocess.call(cmd, timeout=120)
+                    subprocess.call(cmd, timeout=self.timeout)
                 except subprocess.TimeoutExpired:
                     logging.warning(f"Timeout converting {url} to PDF")
                     return False
@@ -41,4 +61,49 @@ class PDFConverter:
         except Exception as e:
             logging.error(f"Error {e} converting {url} to PDF")
             return False
-        
\ No newline at end of file
+
+    def submit(self, url: str, filename: str, title: str = "No Title") -> Future:
+        """
+        Queue the conversion of a webpage to PDF.
+
+        Args:
+            url (str): The URL of the webpage to convert.
+            filename (str): The name of the file to save the PDF to.
+
+        Returns:
+            Future whose result is True if the conversion succeeded, False otherwise
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='pdf_convert')
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(self._convert, url, filename, title)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def from_url(self, url: str, filename: str, title: str = "No Title") -> bool:
+        """
+        Convert a webpage to PDF and save it to a file.
+
+        Args:
+            url (str): The URL of the webpage to convert.
+            filename (str): The name of the file to save the PDF to.
+
+        Returns:
+            True if the conversion succeeded, False otherwise
+        """
+        return bool(self.submit(url, filename, title).result())
+
+    def close(self) -> None:
+        """
+        Wait for pending conversions, stop the worker threads and remove the temporary directory.
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            self.tmp_dir = None
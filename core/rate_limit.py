@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+class TokenBuckets:
+    """
+    A set of token buckets, one per key, each refilled at `rate` tokens per second up to `burst` tokens.
+
+    reserve() never blocks: it takes the tokens and returns how long the caller must wait before using them.
+    Balances can go negative, so concurrent callers get consecutive slots and wait in parallel instead of
+    being woken up one at a time.
+
+    At most max_keys buckets are kept: the least recently used are dropped, which is harmless once they had time
+    to refill (a dropped bucket starts again full).
+
+    Args:
+        rate (float): default tokens per second, for keys not in key_rates.
+        burst (float): default bucket size; defaults to `rate` (i.e. up to one second worth of requests at once).
+        key_rates (dict): per-key rate, or (rate, burst) tuple.
+        max_keys (int): maximum number of buckets to keep.
+    """
+    def __init__(self, rate: float, burst: Optional[float] = None, key_rates: Dict[str, Any] = {}, max_keys: int = 10_000):
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive, got {rate}")
+        self.rate = float(rate)
+        self.burst = float(burst) if burst is not None else max(self.rate, 1.0)
+        self.key_rates: Dict[str, Tuple[float, float]] = {}
+        for key, value in key_rates.items():
+            r, b = value if isinstance(value, (tuple, list)) else (value, None)
+            self.key_rates[key] = (float(r), float(b) if b is not None else max(float(r), 1.0))
+        self.max_keys = max(max_keys, 1)
+        self.buckets: OrderedDict = OrderedDict()   # key -> (tokens, time of last update), least recently used first
+
+    def reserve(self, key: str = '', tokens: float = 1.0, now: Optional[float] = None) -> float:
+        """
+        Take `tokens` from the key's bucket, and return the number of seconds to wait before proceeding.
+        """
+        now = time.monotonic() if now is None else now
+        rate, burst = self.key_rates.get(key, (self.rate, self.burst))
+        available, last = self.buckets.get(key, (burst, now))
+        available = min(burst, available + (now - last) * rate) - tokens
+        self.buckets[key] = (available, now)
+        self.buckets.move_to_end(key)
+        while len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return max(0.0, -available / rate)
+
+class RateLimiter:
+    """
+    Token-bucket rate limiter: at most `max_rate` operations per second on average, with bursts of up to `burst`.
+    Can be used as a context manager (`with rate_limiter:`), or with acquire(key) for separate per-key buckets
+    (e.g. one per host or per API).
+
+    By default the buckets are local to this process. To enforce the rate across processes or Ray actors, create a
+    backend with create_shared_backend() in the driver and pass it to the RateLimiter of every worker.
+    Waiting happens in the calling thread, outside of any lock, so threads don't serialize behind each other.
+
+    Args:
+        max_rate (float): operations per second (0 or less for no limit).
+        burst (float): maximum number of operations allowed at once (defaults to max_rate).
+        key_rates (dict): per-key rate, or (rate, burst) tuple, for keys that need a different rate.
+        backend: a shared backend from create_shared_backend(); if None, buckets are local.
+    """
+    def __init__(self, max_rate: float, burst: Optional[float] = None, key_rates: Dict[str, Any] = {}, backend: Any = None):
+        self.max_rate = max_rate
+        self.backend = backend
+        self.buckets = TokenBuckets(max_rate, burst, key_rates) if backend is None and max_rate > 0 else None
+        self.lock = threading.Lock()
+
+    def _reserve(self, key: str, tokens: float) -> float:
+        if self.backend is not None:
+            import ray
+            return ray.get(self.backend.reserve.remote(key, tokens))
+        if self.buckets is None:
+            return 0.0
+        with self.lock:
+            return self.buckets.reserve(key, tokens)
+
+    def acquire(self, key: str = '', tokens: float = 1.0) -> None:
+        """
+        Block until `tokens` operations are allowed for this key.
+        """
+        wait = self._reserve(key, tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def __getstate__(self) -> dict:
+        # locks can't be pickled (e.g. when passed to a Ray actor)
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+class _SharedTokenBuckets:
+    """
+    Ray actor holding the token buckets shared by all workers of a job.
+    Only the reservation goes through the actor; workers wait locally, so the actor is never blocked.
+    """
+    def __init__(self, rate: float, burst: Optional[float] = None, key_rates: Dict[str, Any] = {}):
+        self.buckets = TokenBuckets(rate, burst, key_rates)
+
+    def reserve(self, key: str = '', tokens: float = 1.0) -> float:
+        return self.buckets.reserve(key, tokens)
+
+def create_shared_backend(max_rate: float, burst: Optional[float] = None, key_rates: Dict[str, Any] = {}):
+    """
+    Create a Ray actor that holds token buckets shared by all RateLimiters it is passed to (ray must be initialized).
+    """
+    import ray
+    return ray.remote(num_cpus=0)(_SharedTokenBuckets).remote(max_rate, burst, key_rates)
@@ -0,0 +1,105 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Iterable, Optional, Tuple
+
+def normalize_lastmod(lastmod: Optional[str]) -> Optional[str]:
+    """
+    Convert a sitemap lastmod (W3C datetime, e.g. '2024-05-01' or '2024-05-01T10:00:00+02:00') to an ISO string in UTC,
+    so that lastmod values can be compared as strings. Unparsable values are returned as is.
+    """
+    if not lastmod:
+        return None
+    try:
+        dt = datetime.fromisoformat(lastmod.strip().replace('Z', '+00:00'))
+    except ValueError:
+        return lastmod.strip()
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).isoformat()
+
+class RecrawlState:
+    """
+    On-disk (SQLite) store of what was indexed in previous runs of a crawl job, used for incremental recrawls.
+
+    For each URL it keeps the lastmod the sitemap currently reports, the lastmod it had when it was last indexed
+    successfully, and when that was. A URL needs to be (re)indexed if it was never indexed, if its lastmod advanced
+    since, or if the sitemap has no lastmod for it. Runs are numbered, so URLs that no longer appear in the sitemap can
+    be dropped, and a full refresh can be forced every N runs.
+
+    Args:
+        path (str): path of the SQLite file; kept across runs.
+    """
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, lastmod TEXT, indexed_lastmod TEXT,
+                                              indexed_at REAL, seen_run INTEGER);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self.conn.commit()
+        self.run = int(self._get_meta('run') or 0)
+        self.last_commit = time.time()
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def start_run(self, full_refresh_every: int = 0, resume: bool = False) -> bool:
+        """
+        Start a new run (or continue the last one, if resume is True).
+        Returns True if this run should re-index all URLs: the first run, or every full_refresh_every runs.
+        """
+        if not resume:
+            self.run += 1
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('run', ?)", (str(self.run),))
+            self.conn.commit()
+        if self.conn.execute("SELECT 1 FROM pages WHERE indexed_at IS NOT NULL LIMIT 1").fetchone() is None:
+            return True
+        return full_refresh_every > 0 and self.run % full_refresh_every == 0
+
+    def update_sitemap(self, entries: Iterable[Tuple[str, Optional[str]]]) -> None:
+        """
+        Record the (url, lastmod) pairs found in the sitemap in this run.
+        """
+        self.conn.executemany("""
+            INSERT INTO pages (url, lastmod, seen_run) VALUES (?, ?, ?)
+            ON CONFLICT(url) DO UPDATE SET lastmod=excluded.lastmod, seen_run=excluded.seen_run
+        """, ((url, normalize_lastmod(lastmod), self.run) for url, lastmod in entries))
+        self.conn.commit()
+
+    def needs_index(self, url: str) -> bool:
+        row = self.conn.execute("SELECT lastmod, indexed_lastmod, indexed_at FROM pages WHERE url=?", (url,)).fetchone()
+        if row is None:
+            return True
+        lastmod, indexed_lastmod, indexed_at = row
+        if indexed_at is None or lastmod is None or indexed_lastmod is None:
+            return True
+        return lastmod > indexed_lastmod
+
+    def mark_indexed(self, url: str) -> None:
+        with self.lock:
+            self.conn.execute("UPDATE pages SET indexed_lastmod=lastmod, indexed_at=? WHERE url=?", (time.time(), url))
+            if time.time() - self.last_commit >= 60:
+                self.conn.commit()
+                self.last_commit = time.time()
+
+    def remove_vanished(self) -> int:
+        """
+        Forget URLs that were not in the sitemap of the current run. Returns the number of URLs removed.
+        """
+        n = self.conn.execute("DELETE FROM pages WHERE seen_run < ?", (self.run,)).rowcount
+        self.conn.commit()
+        if n > 0:
+            logging.info(f"Removed {n} URLs that are no longer in the sitemap from the recrawl state")
+        return n
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+class ValidatorStore:
+    """
+    On-disk (SQLite) store of HTTP cache validators (ETag and Last-Modified) per URL, kept across runs of a crawl job,
+    so that recrawls can send conditional requests (If-None-Match / If-Modified-Since) and skip unchanged pages.
+
+    Along with the validators it keeps the size of the response (to estimate the bandwidth a 304 saved), the links
+    found on the page and its canonical URL (so that a crawl can continue past a page it did not download), and
+    whether the page was indexed successfully since it last changed. A 304 only means "skip re-indexing" for
+    pages that were indexed: a page whose indexing failed is indexed again even if it did not change.
+
+    Can be used from several threads, and from several processes at once (e.g. Ray actors recording validators while
+    the driver marks pages as indexed): each write is committed right away, so no process holds the write lock
+    for longer than one statement.
+
+    Args:
+        path (str): path of the SQLite file; kept across runs.
+    """
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._connect()
+        self.stats = {'requests': 0, 'not_modified': 0, 'bytes_saved': 0, 'not_reindexed': 0}
+        self.not_modified_urls: set = set()     # URLs that got a 304 in this run
+
+    def _connect(self) -> None:
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)   # autocommit
+        self.lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")     # several Ray actors on the same node may write to it
+        self.conn.execute("PRAGMA synchronous=NORMAL")   # in WAL mode, commits then don't wait for the disk
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS validators (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, size INTEGER,
+                                                   links TEXT, page_url TEXT, indexed INTEGER)
+        """)
+
+    def _row(self, url: str) -> Optional[tuple]:
+        with self.lock:
+            return self.conn.execute("SELECT etag, last_modified, size, links, page_url, indexed FROM validators WHERE url=?",
+                                     (url,)).fetchone()
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """
+        Return the If-None-Match / If-Modified-Since headers to send for this URL (empty if it has no validators).
+        """
+        self.stats['requests'] += 1
+        row = self._row(url)
+        headers = {}
+        if row and row[0]:
+            headers['If-None-Match'] = row[0]
+        if row and row[1]:
+            headers['If-Modified-Since'] = row[1]
+        return headers
+
+    def record(self, url: str, response: Any, size: Optional[int] = None, links: Optional[List[str]] = None,
+               page_url: Optional[str] = None) -> None:
+        """
+        Save the validators of a full (200) response; the page has changed, so it is no longer considered indexed.
+        """
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+        if size is None:
+            size = int(response.headers.get('Content-Length') or 0)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?, ?, ?, 0)",
+                              (url, etag, last_modified, size, json.dumps(links) if links is not None else None, page_url))
+
+    def set_links(self, url: str, links: List[str]) -> None:
+        """
+        Save the links found on a page whose validators were just recorded.
+        """
+        with self.lock:
+            self.conn.execute("UPDATE validators SET links=? WHERE url=?", (json.dumps(links), url))
+
+    def not_modified(self, url: str) -> bool:
+        """
+        Record that a conditional request for this URL returned 304 Not Modified.
+        Returns False if there is no record of this URL (the 304 can't be used, and the URL must be fetched again).
+        """
+        row = self._row(url)
+        if row is None:
+            return False
+        self.stats['not_modified'] += 1
+        self.stats['bytes_saved'] += row[2] or 0
+        self.not_modified_urls.add(url)
+        return True
+
+    def links(self, url: str) -> Optional[List[str]]:
+        """
+        Return the links saved for an unchanged page, or None if its links were not saved.
+        """
+        row = self._row(url)
+        return json.loads(row[3]) if row and row[3] is not None else None
+
+    def page_url(self, url: str) -> str:
+        row = self._row(url)
+        return row[4] if row and row[4] else url
+
+    def unchanged(self, url: str) -> bool:
+        """
+        True if this URL got a 304 in this run and was indexed successfully before, so it need not be re-indexed.
+        """
+        if url not in self.not_modified_urls:
+            return False
+        row = self._row(url)
+        if row is not None and row[5]:
+            self.stats['not_reindexed'] += 1
+            return True
+        return False
+
+    def mark_indexed(self, url: str) -> None:
+        with self.lock:
+            self.conn.execute("UPDATE validators SET indexed=1 WHERE url=?", (url,))
+
+    def report(self, stats: Optional[Dict[str, int]] = None) -> None:
+        """
+        Log the requests and bandwidth saved by conditional requests in this run (stats defaults to this store's).
+        """
+        stats = stats or self.stats
+        logging.info(f"Revalidation: {stats['not_modified']} of {stats['requests']} conditional requests returned 304 Not Modified, "
+                     f"saving {stats['bytes_saved'] / 1e6:.1f} MB of downloads; {stats['not_reindexed']} unchanged pages were not re-indexed")
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+    def __getstate__(self) -> dict:
+        # the connection and lock can't be pickled (e.g. when passed to a Ray actor); the copy reopens the file
+        state = self.__dict__.copy()
+        del state['conn'], state['lock']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._connect()
+
+def merge_revalidation_stats(stats: List[Optional[Dict[str, int]]]) -> Dict[str, int]:
+    """
+    Add up the revalidation stats of several workers.
+    """
+    merged = {'requests': 0, 'not_modified': 0, 'bytes_saved': 0, 'not_reindexed': 0}
+    for s in stats:
+        for k, v in (s or {}).items():
+            merged[k] += v
+    return merged
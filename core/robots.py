@@ -0,0 +1,95 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+from core.indexer import get_headers
+from core.utils import create_session_with_retries
+
+class RobotsCache:
+    """
+    Fetches and parses each host's robots.txt once, and answers whether URLs may be crawled and at what Crawl-delay.
+
+    A missing robots.txt (or one that can't be fetched) allows everything; a 401 or 403 response disallows everything,
+    following the conventions of urllib.robotparser. At most max_hosts parsed files are kept (least recently used are dropped).
+
+    Args:
+        user_agent (str): the user agent matched against robots.txt User-agent lines (falls back to '*' rules); defaults
+            to the one pages are requested with, so that the rules followed are those that apply to our requests.
+        timeout (float): timeout in seconds for fetching robots.txt.
+        max_hosts (int): maximum number of hosts to cache.
+    """
+    def __init__(self, user_agent: str = get_headers['User-Agent'], timeout: float = 10, max_hosts: int = 10_000):
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.max_hosts = max_hosts
+        self.parsers: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.thread_local = threading.local()
+
+    def _session(self):
+        if not hasattr(self.thread_local, 'session'):
+            self.thread_local.session = create_session_with_retries(retries=1)
+        return self.thread_local.session
+
+    def _fetch(self, site: str) -> RobotFileParser:
+        parser = RobotFileParser(site + '/robots.txt')
+        try:
+            response = self._session().get(site + '/robots.txt', headers=get_headers, timeout=self.timeout)
+            if response.status_code in (401, 403):
+                parser.disallow_all = True
+            elif response.status_code >= 400:
+                parser.allow_all = True
+            else:
+                parser.parse(response.text.splitlines())
+        except Exception as e:
+            logging.info(f"Failed to fetch {site}/robots.txt ({e}), assuming all URLs are allowed")
+            parser.allow_all = True
+        return parser
+
+    def _parser(self, url: str) -> RobotFileParser:
+        p = urlparse(url)
+        site = f"{p.scheme}://{p.netloc}"
+        with self.lock:
+            parser = self.parsers.get(site)
+            if parser is not None:
+                self.parsers.move_to_end(site)
+                return parser
+        parser = self._fetch(site)     # not under the lock, so one slow host does not block the others
+        with self.lock:
+            self.parsers[site] = parser
+            while len(self.parsers) > self.max_hosts:
+                self.parsers.popitem(last=False)
+        return parser
+
+    def allowed(self, url: str) -> bool:
+        return self._parser(url).can_fetch(self.user_agent, url)
+
+    def crawl_delay(self, url: str) -> float:
+        """
+        Minimum number of seconds between requests to this URL's host, from Crawl-delay or Request-rate (0 if not set).
+        """
+        parser = self._parser(url)
+        delay = parser.crawl_delay(self.user_agent)
+        if delay is not None:
+            return float(delay)
+        rate = parser.request_rate(self.user_agent)
+        if rate is not None and rate.requests > 0:
+            return rate.seconds / rate.requests
+        return 0.0
+
+    def sitemaps(self, url: str) -> List[str]:
+        return self._parser(url).site_maps() or []
+
+    def __getstate__(self) -> dict:
+        # locks and sessions can't be pickled (e.g. when passed to a Ray actor); the parsed files are kept
+        state = self.__dict__.copy()
+        del state['lock'], state['thread_local']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        self.thread_local = threading.local()
@@ -0,0 +1,186 @@
+import gzip
+import io
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, NamedTuple, Optional
+from urllib.parse import urljoin
+
+from lxml import etree
+
+from core.indexer import get_headers
+from core.robots import RobotsCache
+from core.utils import create_session_with_retries
+
+GZIP_MAGIC = b'\x1f\x8b'
+UTF8_BOM = b'\xef\xbb\xbf'
+
+class SitemapEntry(NamedTuple):
+    url: str
+    lastmod: Optional[str] = None
+    priority: Optional[float] = None
+
+def _child_texts(elem) -> dict:
+    """
+    Map the (namespace-less) tag names of an element's children to their text.
+    """
+    texts = {}
+    for child in elem:
+        tag = child.tag
+        if isinstance(tag, str) and child.text:
+            texts[tag.rpartition('}')[2]] = child.text.strip()
+    return texts
+
+def _to_float(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+def get_sitemaps_from_robots(homepage_url: str, session, timeout: float = 30) -> List[str]:
+    """
+    Return the sitemap URLs listed in the site's robots.txt.
+    """
+    robots_url = urljoin(homepage_url, '/robots.txt')
+    try:
+        response = session.get(robots_url, headers=get_headers, timeout=timeout)
+        response.raise_for_status()
+    except Exception as e:
+        logging.info(f"Failed to fetch robots.txt: {robots_url} due to {e}")
+        return []
+    sitemaps = []
+    for line in response.text.splitlines():
+        if line.strip().lower().startswith('sitemap:'):
+            sitemaps.append(urljoin(robots_url, line.split(':', 1)[1].strip()))
+    return sitemaps
+
+class SitemapWalker:
+    """
+    Streams the URLs listed in a website's sitemaps.
+
+    Sitemaps are found in robots.txt (and at /sitemap.xml), and are parsed incrementally with lxml's iterparse
+    while they download, so memory use does not grow with the size of the sitemap. Sitemap index files are
+    followed recursively, and gzipped sitemaps (.xml.gz) and plain text sitemaps are supported.
+    Child sitemaps are fetched and parsed concurrently by `max_workers` threads; parsed entries go through a
+    bounded queue, so a slow consumer pauses parsing rather than buffering the whole sitemap in memory.
+
+    Args:
+        max_workers (int): number of sitemaps fetched concurrently.
+        timeout (float): timeout in seconds for each HTTP request.
+        queue_size (int): maximum number of parsed entries waiting to be consumed.
+    """
+    def __init__(self, max_workers: int = 4, timeout: float = 60, queue_size: int = 10_000):
+        self.max_workers = max(max_workers, 1)
+        self.timeout = timeout
+        self.queue_size = queue_size
+        self.thread_local = threading.local()
+
+    def _session(self):
+        if not hasattr(self.thread_local, 'session'):
+            self.thread_local.session = create_session_with_retries(retries=2)
+        return self.thread_local.session
+
+    def _open(self, url: str):
+        response = self._session().get(url, headers=get_headers, timeout=self.timeout, stream=True)
+        response.raise_for_status()
+        response.raw.decode_content = True     # undo Content-Encoding: gzip
+        response.raw.auto_close = False         # let the buffered reader see EOF instead of a closed file
+        stream = io.BufferedReader(response.raw)
+        if stream.peek(2)[:2] == GZIP_MAGIC:   # a .xml.gz file
+            stream = io.BufferedReader(gzip.GzipFile(fileobj=stream))
+        return response, stream
+
+    def _parse(self, url: str, out: queue.Queue, stop: threading.Event) -> None:
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    out.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        response = None
+        try:
+            response, stream = self._open(url)
+            head = stream.peek(64)
+            if head.startswith(UTF8_BOM):
+                head = head[len(UTF8_BOM):]
+            if head.lstrip()[:1] != b'<':
+                # text sitemap: one URL per line
+                for line in io.TextIOWrapper(stream, encoding='utf-8-sig', errors='ignore'):
+                    line = line.strip()
+                    if line.startswith('http') and not put(('url', SitemapEntry(line))):
+                        return
+                return
+
+            for _, elem in etree.iterparse(stream, events=('end',), tag=('{*}url', '{*}sitemap', 'url', 'sitemap'),
+                                           recover=True, resolve_entities=False, no_network=True, huge_tree=True):
+                texts = _child_texts(elem)
+                loc = texts.get('loc')
+                if loc:
+                    if not loc.startswith('http'):
+                        loc = urljoin(url, loc)
+                    if elem.tag.endswith('sitemap'):
+                        item = ('sitemap', loc)
+                    else:
+                        item = ('url', SitemapEntry(loc, texts.get('lastmod') or None, _to_float(texts.get('priority'))))
+                    if not put(item):
+                        return
+                # free the parsed elements as we go
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+        except Exception as e:
+            logging.warning(f"Failed to fetch sitemap: {url} due to {e}")
+        finally:
+            if response is not None:
+                response.close()
+            put(('done', url))
+
+    def walk(self, sitemap_urls: List[str]) -> Iterator[SitemapEntry]:
+        """
+        Yield the entries of the given sitemaps (and of all sitemaps they link to), as they are parsed.
+        """
+        out: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        seen = set()
+        pending = 0
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='sitemap')
+        try:
+            for url in sitemap_urls:
+                if url not in seen:
+                    seen.add(url)
+                    pending += 1
+                    executor.submit(self._parse, url, out, stop)
+            while pending > 0:
+                kind, value = out.get()
+                if kind == 'url':
+                    yield value
+                elif kind == 'sitemap':
+                    if value not in seen:
+                        seen.add(value)
+                        pending += 1
+                        executor.submit(self._parse, value, out, stop)
+                else:
+                    pending -= 1
+        finally:
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def iter_site(self, homepage_url: str, robots: Optional[RobotsCache] = None) -> Iterator[SitemapEntry]:
+        """
+        Yield the entries of all sitemaps of a website: those listed in robots.txt, sitemap.xml under the homepage URL
+        (for sites under a sub-path) and /sitemap.xml.
+        If a RobotsCache is given, the site's (cached) robots.txt is used instead of fetching it again.
+        """
+        if robots is not None:
+            sitemaps = [urljoin(homepage_url, u) for u in robots.sitemaps(homepage_url)]
+        else:
+            sitemaps = get_sitemaps_from_robots(homepage_url, self._session(), self.timeout)
+        for default_sitemap in [urljoin(homepage_url, 'sitemap.xml'), urljoin(homepage_url, '/sitemap.xml')]:
+            if default_sitemap not in sitemaps:
+                sitemaps.append(default_sitemap)
+        logging.info(f"Reading sitemaps of {homepage_url}: {sitemaps}")
+        yield from self.walk(sitemaps)
@@ -0,0 +1,152 @@
+import re
+from typing import Any, Dict, List, Optional, Pattern, Tuple
+
+_LITERAL_SUFFIXES = ['', '.*', '.*$']
+_BACKREF = re.compile(r'\\[1-9]|\(\?P=')
+
+def _host(url: str) -> str:
+    start = url.find('://') + 3
+    end = url.find('/', start)
+    return url[start:end] if end >= 0 else url[start:]
+
+def _literal_prefix(pattern: str) -> Optional[str]:
+    """
+    If the regex is a literal string optionally followed by '.*' (e.g. 'https://docs\\.vectara\\.com/docs/.*'),
+    return that literal string; otherwise return None.
+    Note that an unescaped '.' matches any character, so patterns with unescaped dots are not literal.
+    """
+    literal = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            if i + 1 < len(pattern) and not pattern[i+1].isalnum():
+                literal.append(pattern[i+1])
+                i += 2
+                continue
+            return None
+        if c in '.^$*+?{}[]|()':
+            break
+        literal.append(c)
+        i += 1
+    if pattern[i:] not in _LITERAL_SUFFIXES or len(literal) == 0:
+        return None
+    return ''.join(literal)
+
+def _strip_wildcards(pattern: str) -> Tuple[str, bool]:
+    """
+    Rewrite a '.*X.*' pattern (used with re.match) as 'X' to be used with re.search, which is much faster
+    since it avoids backtracking over the leading '.*'. Returns the pattern and whether it should be searched.
+    (URLs have no newlines, so '.*' at the start can match any prefix.)
+    """
+    if pattern.endswith('.*') and not pattern.endswith('\\.*') and '|' not in pattern:
+        pattern = pattern[:-2]
+    if pattern.startswith('.*') and '|' not in pattern and len(pattern) > 2 and pattern[2] not in '?+*{':
+        return pattern[2:], True
+    return pattern, False
+
+class _Matcher:
+    """
+    Matches a URL against a list of regexes, with the same semantics as any(r.match(url) for r in regexes).
+    Literal-prefix patterns are indexed by host in a hash table; all other patterns are combined into
+    (at most) two regexes: one for patterns anchored at the start, and one for '.*X' patterns, used with search().
+    """
+    def __init__(self, regexes: List[Any]):
+        self.empty = len(regexes) == 0
+        self.prefixes_by_host: Dict[str, Tuple[str, ...]] = {}
+        self.any_host_prefixes: Tuple[str, ...] = ()
+        self.match_regex: Optional[Pattern] = None
+        self.search_regex: Optional[Pattern] = None
+        self.regex_list: List[Pattern] = []
+
+        patterns = []
+        for r in regexes:
+            p = r if isinstance(r, str) else r.pattern
+            flags = 0 if isinstance(r, str) else (r.flags & ~re.UNICODE)
+            prefix = _literal_prefix(p) if flags == 0 else None
+            if prefix is None:
+                patterns.append(r if not isinstance(r, str) else re.compile(r))
+                continue
+            host = _host(prefix) if '://' in prefix and '/' in prefix.split('://', 1)[1] else None
+            if host:
+                self.prefixes_by_host[host] = self.prefixes_by_host.get(host, ()) + (prefix,)
+            else:
+                self.any_host_prefixes += (prefix,)
+
+        # combine all other regexes into alternations; fall back to a list if they can't be combined
+        # (e.g. inline flags, or back-references whose group numbers would shift)
+        if len(patterns) > 0:
+            try:
+                if any(r.flags & ~re.UNICODE or _BACKREF.search(r.pattern) for r in patterns):
+                    raise re.error("not combinable")
+                to_match, to_search = [], []
+                for r in patterns:
+                    p, search = _strip_wildcards(r.pattern)
+                    (to_search if search else to_match).append(p)
+                if to_match:
+                    self.match_regex = re.compile('|'.join(f'(?:{p})' for p in to_match))
+                if to_search:
+                    self.search_regex = re.compile('|'.join(f'(?:{p})' for p in to_search))
+            except re.error:
+                self.match_regex = self.search_regex = None
+                self.regex_list = patterns
+
+    def match(self, url: str) -> bool:
+        if self.any_host_prefixes and url.startswith(self.any_host_prefixes):
+            return True
+        if self.prefixes_by_host:
+            prefixes = self.prefixes_by_host.get(_host(url))
+            if prefixes and url.startswith(prefixes):
+                return True
+        if self.search_regex is not None and self.search_regex.search(url):
+            return True
+        if self.match_regex is not None and self.match_regex.match(url):
+            return True
+        for r in self.regex_list:
+            if r.match(url):
+                return True
+        return False
+
+class UrlFilter:
+    """
+    Decides which URLs a crawler should follow, based on pos_regex/neg_regex and extensions to ignore.
+
+    A URL is accepted if it starts with 'http', does not end with one of `extensions_to_ignore`, matches at least
+    one of `pos_regex` (if empty: any URL matches, unless empty_pos_matches_all is False) and matches none of `neg_regex`.
+    Regexes use re.match() semantics, as in the rest of the crawlers. Checks run cheapest-first and short-circuit.
+
+    Args:
+        pos_regex (list): regex strings or compiled regexes for URLs to include.
+        neg_regex (list): regex strings or compiled regexes for URLs to exclude.
+        extensions_to_ignore (list): URL suffixes (like '.zip') to exclude.
+        empty_pos_matches_all (bool): whether an empty pos_regex accepts all URLs.
+    """
+    def __init__(self, pos_regex: List[Any] = [], neg_regex: List[Any] = [],
+                 extensions_to_ignore: List[str] = [], empty_pos_matches_all: bool = True):
+        self.pos = _Matcher(pos_regex)
+        self.neg = _Matcher(neg_regex)
+        self.extensions_to_ignore = tuple(set(extensions_to_ignore))
+        self.empty_pos_matches_all = empty_pos_matches_all
+
+    def matches_pos(self, url: str) -> bool:
+        if self.pos.empty:
+            return self.empty_pos_matches_all
+        return self.pos.match(url)
+
+    def matches_neg(self, url: str) -> bool:
+        return not self.neg.empty and self.neg.match(url)
+
+    def has_ignored_extension(self, url: str) -> bool:
+        return len(self.extensions_to_ignore) > 0 and url.endswith(self.extensions_to_ignore)
+
+    def accept(self, url: str) -> bool:
+        if not url.startswith('http'):
+            return False
+        if self.extensions_to_ignore and url.endswith(self.extensions_to_ignore):
+            return False
+        if self.pos.empty:
+            if not self.empty_pos_matches_all:
+                return False
+        elif not self.pos.match(url):
+            return False
+        return self.neg.empty or not self.neg.match(url)
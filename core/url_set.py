@@ -0,0 +1,165 @@
+import math
+import os
+import sqlite3
+import tempfile
+from hashlib import blake2b
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+def _hashes(url: str) -> Tuple[int, int]:
+    digest = blake2b(url.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+class BloomFilter:
+    """
+    A simple Bloom filter over a bytearray, sized for `capacity` items at the given false positive rate.
+    """
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = capacity
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def add(self, h1: int, h2: int) -> None:
+        bits, m = self.bits, self.num_bits
+        for i in range(self.num_hashes):
+            idx = (h1 + i * h2) % m
+            bits[idx >> 3] |= 1 << (idx & 7)
+        self.count += 1
+
+    def __contains__(self, hashes: Tuple[int, int]) -> bool:
+        h1, h2 = hashes
+        bits, m = self.bits, self.num_bits
+        for i in range(self.num_hashes):
+            idx = (h1 + i * h2) % m
+            if not bits[idx >> 3] & (1 << (idx & 7)):
+                return False
+        return True
+
+class UrlSet:
+    """
+    A memory-compact set of URLs, for crawls with millions of URLs.
+
+    URLs are kept in an on-disk SQLite table (the exact store), fronted by an in-memory Bloom filter, so that
+    memory use is roughly the size of the filter (about 1.2 bytes per URL at a 1% false positive rate) instead of
+    a full Python string per URL. Lookups of URLs that were never added are answered by the filter alone;
+    other lookups are confirmed against the SQLite table. The filter grows by adding layers of doubling size
+    when it fills up, so no capacity needs to be known in advance.
+
+    Supports `in`, add(), update(), len() and iteration (in insertion order), like a set.
+
+    Args:
+        path (str): path of the SQLite file; by default a temporary file that is removed by close().
+        capacity (int): number of URLs the first Bloom filter layer is sized for.
+        error_rate (float): Bloom filter false positive rate.
+        batch_size (int): number of added URLs buffered in memory before they are written to disk.
+    """
+    def __init__(self, urls: Optional[Iterable[str]] = None, path: Optional[str] = None,
+                 capacity: int = 100_000, error_rate: float = 0.01, batch_size: int = 10_000):
+        self.owner = path is None
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='urlset_', suffix='.db')
+            os.close(fd)
+        self.path = path
+        self.error_rate = error_rate
+        self.batch_size = batch_size
+        self.blooms: List[BloomFilter] = [BloomFilter(capacity, error_rate)]
+        self.pending: Dict[str, int] = {}     # url -> key in the urls table; ordered, so iteration follows insertion order
+        self.count = 0
+        self._connect()
+        for (url,) in self.conn.execute("SELECT url FROM urls"):     # reopen an existing store
+            self._bloom_add(_hashes(url))
+            self.count += 1
+        if urls is not None:
+            self.update(urls)
+
+    def _connect(self) -> None:
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=OFF")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS urls (h INTEGER, url TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS urls_h ON urls (h)")
+
+    def _bloom_add(self, hashes: Tuple[int, int]) -> None:
+        bloom = self.blooms[-1]
+        if bloom.count >= bloom.capacity:
+            bloom = BloomFilter(bloom.capacity * 2, self.error_rate)
+            self.blooms.append(bloom)
+        bloom.add(*hashes)
+
+    def _contains(self, url: str, hashes: Tuple[int, int]) -> bool:
+        if url in self.pending:
+            return True
+        if not any(hashes in bloom for bloom in self.blooms):
+            return False
+        row = self.conn.execute("SELECT 1 FROM urls WHERE h=? AND url=? LIMIT 1",
+                                (hashes[0] - (1 << 63), url)).fetchone()
+        return row is not None
+
+    def __contains__(self, url: object) -> bool:
+        if not isinstance(url, str):
+            return False
+        return self._contains(url, _hashes(url))
+
+    def add(self, url: str) -> None:
+        hashes = _hashes(url)
+        if self._contains(url, hashes):
+            return
+        self._bloom_add(hashes)
+        self.pending[url] = hashes[0] - (1 << 63)
+        self.count += 1
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def update(self, urls: Iterable[str]) -> None:
+        for url in urls:
+            self.add(url)
+
+    def flush(self) -> None:
+        if len(self.pending) == 0:
+            return
+        self.conn.executemany("INSERT INTO urls (h, url) VALUES (?, ?)", ((h, url) for url, h in self.pending.items()))
+        self.conn.commit()
+        self.pending = {}
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[str]:
+        self.flush()
+        cursor = self.conn.execute("SELECT url FROM urls ORDER BY rowid")
+        while True:
+            rows = cursor.fetchmany(10_000)
+            if len(rows) == 0:
+                break
+            for row in rows:
+                yield row[0]
+
+    def memory_size(self) -> int:
+        """
+        Approximate number of bytes used in memory (Bloom filters only, excluding the pending batch).
+        """
+        return sum(len(bloom.bits) for bloom in self.blooms)
+
+    def close(self) -> None:
+        self.conn.close()
+        if self.owner and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __del__(self) -> None:
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __getstate__(self) -> dict:
+        # sqlite connections can't be pickled (e.g. when passed to a Ray actor); the copy reopens the same file
+        self.flush()
+        state = self.__dict__.copy()
+        del state['conn']
+        state['owner'] = False
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._connect()
@@ -7,8 +7,10 @@ from bs4 import BeautifulSoup
 import xml.etree.ElementTree as ET
 from urllib.parse import urljoin, urlparse
 from slugify import slugify
+from lxml import etree
 
 import re
+from functools import lru_cache
 from typing import List, Set
 import os
 import sys
@@ -31,6 +33,9 @@ try:
 except ImportError:
     logging.info("Presidio is not installed. if PII detection and masking is requested - it will not work.")
 
+from core.rate_limit import RateLimiter     # noqa: F401 (kept here for existing imports)
+from core.docs_extract import iter_text, parse_html, removal_xpaths
+
 img_extensions = [".gif", ".jpeg", ".jpg", ".mp3", ".mp4", ".png", ".svg", ".bmp", ".eps", ".ico"]
 doc_extensions = [".doc", ".docx", ".ppt", ".pptx", ".xls", ".xlsx", ".pdf", ".ps"]
 archive_extensions = [".zip", ".gz", ".tar", ".bz2", ".7z", ".rar"]
@@ -131,39 +136,30 @@ def remove_code_from_html(html: str) -> str:
         element.decompose()
     return str(soup)
 
+@lru_cache(maxsize=64)
+def _removal_xpath(remove_code: bool, ids: tuple, tags: tuple, classes: tuple) -> etree.XPath:
+    # all the elements html_to_text() drops, in one XPath compiled once per html_processing setting
+    xpaths = ['//script', '//style'] + (['//code'] if remove_code else [])
+    xpaths += removal_xpaths(ids, tags, classes)
+    return etree.XPath(' | '.join(xpaths))
+
 def html_to_text(html: str, remove_code: bool = False, html_processing: dict = {}) -> str:
     """Convert HTML to text, optionally removing code blocks."""
-
-    # Remove code blocks if specified
-    if remove_code:
-        html = remove_code_from_html(html)
-
-    # Initialize BeautifulSoup
-    soup = BeautifulSoup(html, 'html5lib')
-
-    # Remove unwanted HTML elements
-    for element in soup.find_all(['script', 'style']):
-        element.decompose()
-
-    # remove any HTML items with the specified IDs
-    ids_to_remove = html_processing.get('ids_to_remove', [])
-    for id in ids_to_remove:
-        for element in soup.find_all(id=id):
-            element.decompose()
-
-    # remove any HTML tags in the list
-    tags_to_remove = html_processing.get('tags_to_remove', [])
-    for tag in tags_to_remove:
-        for element in soup.find_all(tag):
-            element.decompose()
-
-    # remove any elements with these classes
-    classes_to_remove = html_processing.get('classes_to_remove', [])
-    for class_name in classes_to_remove:
-        for element in soup.find_all(class_=class_name):
-            element.decompose()
-        
-    text = soup.get_text(' ', strip=True).replace('\n', ' ')
+    if not html or not html.strip():
+        return ''
+    try:
+        doc = parse_html(html)
+    except etree.ParserError:
+        return ''
+
+    # skip code blocks (if specified), scripts, styles and the elements with the ids, tags and classes to remove,
+    # found in a single pass; the text on either side of a skipped element stays separated, as with get_text(' ')
+    removal = _removal_xpath(remove_code, tuple(html_processing.get('ids_to_remove', [])),
+                             tuple(html_processing.get('tags_to_remove', [])),
+                             tuple(html_processing.get('classes_to_remove', [])))
+    removed = set(removal(doc))
+
+    text = ' '.join(s for s in (t.strip() for t in iter_text(doc, removed)) if s).replace('\n', ' ')
     return text
 
 def safe_remove_file(file_path: str):
@@ -172,15 +168,15 @@ def safe_remove_file(file_path: str):
     except Exception as e:
         logging.info(f"Failed to remove file: {file_path} due to {e}")
 
-def create_session_with_retries(retries: int = 5) -> requests.Session:
-    """Create a requests session with retries."""
+def create_session_with_retries(retries: int = 5, pool_maxsize: int = 10) -> requests.Session:
+    """Create a requests session with retries, keeping up to pool_maxsize connections open per host."""
     session = requests.Session()
     retry_strategy = Retry(
         total=retries,
         status_forcelist=[429, 430, 443, 500, 502, 503, 504],  # A set of integer HTTP status codes that we should force a retry on.
         backoff_factor=1,
     )
-    adapter = requests.adapters.HTTPAdapter(max_retries=retry_strategy)
+    adapter = requests.adapters.HTTPAdapter(max_retries=retry_strategy, pool_maxsize=pool_maxsize)
     session.mount('http://', adapter)
     session.mount('https://', adapter)
     return session
@@ -270,83 +266,9 @@ def mask_pii(text: str) -> str:
     anonymized_text = anonymizer.anonymize(text=text, analyzer_results=results)
     return str(anonymized_text.text)
 
-# Rate Limiter class
-# Existing packages are not well maintained so we create our own (using ChatGPT)
-class RateLimiter:
-    def __init__(self, max_rate):
-        self.max_rate = max_rate
-        self.lock = threading.Lock()
-        self.condition = threading.Condition(self.lock)
-        self.num_executions = 0
-        self.start_time = time.time()
-
-    def __enter__(self):
-        with self.lock:
-            current_time = time.time()
-            elapsed_time = current_time - self.start_time
-
-            if elapsed_time >= 1:
-                # Reset counter and timer after a second
-                self.num_executions = 0
-                self.start_time = current_time
-            else:
-                if self.num_executions >= self.max_rate:
-                    # Wait until the second is up if limit is reached
-                    time_to_wait = 1 - elapsed_time
-                    self.condition.wait(timeout=time_to_wait)
-                    # Reset after waiting
-                    self.num_executions = 0
-                    self.start_time = time.time()
-
-            # Increment the count of executions
-            self.num_executions += 1
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        with self.lock:
-            self.condition.notify()
-
 def get_urls_from_sitemap(homepage_url):
-    
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    # Helper function to fetch and parse XML
-    def fetch_sitemap(sitemap_url):
-        try:
-            response = requests.get(sitemap_url, headers=headers)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.content, 'xml')
-            return soup
-        except requests.exceptions.RequestException as e:
-            logging.warning(f"Failed to fetch sitemap: {sitemap_url} due to {e}")
-            return None
-    
-    # Step 1: Check for standard sitemap.xml
-    sitemap_url = urljoin(homepage_url, 'sitemap.xml')
-    soup = fetch_sitemap(sitemap_url)
-    
-    sitemaps = []
-    if soup:
-        sitemaps.append(sitemap_url)
-    
-    # Step 2: Check for sitemaps in robots.txt
-    robots_url = urljoin(homepage_url, 'robots.txt')
-    try:
-        response = requests.get(robots_url, headers=headers)
-        response.raise_for_status()
-        for line in response.text.split('\n'):
-            if line.lower().startswith('sitemap:'):
-                sitemap_url = line.split(':', 1)[1].strip()
-                sitemaps.append(sitemap_url)
-    except requests.exceptions.RequestException as e:
-        logging.info(f"Failed to fetch robots.txt: {robots_url} due to {e}")
-    
-    # Step 3: Extract URLs from all found sitemaps
-    urls = set()
-    for sitemap in sitemaps:
-        soup = fetch_sitemap(sitemap)
-        if soup:
-            for loc in soup.find_all('loc'):
-                urls.add(loc.text.strip())
-    
-    return list(urls)
+    """
+    Return the list of URLs in all sitemaps of a website (see core.sitemap.SitemapWalker for a streaming version).
+    """
+    from core.sitemap import SitemapWalker
+    return list(set(entry.url for entry in SitemapWalker().iter_site(homepage_url)))
@@ -0,0 +1,258 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+import uuid
+import zlib
+from datetime import datetime, timezone
+from http.client import responses as http_reasons
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from requests.structures import CaseInsensitiveDict
+
+# value of the WARC-Vectara-Fetch header, telling how a record was fetched
+PAGE = 'page'            # raw HTTP GET of a web page (e.g. by the docs crawler)
+DOWNLOAD = 'download'    # raw HTTP GET of a file (e.g. a PDF linked from a web page)
+RENDER = 'render'        # page rendered with playwright
+
+_CHUNK = 1 << 20
+
+def _warc_record(warc_type: str, url: str, content_type: str, block: bytes, extra: Dict[str, str] = {}) -> Tuple[str, bytes]:
+    record_id = f"<urn:uuid:{uuid.uuid4()}>"
+    headers = {
+        'WARC-Type': warc_type,
+        'WARC-Record-ID': record_id,
+        'WARC-Date': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'WARC-Target-URI': url,
+        'Content-Type': content_type,
+        'Content-Length': str(len(block)),
+        **extra,
+    }
+    head = 'WARC/1.1\r\n' + ''.join(f"{k}: {v}\r\n" for k, v in headers.items()) + '\r\n'
+    return record_id, head.encode('utf-8') + block + b'\r\n\r\n'
+
+def _http_block(status: int, headers: Dict[str, str], body: bytes) -> bytes:
+    # the body is stored decoded, so drop headers that describe the transfer encoding
+    skip = {'content-encoding', 'transfer-encoding', 'content-length'}
+    lines = [f"HTTP/1.1 {status} {http_reasons.get(status, '')}"]
+    lines += [f"{k}: {v}" for k, v in headers.items() if k.lower() not in skip]
+    lines.append(f"Content-Length: {len(body)}")
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8', 'replace') + body
+
+def _parse_headers(data: bytes) -> Tuple[str, CaseInsensitiveDict]:
+    lines = data.decode('utf-8', 'replace').split('\r\n')
+    headers: CaseInsensitiveDict = CaseInsensitiveDict()
+    for line in lines[1:]:
+        if ':' in line:
+            k, v = line.split(':', 1)
+            headers[k.strip()] = v.strip()
+    return lines[0], headers
+
+def _parse_record(data: bytes) -> Tuple[CaseInsensitiveDict, bytes]:
+    head, _, rest = data.partition(b'\r\n\r\n')
+    _, headers = _parse_headers(head)
+    return headers, rest[:int(headers.get('Content-Length', len(rest)))]
+
+def _iter_members(path: str) -> Iterator[Tuple[int, bytes]]:
+    """
+    Yield the offset and decompressed content of each gzip member (one WARC record each) of a .warc.gz file.
+    """
+    with open(path, 'rb') as f:
+        offset = 0
+        buf = f.read(_CHUNK)
+        while buf:
+            start = offset
+            d = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            out = []
+            while True:
+                out.append(d.decompress(buf))
+                offset += len(buf) - len(d.unused_data)
+                if d.eof:
+                    buf = d.unused_data or f.read(_CHUNK)
+                    break
+                buf = f.read(_CHUNK)
+                if not buf:
+                    logging.warning(f"Truncated WARC record at offset {start} of {path}")
+                    return
+            yield start, b''.join(out)
+
+def _read_member(path: str, offset: int) -> bytes:
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        d = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        out = []
+        while not d.eof:
+            buf = f.read(_CHUNK)
+            if not buf:
+                break
+            out.append(d.decompress(buf))
+        return b''.join(out)
+
+class ReplayResponse:
+    """
+    A response served from a WARC archive, with the parts of the requests.Response interface the crawlers use.
+    """
+    def __init__(self, url: str, status_code: int, headers: CaseInsensitiveDict, content: bytes):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', 'replace')
+
+    def iter_content(self, chunk_size: int = 8192) -> Iterator[bytes]:
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i+chunk_size]
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            import requests
+            raise requests.HTTPError(f"{self.status_code} Error (replayed from WARC) for url: {self.url}")
+
+    def close(self) -> None:
+        pass
+
+class WarcWriter:
+    """
+    Writes fetched responses and rendered pages to gzipped WARC 1.1 files in `directory`, so that a crawl can be
+    replayed offline with WarcArchive. Each process writes its own files, rotated once they reach `max_size` bytes.
+    Raw HTTP responses are written as 'response' records; rendered pages as a 'resource' record with the HTML,
+    followed by a 'metadata' record (JSON) with the final URL, title, extracted text and links.
+    Can be used from several threads.
+
+    Args:
+        directory (str): folder to write the WARC files to.
+        max_size (int): maximum size of a WARC file.
+    """
+    def __init__(self, directory: str, max_size: int = 1 << 30):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+        self.file = None
+        self.file_count = 0
+        self.prefix = f"capture-{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.lock = threading.Lock()
+
+    def _write(self, records: List[bytes]) -> None:
+        with self.lock:
+            if self.file is not None and self.file.tell() >= self.max_size:
+                self.file.close()
+                self.file = None
+            if self.file is None:
+                self.file_count += 1
+                path = os.path.join(self.directory, f"{self.prefix}-{self.file_count:05d}.warc.gz")
+                self.file = open(path, 'ab')
+                info = "software: vectara-ingest\r\nformat: WARC File Format 1.1\r\n".encode('utf-8')
+                self.file.write(gzip.compress(_warc_record('warcinfo', '', 'application/warc-fields', info)[1]))
+            for record in records:
+                self.file.write(gzip.compress(record))
+            self.file.flush()
+
+    def write_response(self, url: str, status: int, headers: Dict[str, str], body: bytes, fetch: str = PAGE) -> None:
+        """
+        Write a raw HTTP response (fetch is PAGE or DOWNLOAD).
+        """
+        block = _http_block(status, headers, body)
+        _, record = _warc_record('response', url, 'application/http;msgtype=response', block, {'WARC-Vectara-Fetch': fetch})
+        self._write([record])
+
+    def write_rendered(self, url: str, res: Dict[str, Any]) -> None:
+        """
+        Write a page rendered with playwright (the result of Indexer.fetch_page_contents).
+        """
+        record_id, resource = _warc_record('resource', url, 'text/html; charset=utf-8', (res['html'] or '').encode('utf-8'),
+                                           {'WARC-Vectara-Fetch': RENDER})
+        meta = json.dumps({'url': res['url'], 'title': res['title'], 'text': res['text'], 'links': res['links']}).encode('utf-8')
+        _, metadata = _warc_record('metadata', url, 'application/json', meta,
+                                   {'WARC-Vectara-Fetch': RENDER, 'WARC-Refers-To': record_id})
+        self._write([resource, metadata])
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def __getstate__(self) -> dict:
+        # open files and locks can't be pickled (e.g. when passed to a Ray actor); each copy writes its own files
+        state = self.__dict__.copy()
+        del state['file'], state['lock']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.file = None
+        self.file_count = 0
+        self.prefix = f"capture-{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.lock = threading.Lock()
+
+class WarcArchive:
+    """
+    Serves responses and rendered pages from the WARC files in `directory` (as written by WarcWriter), to replay a
+    crawl offline. Opening the archive scans all files once to index their records by URL; records are then read
+    from disk on demand. If a URL was captured more than once, the last capture is served.
+
+    Args:
+        directory (str): folder with the .warc.gz files.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.responses: Dict[Tuple[str, str], Tuple[str, int]] = {}    # (fetch, url) -> (path, offset)
+        self.rendered: Dict[str, Tuple[str, int, int]] = {}             # url -> (path, resource offset, metadata offset)
+        resources: Dict[str, Tuple[str, int]] = {}
+        paths = sorted(glob.glob(os.path.join(directory, '*.warc.gz')))
+        for path in paths:
+            for offset, data in _iter_members(path):
+                headers, _ = _parse_record(data)
+                url = headers.get('WARC-Target-URI', '')
+                fetch = headers.get('WARC-Vectara-Fetch', PAGE)
+                warc_type = headers.get('WARC-Type')
+                if warc_type == 'response':
+                    self.responses[(fetch, url)] = (path, offset)
+                elif warc_type == 'resource' and fetch == RENDER:
+                    resources[headers['WARC-Record-ID']] = (path, offset)
+                elif warc_type == 'metadata' and fetch == RENDER and headers.get('WARC-Refers-To') in resources:
+                    # WarcWriter writes both records of a rendered page to the same file
+                    _, res_offset = resources.pop(headers['WARC-Refers-To'])
+                    self.rendered[url] = (path, res_offset, offset)
+        logging.info(f"Opened WARC archive {directory}: {len(paths)} files, {len(self.rendered)} rendered pages and "
+                     f"{len(self.responses)} responses")
+
+    def urls(self) -> List[str]:
+        """
+        Return the URLs of all rendered pages and downloaded files in the archive.
+        """
+        return list(set(self.rendered.keys()) | set(u for fetch, u in self.responses.keys() if fetch == DOWNLOAD))
+
+    def has_download(self, url: str) -> bool:
+        return (DOWNLOAD, url) in self.responses
+
+    def get_response(self, url: str, fetch: str = PAGE) -> Optional[ReplayResponse]:
+        """
+        Return the archived raw HTTP response for this URL, or None if it was not captured.
+        """
+        location = self.responses.get((fetch, url))
+        if location is None:
+            return None
+        _, block = _parse_record(_read_member(*location))
+        head, _, body = block.partition(b'\r\n\r\n')
+        status_line, headers = _parse_headers(head)
+        status = int(status_line.split(' ')[1]) if len(status_line.split(' ')) > 1 else 200
+        return ReplayResponse(url, status, headers, body)
+
+    def get_rendered(self, url: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the archived rendering of this URL, in the format of Indexer.fetch_page_contents(), or None.
+        """
+        location = self.rendered.get(url)
+        if location is None:
+            return None
+        path, resource_offset, metadata_offset = location
+        _, meta = _parse_record(_read_member(path, metadata_offset))
+        res = json.loads(meta)
+        res['html'] = _parse_record(_read_member(path, resource_offset))[1].decode('utf-8', 'replace')
+        return res
@@ -0,0 +1,226 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from core.index_queue import IndexQueue
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+class ShardedWorkQueue:
+    """
+    Durable queue of work units (URLs, row ranges, files, ...) shared by several ingest.py processes, possibly on
+    different nodes, through a SQLite file on shared storage, so that they can split one crawl job between them.
+
+    One process at a time is the producer (see claim_producer()): it discovers the work units and put()s them in the
+    queue, then seal()s it. All processes, the producer included, consume() the units: each unit is leased to one
+    process at a time, and acknowledged once processed. A lease that is not acknowledged within `lease_seconds`
+    (e.g. because its process died) expires, and the unit is leased again to another process, up to `max_attempts`
+    times. Leases are renewed while their process is alive, and so is the producer's claim: if the producer dies
+    before sealing the queue, another process takes over discovery. Units already in the queue are never added twice.
+
+    The file is the state of the job: restarting processes with the same file resumes the job, and a new job needs a
+    new (or deleted) file. The shared storage must support file locks (SQLite with its default rollback journal).
+    put() and ack() are buffered and written in batches, to keep transactions on shared storage few.
+
+    Args:
+        path (str): path of the SQLite file, on storage shared by all processes.
+        lease_seconds (float): how long a process may hold a unit (or the producer claim) without renewing it.
+        max_attempts (int): maximum number of times a unit is leased before it is given up as failed.
+        batch_size (int): number of units leased at once (at least as many as the IndexQueue can have in flight).
+    """
+    def __init__(self, path: str, lease_seconds: float = 600, max_attempts: int = 3, batch_size: int = 16):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.batch_size = batch_size
+        self.owner = f"{socket.gethostname()}-{os.getpid()}"
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=60, isolation_level=None)
+        self.lock = threading.Lock()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS work (key TEXT PRIMARY KEY, seq INTEGER, state TEXT, owner TEXT, expires REAL,
+                                             attempts INTEGER DEFAULT 0);
+            CREATE INDEX IF NOT EXISTS work_state ON work (state, seq);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self.to_put: List[str] = []
+        self.to_ack: List[tuple] = []
+        self.is_producer = False
+        self.last_write = self.last_heartbeat = time.time()
+        self.counts = {'leased': 0, 'done': 0, 'failed': 0}
+        logging.info(f"Using shared work queue {path} as {self.owner}")
+
+    def _transaction(self, statements: List[tuple]) -> None:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in statements:
+                    if isinstance(params, list):
+                        self.conn.executemany(sql, params)
+                    else:
+                        self.conn.execute(sql, params)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _meta(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def claim_producer(self) -> bool:
+        """
+        Become the producer, if the queue is not sealed and no other live process is the producer.
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            rows = dict(self.conn.execute("SELECT key, value FROM meta WHERE key IN ('sealed', 'producer', 'producer_expires')").fetchall())
+            claimed = 'sealed' not in rows and (rows.get('producer') in (None, self.owner) or float(rows['producer_expires']) < now)
+            if claimed:
+                self.conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                      [('producer', self.owner), ('producer_expires', str(now + self.lease_seconds))])
+            self.conn.execute("COMMIT")
+        if claimed:
+            logging.info(f"{self.owner} is the producer of the shared work queue {self.path}")
+        self.is_producer = claimed
+        return claimed
+
+    def _producer_lost(self) -> bool:
+        expires = self._meta('producer_expires')
+        return expires is None or float(expires) < time.time()
+
+    def sealed(self) -> bool:
+        return self._meta('sealed') is not None
+
+    def put(self, key: str) -> None:
+        """
+        Add a work unit (buffered). put(), idle_slots() and join() mirror IndexQueue, so that the producer can
+        discover units with the same code that would otherwise index them directly.
+        """
+        self.to_put.append(key)
+        if len(self.to_put) >= 1000 or time.time() - self.last_write >= 5:
+            self.flush()
+
+    def idle_slots(self) -> int:
+        return 0
+
+    def join(self) -> None:
+        self.flush()
+
+    def seal(self) -> None:
+        """
+        Record that all work units were added, so that consumers can tell when the job is done.
+        """
+        self.flush()
+        self._transaction([("INSERT OR REPLACE INTO meta (key, value) VALUES ('sealed', ?)", (self.owner,))])
+        logging.info(f"Sealed the shared work queue {self.path}: {self.stats()}")
+
+    def ack(self, key: str, succeeded: bool = True) -> None:
+        """
+        Acknowledge a leased unit (buffered). A unit that failed is leased again later, until max_attempts.
+        """
+        self.to_ack.append((key, succeeded))
+        self.counts['done' if succeeded else 'failed'] += 1
+        if len(self.to_ack) >= 100 or time.time() - self.last_write >= 5:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write the buffered units and acknowledgements, and renew this process's leases if they are due.
+        """
+        now = time.time()
+        statements: List[tuple] = []
+        if self.to_put:
+            with self.lock:
+                seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM work").fetchone()[0]
+            statements.append(("INSERT OR IGNORE INTO work (key, seq, state) VALUES (?, ?, ?)",
+                               [(key, seq + i + 1, PENDING) for i, key in enumerate(self.to_put)]))
+        if self.to_ack:
+            statements.append(("UPDATE work SET state=?, owner=NULL WHERE key=? AND owner=? AND state=?",
+                               [(DONE if ok else PENDING, key, self.owner, LEASED) for key, ok in self.to_ack]))
+            statements.append(("UPDATE work SET state=? WHERE state=? AND attempts>=?", (FAILED, PENDING, self.max_attempts)))
+        if now - self.last_heartbeat >= self.lease_seconds / 3:
+            statements.append(("UPDATE work SET expires=? WHERE owner=? AND state=?", (now + self.lease_seconds, self.owner, LEASED)))
+            if self.is_producer and not self.sealed():
+                statements.append(("UPDATE meta SET value=? WHERE key='producer_expires'", (str(now + self.lease_seconds),)))
+            self.last_heartbeat = now
+        if statements:
+            self._transaction(statements)
+        self.to_put.clear()
+        self.to_ack.clear()
+        self.last_write = now
+
+    def lease(self, n: int) -> List[str]:
+        """
+        Lease up to n units to this process: pending units first, in the order they were added, then expired leases.
+        """
+        self.flush()
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("UPDATE work SET state=?, owner=NULL WHERE state=? AND expires<? AND attempts>=?",
+                                  (FAILED, LEASED, now, self.max_attempts))
+                keys = [r[0] for r in self.conn.execute(
+                    "SELECT key FROM work WHERE state=? OR (state=? AND expires<?) ORDER BY state DESC, seq LIMIT ?",
+                    (PENDING, LEASED, now, n)).fetchall()]
+                self.conn.executemany("UPDATE work SET state=?, owner=?, expires=?, attempts=attempts+1 WHERE key=?",
+                                      [(LEASED, self.owner, now + self.lease_seconds, k) for k in keys])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        self.counts['leased'] += len(keys)
+        return keys
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return the number of units in each state.
+        """
+        with self.lock:
+            return dict(self.conn.execute("SELECT state, COUNT(*) FROM work GROUP BY state").fetchall())
+
+    def finished(self) -> bool:
+        stats = self.stats()
+        return self.sealed() and stats.get(PENDING, 0) + stats.get(LEASED, 0) == 0
+
+    def consume(self, index_queue: IndexQueue, poll_seconds: float = 5) -> bool:
+        """
+        Lease units and put() them on an IndexQueue (whose on_result must ack() them), until all units of the job
+        are done or failed. Returns True then, or False if the producer died before sealing the queue, in which case
+        the caller should claim_producer() and discover the units again.
+        """
+        batch_size = max(index_queue.max_pending if index_queue.remote else 1, self.batch_size)
+        while True:
+            keys = self.lease(batch_size)
+            for key in keys:
+                index_queue.put(key)
+            if keys:
+                continue
+            index_queue.join()
+            self.flush()
+            if self.finished():
+                logging.info(f"Shared work queue {self.path} is done: {self.stats()}; this process leased {self.counts['leased']} "
+                             f"units ({self.counts['done']} succeeded, {self.counts['failed']} failed attempts)")
+                return True
+            if not self.sealed() and self._producer_lost():
+                logging.warning(f"The producer of the shared work queue {self.path} stopped before adding all work units")
+                return False
+            time.sleep(poll_seconds)
+
+    def failed(self) -> List[str]:
+        with self.lock:
+            return [r[0] for r in self.conn.execute("SELECT key FROM work WHERE state=? ORDER BY seq", (FAILED,)).fetchall()]
+
+    def close(self) -> None:
+        self.flush()
+        self.conn.close()
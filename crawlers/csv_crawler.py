@@ -7,6 +7,8 @@ import psutil
 import ray
 
 from core.indexer import Indexer
+from core.work_queue import ShardedWorkQueue
+from core.index_queue import IndexQueue
 from core.utils import setup_logging
 
 class DFIndexer(object):
@@ -30,7 +32,7 @@ class DFIndexer(object):
         self.indexer.setup(use_playwright=False)
         setup_logging()
 
-    def process(self, doc_id: str, df: pd.DataFrame) -> None:
+    def process(self, doc_id: str, df: pd.DataFrame) -> int:
         texts = []
         titles = []
         metadatas = []
@@ -50,12 +52,13 @@ class DFIndexer(object):
             if len(df[column].unique())==1 and not pd.isnull(df[column].iloc[0]):
                 doc_metadata[column] = df[column].iloc[0]
         title = titles[0] if titles else doc_id
-        self.indexer.index_segments(doc_id, texts=texts, titles=titles, metadatas=metadatas, 
-                                    doc_title=title, doc_metadata = doc_metadata)
+        succeeded = self.indexer.index_segments(doc_id, texts=texts, titles=titles, metadatas=metadatas, 
+                                                doc_title=title, doc_metadata = doc_metadata)
         gc.collect()
         self.count += 1
         if self.count % 100==0:
             logging.info(f"Indexed {self.count} documents in actor {ray.get_runtime_context().get_actor_id()}")
+        return 0 if succeeded else -1
 
 
 class CsvCrawler(Crawler):
@@ -80,16 +83,19 @@ class CsvCrawler(Crawler):
                     doc_id = ' - '.join([str(x) for x in name if x])
                 dfs_to_index.append((doc_id, group))
         else:
-            if rows_per_chunk < len(df):
+            if rows_per_chunk > len(df):
                 rows_per_chunk = len(df)
             for inx in range(0, df.shape[0], rows_per_chunk):
                 sub_df = df[inx: inx+rows_per_chunk]
                 name = f'rows {inx}-{inx+rows_per_chunk-1}'
-                dfs_to_index.append((doc_id, sub_df))
+                dfs_to_index.append((name, sub_df))
         
         if ray_workers == -1:
             ray_workers = psutil.cpu_count(logical=True)
 
+        # in a sharded job, each process loads the same file, and indexes the documents it leases from the shared work queue
+        work_queue = self.open_work_queue()
+
         if ray_workers > 0:
             logging.info(f"Using {ray_workers} ray workers")
             self.indexer.p = self.indexer.browser = None
@@ -97,13 +103,39 @@ class CsvCrawler(Crawler):
             actors = [ray.remote(DFIndexer).remote(self.indexer, self, title_column, text_columns, metadata_columns, source) for _ in range(ray_workers)]
             for a in actors:
                 a.setup.remote()
-            pool = ray.util.ActorPool(actors)
-            _ = list(pool.map(lambda a, args_inx: a.process.remote(args_inx[0], args_inx[1]), dfs_to_index))
+            # documents are queued by their position, since several groups may have the same doc_id
+            if work_queue:
+                self.index_sharded(work_queue, len(dfs_to_index),
+                                   self.make_ray_queue(actors, lambda a, i: a.process.remote(*dfs_to_index[int(i)]),
+                                                       lambda i, res: work_queue.ack(i, res != -1), label=lambda i: dfs_to_index[int(i)][0]))
+                return
+            index_queue = self.make_ray_queue(actors, lambda a, i: a.process.remote(*dfs_to_index[i]), label=lambda i: dfs_to_index[i][0])
+            for i in range(len(dfs_to_index)):
+                index_queue.put(i)
+            index_queue.join()
         else:
             crawl_worker = DFIndexer(self.indexer, self, title_column, text_columns, metadata_columns, source)
+            if work_queue:
+                self.index_sharded(work_queue, len(dfs_to_index),
+                                   IndexQueue([crawl_worker], lambda w, i: w.process(*dfs_to_index[int(i)]),
+                                              lambda i, res: work_queue.ack(i, res != -1), label=lambda i: dfs_to_index[int(i)][0]))
+                return
             for df_tuple in dfs_to_index:
                 crawl_worker.process(df_tuple[0], df_tuple[1])
 
+    def index_sharded(self, work_queue: ShardedWorkQueue, num_docs: int, index_queue: IndexQueue) -> None:
+        # the producer adds the positions of all documents to the shared queue (every process loads the same file,
+        # so they are the same everywhere), then all processes index the documents they lease
+        while True:
+            if work_queue.claim_producer():
+                for i in range(num_docs):
+                    work_queue.put(str(i))
+                work_queue.seal()
+            # consume() returns False if the producer died before adding all documents; another process then takes over
+            if work_queue.consume(index_queue):
+                break
+        work_queue.close()
+
     def crawl(self) -> None:
         text_columns = list(self.cfg.csv_crawler.get("text_columns", []))
         title_column = self.cfg.csv_crawler.get("title_column", None)
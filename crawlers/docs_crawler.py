@@ -1,38 +1,64 @@
 from core.crawler import Crawler
-from bs4 import BeautifulSoup
+import lxml.html
 import logging
 from urllib.parse import urljoin, urlparse
 import re
 from collections import deque
-from core.utils import create_session_with_retries, binary_extensions, RateLimiter, setup_logging
-from typing import Tuple, Set
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from core.utils import create_session_with_retries, binary_extensions, setup_logging
+from core.rate_limit import RateLimiter, create_shared_backend
+from core.host_scheduler import HostScheduler
+from typing import Any, Callable, Dict, Tuple, Set, List, Optional
+from core.checkpoint import CrawlCheckpoint, DONE, ERROR
+from core.url_set import UrlSet
+from core.url_filter import UrlFilter
 from core.indexer import Indexer
+from core.index_queue import IndexQueue
+from core.revalidation import ValidatorStore, merge_revalidation_stats
+from core.html_cache import HtmlCache
+from core.docs_extract import get_docs_extractor
+import os
 import psutil
 import ray
 
+# docs systems that generate static HTML, whose pages can be indexed without rendering them in a browser
+STATIC_DOCS_SYSTEMS = ['sphinx', 'mkdocs', 'docusaurus', 'javadoc', 'hugo', 'jekyll', 'readthedocs']
+
 class UrlCrawlWorker(object):
-    def __init__(self, indexer: Indexer, crawler: Crawler, num_per_second: int):
+    def __init__(self, indexer: Indexer, crawler: Crawler, num_per_second: int, rate_backend=None):
         self.indexer = indexer
         self.crawler = crawler
-        self.rate_limiter = RateLimiter(num_per_second)
+        self.rate_limiter = RateLimiter(num_per_second, backend=rate_backend)
 
     def setup(self):
         self.indexer.setup()
         setup_logging()
 
+    def revalidation_stats(self):
+        return self.indexer.validators.stats if self.indexer.validators else None
+
     def process(self, url: str, source: str):
         if url is None:
             logging.info("URL is None, skipping")
             return -1
         metadata = {"source": source, "url": url}
-        logging.info(f"Crawling and indexing {url}")
+        html = self.crawler.html_cache.get(url) if self.crawler.html_cache else None
         try:
-            with self.rate_limiter:
-                succeeded = self.indexer.index_url(url, metadata=metadata, html_processing=self.crawler.html_processing)
+            if html is not None:
+                # the page was downloaded when it was discovered, so it is indexed from that copy
+                logging.info(f"Indexing {url} from the HTML downloaded during discovery")
+                succeeded = self.indexer.index_url(url, metadata=metadata, html_processing=self.crawler.html_processing, html=html,
+                                                   extractor=self.crawler.extractor)
+                self.crawler.html_cache.discard(url)
+            else:
+                logging.info(f"Crawling and indexing {url}")
+                with self.rate_limiter:
+                    succeeded = self.indexer.index_url(url, metadata=metadata, html_processing=self.crawler.html_processing,
+                                                       extractor=self.crawler.extractor)
             if not succeeded:
                 logging.info(f"Indexing failed for {url}")
-            else:
-                logging.info(f"Indexing {url} was successful")
+                return -1
+            logging.info(f"Indexing {url} was successful")
         except Exception as e:
             import traceback
             logging.error(
@@ -52,98 +78,189 @@ class DocsCrawler(Crawler):
             joined = urljoin(url, href)
             return joined
 
-    def get_url_content(self, url: str) -> Tuple[str, BeautifulSoup]:
+    def parse_page(self, content: bytes) -> Optional[Any]:
+        try:
+            return lxml.html.fromstring(content)
+        except Exception:
+            return None         # e.g. an empty page
+
+    def get_url_links(self, url: str) -> Tuple[Optional[str], Optional[List[str]]]:
+        """
+        Fetch a page (following a meta refresh redirect), and return its URL and the links on it, parsing it only once.
+        Returns (None, None) if the page could not be fetched, and (url, None) if it was not modified since the
+        previous run (in which case the links saved by that run are used).
+        """
         headers = {
             'User-Agent': 'Mozilla/5.0',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8'
         }
-        response = self.session.get(url, headers=headers)
+        conditional = self.validators.conditional_headers(url) if self.validators else {}
+        response = self.indexer.http_get(url, session=self.session, headers={**headers, **conditional})
+        if response is None:
+            return None, None
+        if response.status_code == 304 and self.validators and self.validators.not_modified(url):
+            return url, None        # not modified since the previous run; its saved links are used instead
         if response.status_code != 200:
             logging.info(f"Failed to crawl {url}, response code is {response.status_code}")
             return None, None
 
-        # check for refresh redirect        
-        soup = BeautifulSoup(response.content, 'html.parser')
-        meta_refresh = soup.find('meta', attrs={'http-equiv': 'refresh'})
+        # check for refresh redirect
+        doc = self.parse_page(response.content)
+        meta_refresh = doc.xpath('//meta[translate(@http-equiv, "REFSH", "refsh")="refresh"]/@content') if doc is not None else []
+        if self.validators and not meta_refresh:
+            self.validators.record(url, response, size=len(response.content))
         if meta_refresh:
-            href = meta_refresh['content'].split('url=')[-1]            # type: ignore
+            href = meta_refresh[0].split('url=')[-1]
             url = self.concat_url_and_href(url, href)
-            response = self.session.get(url, headers=headers)
+            response = self.indexer.http_get(url, session=self.session, headers=headers)
+            if response is None:
+                return None, None
             if response.status_code != 200:
                 logging.info(f"Failed to crawl redirect {url}, response code is {response.status_code}")
                 return None, None
+            doc = self.parse_page(response.content)
 
-        page_content = BeautifulSoup(response.content, 'lxml')
-        return url, page_content
+        content_type = response.headers.get('Content-Type', 'text/html')
+        if self.html_cache and 'html' in content_type:
+            # with no charset in Content-Type, the cache decodes the page with the charset declared in it (or UTF-8)
+            self.html_cache.put(url, response.text.encode('utf-8') if 'charset' in content_type.lower() else response.content)
+        hrefs = doc.xpath('//a/@href') if doc is not None else []
+        return url, [self.concat_url_and_href(url, href) for href in hrefs]
 
-    def collect_urls(self, base_url: str, num_per_second: int) -> None:
+    def fetch_links(self, url: str, host_scheduler: HostScheduler, rate_limiter: RateLimiter) -> Tuple[Optional[str], Optional[List[str]]]:
+        # runs in a fetcher thread
+        with host_scheduler.slot(url), rate_limiter:
+            return self.get_url_links(url)
+
+    def collect_urls(self, base_url: str, num_per_second: int, checkpoint: Optional[CrawlCheckpoint] = None,
+                     on_url: Optional[Callable[[str], None]] = None) -> None:
+        """
+        Crawl the docs site from base_url, adding each page to self.crawled_urls.
+        Pages are fetched by `num_fetchers` threads, with at most `max_host_connections` concurrent requests per host,
+        and at most num_per_second requests per second overall; their links are processed on the calling thread.
+        If on_url is given, it is called (from the calling thread) with each page as soon as it is crawled (and, when
+        resuming from a checkpoint, with each page crawled before the interruption), so that it can be indexed while
+        the crawl continues.
+        """
         new_urls = deque([base_url])
+        self.queued_urls.add(base_url)
+        unsaved_urls: List[str] = []
+        if checkpoint:
+            state = checkpoint.load_frontier(base_url)
+            if state:
+                self.crawled_urls.update(state[0])
+                if on_url:
+                    for url in state[0]:
+                        on_url(url)
+                new_urls = deque(u for u, _ in state[1])
+                self.queued_urls.update(new_urls)
+            if checkpoint.discovery_done(base_url):
+                return
+            if state:
+                logging.info(f"Resuming collection of {base_url} with {len(state[0])} URLs collected and {len(new_urls)} in the queue")
+
         rate_limiter = RateLimiter(num_per_second)
-        # Crawl each URL in the queue
-        while len(new_urls):
-            n_urls = len(self.crawled_urls)
-            if n_urls>0 and n_urls%100==0:
-                logging.info(f"Currently have {n_urls} crawled urls identified")
-            
-            # pop the left-most URL from new_urls
-            url = new_urls.popleft()
-
-            try:
-                with rate_limiter:
-                    url, page_content = self.get_url_content(url)
-                if url is None:
-                    continue
-                self.crawled_urls.add(url)
-
-                # Find all the new URLs in the page's content and add them into the queue
-                if page_content:
-                    for link in page_content.find_all('a'):
-                        href = link.get('href')
-                        if href is None:
+        host_scheduler = HostScheduler(max_host_connections=self.cfg.docs_crawler.get("max_host_connections", 4))
+        num_fetchers = max(self.cfg.docs_crawler.get("num_fetchers", 8), 1)
+        in_flight: Dict[Future, str] = {}
+        with ThreadPoolExecutor(max_workers=num_fetchers) as executor:
+            while len(new_urls) > 0 or len(in_flight) > 0:
+                while len(new_urls) > 0 and len(in_flight) < num_fetchers:
+                    url = new_urls.popleft()
+                    in_flight[executor.submit(self.fetch_links, url, host_scheduler, rate_limiter)] = url
+
+                done, _ = wait(list(in_flight.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = in_flight.pop(future)
+                    try:
+                        url, links = future.result()
+                        if url is None:
                             continue
-                        abs_url = self.concat_url_and_href(url, href)
-                        if ((any([r.match(abs_url) for r in self.pos_regex])) and                           # match any of the positive regexes
-                            (not any([r.match(abs_url) for r in self.neg_regex])) and                       # don't match any of the negative regexes
-                            (abs_url.startswith("http")) and                                                # starts with http/https
-                            (abs_url not in self.ignored_urls) and                                          # not previously ignored    
-                            (len(urlparse(abs_url).fragment)==0) and                                        # does not have fragment
-                            (not any([abs_url.endswith(ext) for ext in self.extensions_to_ignore]))):    # not any of the specified extensions to ignore
-                                # add URL if needed
-                                if abs_url not in self.crawled_urls and abs_url not in new_urls:
-                                    new_urls.append(abs_url)
+                        if url in self.crawled_urls:
+                            continue        # a meta refresh to a page that was already crawled
+                        self.crawled_urls.add(url)
+                        unsaved_urls.append(url)
+                        n_urls = len(self.crawled_urls)
+                        if n_urls % 100 == 0:
+                            logging.info(f"Currently have {n_urls} crawled urls identified")
+                        if on_url:
+                            on_url(url)
+
+                        # Find all the new URLs in the page's content (or, if it was not modified, the links saved
+                        # by the previous run) and add them into the queue
+                        if links is not None:
+                            if self.validators:
+                                self.validators.set_links(url, links)
                         else:
-                            self.ignored_urls.add(abs_url)
+                            links = (self.validators.links(url) or []) if self.validators else []
+                        for abs_url in links:
+                            if (('#' not in abs_url or len(urlparse(abs_url).fragment)==0) and                 # does not have fragment
+                                (abs_url not in self.ignored_urls) and                                          # not previously ignored
+                                self.url_filter.accept(abs_url)):                                               # http(s), matches pos/neg regex, not an ignored extension
+                                    # add URL if needed
+                                    if abs_url not in self.crawled_urls and abs_url not in self.queued_urls:
+                                        new_urls.append(abs_url)
+                                        self.queued_urls.add(abs_url)
+                            else:
+                                self.ignored_urls.add(abs_url)
+
+                    except Exception as e:
+                        import traceback
+                        logging.info(f"Error crawling {url}: {e}, traceback={traceback.format_exc()}")
+                        continue
 
-            except Exception as e:
-                import traceback
-                logging.info(f"Error crawling {url}: {e}, traceback={traceback.format_exc()}")
-                continue
+                if checkpoint and checkpoint.due():
+                    checkpoint.add_visited(base_url, unsaved_urls)
+                    unsaved_urls = []
+                    # URLs being fetched are saved with the queue, so they are fetched again on resume
+                    checkpoint.save_frontier(base_url, [(u, 0) for u in list(in_flight.values()) + list(new_urls)])
+
+        if checkpoint:
+            checkpoint.add_visited(base_url, unsaved_urls)
+            checkpoint.set_discovery_done(base_url)
 
     def crawl(self) -> None:
-        self.crawled_urls: Set[str] = set()
-        self.ignored_urls: Set[str] = set()
+        self.crawled_urls = UrlSet()
+        self.ignored_urls = UrlSet()
+        self.queued_urls = UrlSet()    # every URL ever added to the BFS queue
         self.extensions_to_ignore = list(set(self.cfg.docs_crawler.extensions_to_ignore + binary_extensions))
         self.pos_regex = [re.compile(r) for r in self.cfg.docs_crawler.get("pos_regex", [])]
         self.neg_regex = [re.compile(r) for r in self.cfg.docs_crawler.get("neg_regex", [])]
+        self.url_filter = UrlFilter(self.pos_regex, self.neg_regex, self.extensions_to_ignore, empty_pos_matches_all=False)
         self.html_processing = self.cfg.docs_crawler.get('html_processing', {})
 
-        self.session = create_session_with_retries()
+        self.session = create_session_with_retries(pool_maxsize=max(self.cfg.docs_crawler.get("num_fetchers", 8), 10))
+        self.validators = None
+        if self.cfg.docs_crawler.get('revalidate', False):
+            state_dir = self.cfg.docs_crawler.get('state_dir', '/home/vectara/env/crawl_state')
+            self.validators = ValidatorStore(os.path.join(state_dir, f"docs_crawler_{self.indexer.corpus_id}_validators.db"))
+        self.indexer.validators = self.validators
+        # for docs systems that serve static HTML, pages are indexed from the HTML downloaded during discovery,
+        # instead of being fetched again and rendered with playwright
+        docs_system = self.cfg.docs_crawler.get("docs_system", "")
+        reuse_html = self.cfg.docs_crawler.get("reuse_html", docs_system.lower() in STATIC_DOCS_SYSTEMS)
+        self.html_cache = HtmlCache(self.cfg.docs_crawler.get("html_cache_dir", None),
+                                    max_bytes=int(self.cfg.docs_crawler.get("html_cache_mb", 1024)) << 20) if reuse_html else None
+        # the main content of each page is extracted with the selectors of its docs system, if it is a known one
+        self.extractor = None
+        if self.cfg.docs_crawler.get("extract_main_content", True):
+            self.extractor = get_docs_extractor(docs_system, self.cfg.docs_crawler.get("content_xpaths", None),
+                                                self.cfg.docs_crawler.get("remove_xpaths", None))
+        if self.extractor:
+            logging.info(f"Extracting the main content of pages with the {docs_system} extractor")
 
         source = self.cfg.docs_crawler.docs_system
         ray_workers = self.cfg.docs_crawler.get("ray_workers", 0)            # -1: use ray with ALL cores, 0: dont use ray
         num_per_second = max(self.cfg.docs_crawler.get("num_per_second", 10), 1)
 
-        for base_url in self.cfg.docs_crawler.base_urls:
-            self.collect_urls(base_url, num_per_second=num_per_second)
+        checkpoint = self.open_checkpoint()
+        completed = checkpoint.completed() if checkpoint else set()
 
-        logging.info(f"Found {len(self.crawled_urls)} urls in {self.cfg.docs_crawler.base_urls}")
-        if self.cfg.docs_crawler.get("crawl_report", False):
-            logging.info(f"Collected {len(self.crawled_urls)} URLs to crawl and index. See urls_indexed.txt for a full report.")
-            with open('/home/vectara/env/urls_indexed.txt', 'w') as f:
-                for url in sorted(list(self.crawled_urls)):
-                    f.write(url + '\n')
-        else:
-            logging.info(f"Collected {len(self.crawled_urls)} URLs to crawl and index.")
+        def mark(url: str, res: int) -> None:
+            if checkpoint:
+                checkpoint.mark(url, DONE if res == 0 else ERROR)
+            if self.validators and res == 0:
+                self.validators.mark_indexed(url)
 
         if ray_workers == -1:
             ray_workers = psutil.cpu_count(logical=True)
@@ -151,18 +268,61 @@ class DocsCrawler(Crawler):
             logging.info(f"Using {ray_workers} ray workers")
             self.indexer.p = self.indexer.browser = None
             ray.init(num_cpus=ray_workers, log_to_driver=True, include_dashboard=False)
-            actors = [ray.remote(UrlCrawlWorker).remote(self.indexer, self, num_per_second) for _ in range(ray_workers)]
+            rate_backend = create_shared_backend(num_per_second)     # so num_per_second holds across all actors
+            if self.indexer.near_duplicates:
+                self.indexer.near_duplicates.share()
+            actors = [ray.remote(UrlCrawlWorker).remote(self.indexer, self, num_per_second, rate_backend) for _ in range(ray_workers)]
             for a in actors:
                 a.setup.remote()
-            pool = ray.util.ActorPool(actors)
-            _ = list(pool.map(lambda a, u: a.process.remote(u, source=source), self.crawled_urls))
-                
+            index_queue = self.make_ray_queue(actors, lambda a, u: a.process.remote(u, source=source), mark,
+                                              host_of=lambda u: urlparse(u).netloc)
         else:
             crawl_worker = UrlCrawlWorker(self.indexer, self, num_per_second)
-            for inx, url in enumerate(self.crawled_urls):
-                if inx % 100 == 0:
-                    logging.info(f"Crawling URL number {inx+1} out of {len(self.crawled_urls)}")
-                crawl_worker.process(url, source=source)
+            index_queue = IndexQueue([crawl_worker], lambda w, u: w.process(u, source=source), mark)
+
+        # index each page as soon as it is crawled; the index queue blocks when all workers are busy,
+        # which slows the crawl down to the pace of indexing
+        n_skipped = n_not_modified = 0
+
+        def on_url(url: str) -> None:
+            nonlocal n_skipped, n_not_modified
+            if url in completed:        # already indexed by a previous (interrupted) run
+                n_skipped += 1
+            elif self.validators and self.validators.unchanged(url):
+                n_not_modified += 1
+            else:
+                index_queue.put(url)
+
+        for base_url in self.cfg.docs_crawler.base_urls:
+            self.collect_urls(base_url, num_per_second=num_per_second, checkpoint=checkpoint, on_url=on_url)
+
+        logging.info(f"Found {len(self.crawled_urls)} urls in {self.cfg.docs_crawler.base_urls}")
+        if self.cfg.docs_crawler.get("crawl_report", False):
+            logging.info(f"Collected {len(self.crawled_urls)} URLs to crawl and index. See urls_indexed.txt for a full report.")
+            with open('/home/vectara/env/urls_indexed.txt', 'w') as f:
+                for url in sorted(list(self.crawled_urls)):
+                    f.write(url + '\n')
+        else:
+            logging.info(f"Collected {len(self.crawled_urls)} URLs to crawl and index.")
+        if n_skipped > 0:
+            logging.info(f"Skipped {n_skipped} URLs already indexed in a previous run")
+        if n_not_modified > 0:
+            logging.info(f"Skipped {n_not_modified} URLs that were not modified since they were last indexed")
+        index_queue.join()
+        if self.html_cache:
+            self.html_cache.close()
+        if self.validators:
+            stats = [self.validators.stats]
+            if ray_workers > 0:
+                stats += ray.get([a.revalidation_stats.remote() for a in actors])
+            self.validators.report(merge_revalidation_stats(stats))
+            self.validators.close()
+        if self.indexer.near_duplicates:
+            crawl_report = self.cfg.docs_crawler.get("crawl_report", False)
+            self.indexer.near_duplicates.report('/home/vectara/env/near_duplicates.txt' if crawl_report else None)
+
+        if checkpoint:
+            checkpoint.close()
 
         # If remove_old_content is set to true:
         # remove from corpus any document previously indexed that is NOT in the crawl list
@@ -280,8 +280,10 @@ class GdriveCrawler(Crawler):
             actors = [ray.remote(UserWorker).remote(self.indexer, self, shared_cache, date_threshold, permissions, use_ray=True) for _ in range(ray_workers)]
             for a in actors:
                 a.setup.remote()
-            pool = ray.util.ActorPool(actors)
-            _ = list(pool.map(lambda a, user: a.process.remote(user), self.delegated_users))
+            index_queue = self.make_ray_queue(actors, lambda a, user: a.process.remote(user), label=lambda user: f"user {user}")
+            for user in self.delegated_users:
+                index_queue.put(user)
+            index_queue.join()
                 
         else:
             shared_cache = SharedCache()
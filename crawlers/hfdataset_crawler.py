@@ -74,7 +74,6 @@ class HfdatasetCrawler(Crawler):
         if ray_workers == -1:
             ray_workers = psutil.cpu_count(logical=True)
 
-        batch_size = 256
         if ray_workers > 0:
             logging.info(f"Using {ray_workers} ray workers")
             self.indexer.p = self.indexer.browser = None
@@ -82,19 +81,14 @@ class HfdatasetCrawler(Crawler):
             actors = [ray.remote(RowIndexer).remote(self.indexer, self) for _ in range(ray_workers)]
             for a in actors:
                 a.setup.remote()
-            pool = ray.util.ActorPool(actors)
-            batch = []
+            # rows are streamed to the actors as the dataset is read, and their results collected as they complete
+            index_queue = self.make_ray_queue(actors, lambda a, args_inx: a.process.remote(args_inx[0], args_inx[1], id_column, text_columns, metadata_columns, title_column),
+                                              label=lambda args_inx: f"row {args_inx[0]}")
             for inx, row in enumerate(ds):
                 if num_rows and inx >= num_rows:
                     break  # Ensure we stop when num_rows is reached                
-                batch.append((inx,row))
-                if len(batch) >= batch_size:
-                    _ = list(pool.map(lambda a, args_inx: a.process.remote(args_inx[0], args_inx[1], id_column, text_columns, metadata_columns, title_column),
-                                      batch))
-                    batch = []
-            if batch:
-                _ = list(pool.map(lambda a, args_inx: a.process.remote(args_inx[0], args_inx[1], id_column, text_columns, metadata_columns, title_column), 
-                                  batch))
+                index_queue.put((inx, row))
+            index_queue.join()
         else:
             crawl_worker = RowIndexer(self.indexer, self)
             for inx, row in enumerate(ds):
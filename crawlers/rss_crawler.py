@@ -1,6 +1,7 @@
 import logging
 import time
 from core.crawler import Crawler
+from core.url_set import UrlSet
 import feedparser
 from datetime import datetime, timedelta
 from time import mktime
@@ -60,7 +61,7 @@ class RssCrawler(Crawler):
 
         logging.info(f"Found {len(urls)} URLs to index from the last {days_past} days ({source})")
 
-        crawled_urls = set()  # To avoid duplications
+        crawled_urls = UrlSet()  # To avoid duplications
         for url, title, pub_date in urls:
             if url in crawled_urls:
                 logging.info(f"Skipping duplicate URL: {url}")
@@ -99,6 +100,7 @@ class RssCrawler(Crawler):
 
             time.sleep(delay_in_secs)
 
+        crawled_urls.close()
         logging.info("RSS crawl completed successfully.")
         return
 
@@ -392,8 +392,11 @@ class SlackCrawler(Crawler):
                 actors = [ray.remote(SlackMsgIndexer).remote(self.indexer, self) for _ in range(ray_workers)]
                 for a in actors:
                     a.setup.remote()
-                pool = ray.util.ActorPool(actors)
-                _ = list(pool.map(lambda a, msg: a.process.remote(channel, msg, users_info_id), messages))
+                index_queue = self.make_ray_queue(actors, lambda a, msg: a.process.remote(channel, msg, users_info_id),
+                                                  label=lambda msg: f"message {msg.get('ts')} of channel {channel['name']}")
+                for msg in messages:
+                    index_queue.put(msg)
+                index_queue.join()
             else:
                 msg_indexer = SlackMsgIndexer(self.indexer, self)
                 for inx, msg in enumerate(messages):
@@ -1,57 +1,168 @@
 import logging
 import os
-from core.crawler import Crawler, recursive_crawl
-from core.utils import clean_urls, archive_extensions, img_extensions, get_file_extension, RateLimiter, setup_logging, get_urls_from_sitemap
+from core.crawler import Crawler
+from core.frontier import FrontierCrawler
+from core.checkpoint import CrawlCheckpoint, DONE, ERROR
+from core.recrawl_state import RecrawlState
+from core.revalidation import ValidatorStore, merge_revalidation_stats
+from core.robots import RobotsCache
+from core.host_scheduler import HostScheduler, interleave_by_host
+from core.url_filter import UrlFilter
+from core.canonical import UrlCanonicalizer
+from core.utils import clean_urls, normalize_url, archive_extensions, img_extensions, get_file_extension, setup_logging
+from core.rate_limit import RateLimiter, create_shared_backend
+from core.sitemap import SitemapWalker
 from core.indexer import Indexer
+from core.index_queue import IndexQueue
+from core.crawl_budget import CrawlBudget, CrawlBudgetExhausted, CrawlScheduler, PriorityScorer
+from core.url_set import UrlSet
+from core.host_health import merge_host_reports
 import re
-from typing import List, Set
+from urllib.parse import urlparse
+import queue
+from typing import Callable, List, Set, Tuple, Optional
+from concurrent.futures import Future
 
 import ray
 import psutil
 
+DEFERRED = 1    # returned by PageCrawlWorker.process() when the URL's host circuit is open
+DUPLICATE = 2   # returned by PageCrawlWorker.process() when the page was already indexed under its canonical URL
 
 class PageCrawlWorker(object):
-    def __init__(self, indexer: Indexer, crawler: Crawler, num_per_second: int):
+    def __init__(self, indexer: Indexer, crawler: Crawler, num_per_second: int, host_scheduler: Optional[HostScheduler] = None,
+                 rate_backend=None):
         self.crawler = crawler
         self.indexer = indexer
-        self.rate_limiter = RateLimiter(num_per_second)
+        self.rate_limiter = RateLimiter(num_per_second, backend=rate_backend)
+        self.host_scheduler = host_scheduler or HostScheduler()
+        self.pending_pdfs: List[Tuple[str, str, Future, dict]] = []
 
     def setup(self):
         self.indexer.setup()
         setup_logging()
 
-    def process(self, url: str, extraction: str, source: str):
+    def index_pdf(self, url: str, filename: str, future: Future, metadata: dict) -> int:
+        try:
+            if not future.result():
+                logging.error(f"Error while processing {url}: failed to convert to PDF")
+                return -1
+            succeeded = self.indexer.index_file(filename, uri=url, metadata=metadata)
+            if not succeeded:
+                logging.info(f"Indexing failed for {url}")
+                return -1
+            logging.info(f"Indexing {url} was successful")
+        except Exception as e:
+            import traceback
+            logging.error(
+                f"Error while indexing {url}: {e}, traceback={traceback.format_exc()}"
+            )
+            return -1
+        finally:
+            if os.path.exists(filename):
+                os.remove(filename)
+        return 0
+
+    def index_completed_pdfs(self, wait: bool = False) -> List[Tuple[str, int]]:
+        """
+        Index the PDF files whose conversion has completed (or all of them, if wait is True),
+        and return the URL and result code of each one.
+        """
+        results = []
+        still_pending = []
+        for url, filename, future, metadata in self.pending_pdfs:
+            if wait or future.done():
+                results.append((url, self.index_pdf(url, filename, future, metadata)))
+            else:
+                still_pending.append((url, filename, future, metadata))
+        self.pending_pdfs = still_pending
+        return results
+
+    def finish(self) -> List[Tuple[str, int]]:
+        """
+        Index the PDFs still being converted, and return their URLs and result codes.
+        """
+        results = self.index_completed_pdfs(wait=True)
+        if self.crawler.pdf_converter is not None:
+            self.crawler.pdf_converter.close()
+        return results
+
+    def host_health_report(self):
+        return self.indexer.host_health.tripped_hosts()
+
+    def revalidation_stats(self):
+        return self.indexer.validators.stats if self.indexer.validators else None
+
+    def crawl_and_index(self, url: str, source: str) -> Tuple[int, List[str], str]:
+        """
+        Render and index a page, and return the result code, the page's links and the URL it was indexed under.
+        """
+        metadata = {"source": source, "url": url}
+        logging.info(f"Crawling and indexing {url}")
+        try:
+            with self.rate_limiter:
+                res = self.indexer.crawl_and_index_url(url, metadata=metadata, html_processing=self.crawler.html_processing)
+        except Exception as e:
+            import traceback
+            logging.error(
+                f"Error while indexing {url}: {e}, traceback={traceback.format_exc()}"
+            )
+            return -1, [], url
+        if res.get('duplicate'):
+            return DUPLICATE, res['links'], res['url']
+        if not res['indexed']:
+            logging.info(f"Indexing failed for {url}")
+        else:
+            logging.info(f"Indexing {url} was successful")
+        return (0 if res['indexed'] else -1), res['links'], res['url']
+
+    def page_links(self, url: str) -> Tuple[List[str], str]:
+        """
+        Render a page without indexing it (since a previous run already indexed it), and return its links and the URL
+        it was indexed under, so that the crawl can continue from it.
+        """
+        try:
+            with self.rate_limiter:
+                res = self.indexer.fetch_page_contents(url)
+        except Exception as e:
+            logging.error(f"Error while rendering {url}: {e}")
+            return [], url
+        page_url = self.indexer.canonicalizer.resolve(url, res['url'], res['html']) if self.indexer.canonicalizer else url
+        return res['links'], page_url
+
+    def process(self, url: str, extraction: str, source: str, defer: bool = True, wait: bool = False):
+        """
+        Index a URL, and return its result code (0 if indexed, -1 if not, DEFERRED if its host is failing,
+        DUPLICATE if it was already indexed under its canonical URL).
+        With extraction "pdf", the PDF conversion is queued, and the URLs and result codes of the PDFs indexed so far
+        are returned instead (as a list), since a page's result is only known once its conversion completes;
+        with wait=True, the result of the page itself is included.
+        """
         metadata = {"source": source, "url": url}
+        if defer and self.indexer.host_health.is_open(url):
+            logging.info(f"Deferring {url} since its host is currently failing")
+            return DEFERRED
         if extraction == "pdf":
+            # queue the PDF conversion, and index any PDFs that are ready while the rest are still rendering
             try:
-                with self.rate_limiter:
-                    filename = self.crawler.url_to_file(url, title="")
+                with self.host_scheduler.slot(url), self.rate_limiter:
+                    filename, future = self.crawler.submit_url_to_file(url, title="")
             except Exception as e:
                 logging.error(f"Error while processing {url}: {e}")
                 return -1
-            try:
-                succeeded = self.indexer.index_file(filename, uri=url, metadata=metadata)
-                if not succeeded:
-                    logging.info(f"Indexing failed for {url}")
-                else:
-                    if os.path.exists(filename):
-                        os.remove(filename)
-                    logging.info(f"Indexing {url} was successful")
-            except Exception as e:
-                import traceback
-                logging.error(
-                    f"Error while indexing {url}: {e}, traceback={traceback.format_exc()}"
-                )
-                return -1
+            self.pending_pdfs.append((url, filename, future, metadata))
+            return self.index_completed_pdfs(wait=wait)
         else:  # use index_url which uses PlayWright
             logging.info(f"Crawling and indexing {url}")
             try:
-                with self.rate_limiter:
-                    succeeded = self.indexer.index_url(url, metadata=metadata, html_processing=self.crawler.html_processing)
-                if not succeeded:
+                with self.host_scheduler.slot(url), self.rate_limiter:
+                    res = self.indexer.crawl_and_index_url(url, metadata=metadata, html_processing=self.crawler.html_processing)
+                if res.get('duplicate'):
+                    return DUPLICATE
+                if not res['indexed']:
                     logging.info(f"Indexing failed for {url}")
-                else:
-                    logging.info(f"Indexing {url} was successful")
+                    return -1
+                logging.info(f"Indexing {url} was successful")
             except Exception as e:
                 import traceback
                 logging.error(
@@ -61,38 +172,141 @@ class PageCrawlWorker(object):
         return 0
 
 class WebsiteCrawler(Crawler):
-    def crawl(self) -> None:
+    def get_canonicalizer(self) -> Optional[UrlCanonicalizer]:
+        if not self.cfg.website_crawler.get('canonical_urls', False):
+            return None
+        return UrlCanonicalizer(
+            keep_query_params=self.cfg.website_crawler.get('keep_query_params', False),
+            allowed_params=self.cfg.website_crawler.get('allowed_query_params', []),
+            denied_params=self.cfg.website_crawler.get('denied_query_params', []),
+            trailing_slash=self.cfg.website_crawler.get('trailing_slash', 'strip'),
+            lowercase_path=self.cfg.website_crawler.get('lowercase_urls', False),
+            use_rel_canonical=self.cfg.website_crawler.get('use_rel_canonical', True),
+        )
+
+    def open_recrawl_state(self) -> Optional[RecrawlState]:
+        """
+        Open the store of what previous runs indexed, if website_crawler.incremental is set.
+        """
+        if not self.cfg.website_crawler.get('incremental', False):
+            return None
+        state_dir = self.cfg.website_crawler.get('state_dir', '/home/vectara/env/crawl_state')
+        return RecrawlState(os.path.join(state_dir, f"website_crawler_{self.indexer.corpus_id}.db"))
+
+    def open_validator_store(self) -> Optional[ValidatorStore]:
+        """
+        Open the store of HTTP validators (ETag/Last-Modified) from previous runs, if website_crawler.revalidate is set.
+        """
+        if not self.cfg.website_crawler.get('revalidate', False):
+            return None
+        state_dir = self.cfg.website_crawler.get('state_dir', '/home/vectara/env/crawl_state')
+        return ValidatorStore(os.path.join(state_dir, f"website_crawler_{self.indexer.corpus_id}_validators.db"))
+
+    def report_revalidation(self, actors: Optional[list] = None) -> None:
+        if self.validators is None:
+            return
+        stats = [self.validators.stats]
+        if actors:
+            stats += ray.get([a.revalidation_stats.remote() for a in actors])
+        self.validators.report(merge_revalidation_stats(stats))
+
+    def make_crawl_scheduler(self) -> Optional[CrawlScheduler]:
+        """
+        Create the scheduler that orders URLs by priority and enforces the crawl budget, if either is configured.
+        """
+        prioritize = self.cfg.website_crawler.get('prioritize', False)
+        deadline_minutes = self.cfg.website_crawler.get('deadline_minutes', 0)
+        max_indexed_pages = self.cfg.website_crawler.get('max_indexed_pages', 0)
+        if not prioritize and deadline_minutes <= 0 and max_indexed_pages <= 0:
+            return None
+        scorer = PriorityScorer(
+            boosts=self.cfg.website_crawler.get('priority_boosts', {}),
+            recency_half_life_days=self.cfg.website_crawler.get('recency_half_life_days', 30),
+        )
+        window = self.cfg.website_crawler.get('priority_window', 1000) if prioritize else 0
+        return CrawlScheduler(scorer, CrawlBudget(deadline_minutes, max_indexed_pages), window)
+
+    def write_deferred_report(self, reason: str, deferred: List[str], discovery_complete: bool) -> None:
+        logging.warning(f"Stopped indexing ({reason}): {len(deferred)} URLs were deferred to a later run"
+                        + ("" if discovery_complete else ", and URL discovery did not complete"))
+        if self.cfg.website_crawler.get("crawl_report", False):
+            with open('/home/vectara/env/urls_deferred.txt', 'w') as f:
+                for url in deferred:
+                    f.write(url + '\n')
+
+    def make_frontier(self, checkpoint: Optional[CrawlCheckpoint], **kwargs) -> FrontierCrawler:
+        params = dict(
+            max_depth=self.cfg.website_crawler.get("max_depth", 3),
+            max_pages=self.cfg.website_crawler.get("max_pages", 0),
+            num_fetchers=self.cfg.website_crawler.get("num_fetchers", 8),
+            max_host_connections=self.cfg.website_crawler.get("max_host_connections", 4),
+            min_host_delay=self.cfg.website_crawler.get("min_host_delay", 0.0),
+            max_host_rate=self.cfg.website_crawler.get("max_host_rate", 0.0),
+            render_js=self.cfg.website_crawler.get("render_js", "auto"),
+            verbose=self.indexer.verbose, checkpoint=checkpoint, canonicalizer=self.indexer.canonicalizer,
+            robots=self.robots, validators=self.validators
+        )
+        params.update(kwargs)
+        return FrontierCrawler(self.indexer, pos_regex=self.pos_regex, neg_regex=self.neg_regex, **params)
+
+    def collect_urls(self, checkpoint: Optional[CrawlCheckpoint],
+                     on_url: Optional[Callable[..., None]] = None) -> Optional[List[str]]:
+        """
+        Collect the URLs to index from all base URLs, and return them.
+        If on_url is given, it is called with each URL (and its sitemap lastmod and priority, or link depth) as soon as
+        it is found and passes the filters, so that indexing can start while discovery continues.
+        It may be called more than once per URL.
+        """
         base_urls = self.cfg.website_crawler.urls
-        self.pos_regex = [re.compile(r) for r in self.cfg.website_crawler.get("pos_regex", [])]
-        self.neg_regex = [re.compile(r) for r in self.cfg.website_crawler.get("neg_regex", [])]
         keep_query_params = self.cfg.website_crawler.get('keep_query_params', False)
-        self.html_processing = self.cfg.website_crawler.get('html_processing', {})
+        canonicalizer = self.indexer.canonicalizer
+
+        # remove URLS that are out of our regex regime or are archives or images
+        url_filter = UrlFilter(self.pos_regex, self.neg_regex, extensions_to_ignore=archive_extensions + img_extensions)
+
+        def emit(url: str, lastmod: Optional[str] = None, priority: Optional[float] = None, depth: Optional[int] = None) -> None:
+            if on_url is not None and url_filter.accept(url):
+                on_url(url, lastmod=lastmod, priority=priority, depth=depth)
+
+        # when replaying a WARC capture, the URLs to index are those captured, whatever the pages_source was
+        if self.indexer.warc_archive:
+            urls = sorted(u for u in self.indexer.warc_archive.urls() if url_filter.accept(u))
+            logging.info(f"Found {len(urls)} URLs in the WARC archive")
+            for url in urls:
+                emit(url)
+            return urls
 
         # grab all URLs to crawl from all base_urls
         all_urls = []
         for homepage in base_urls:
             if self.cfg.website_crawler.pages_source == "sitemap":
-                urls = get_urls_from_sitemap(homepage)
+                walker = SitemapWalker(max_workers=self.cfg.website_crawler.get("num_fetchers", 8))
+                lastmods = {}
+                for entry in walker.iter_site(homepage, self.robots):
+                    url = canonicalizer.canonicalize(entry.url) if canonicalizer else entry.url
+                    if url in lastmods:
+                        continue
+                    lastmods[url] = entry.lastmod
+                    emit(url, entry.lastmod, entry.priority)
+                urls = list(lastmods.keys())
             elif self.cfg.website_crawler.pages_source == "crawl":
-                max_depth = self.cfg.website_crawler.get("max_depth", 3)
-                urls_set = recursive_crawl(homepage, max_depth, 
-                                           pos_regex=self.pos_regex, neg_regex=self.neg_regex, 
-                                           indexer=self.indexer, visited=set(), verbose=self.indexer.verbose)
-                urls = clean_urls(urls_set, keep_query_params)
+                # the frontier canonicalizes URLs itself if there is a canonicalizer
+                on_collect = (lambda u, d: emit(u if canonicalizer else normalize_url(u, keep_query_params), depth=d)) if on_url else None
+                frontier = self.make_frontier(checkpoint, on_collect=on_collect)
+                urls_set = frontier.crawl([homepage])
+                urls = list(urls_set) if canonicalizer else clean_urls(urls_set, keep_query_params)
+                urls_set.close()
             else:
                 logging.info(f"Unknown pages_source: {self.cfg.website_crawler.pages_source}")
-                return
+                return None
+            if canonicalizer:
+                urls = list(set(canonicalizer.canonicalize(u) for u in urls))
             logging.info(f"Found {len(urls)} URLs on {homepage}")
             all_urls += urls
 
-        # remove URLS that are out of our regex regime or are archives or images
-        urls = [u for u in all_urls if u.startswith('http') and not any([u.endswith(ext) for ext in archive_extensions + img_extensions])]
-        if self.pos_regex and len(self.pos_regex)>0:
-            urls = [u for u in all_urls if any([r.match(u) for r in self.pos_regex])]
-        if self.neg_regex and len(self.neg_regex)>0:
-            urls = [u for u in all_urls if not any([r.match(u) for r in self.neg_regex])]
-        urls = list(set(urls))
+        return list(set(u for u in all_urls if url_filter.accept(u)))
 
+    def write_crawl_report(self, urls: List[str]) -> None:
         # Store URLS in crawl_report if needed
         if self.cfg.website_crawler.get("crawl_report", False):
             logging.info(f"Collected {len(urls)} URLs to crawl and index. See urls_indexed.txt for a full report.")
@@ -102,41 +316,337 @@ class WebsiteCrawler(Crawler):
         else:
             logging.info(f"Collected {len(urls)} URLs to crawl and index.")
 
-        # print some file types
-        file_types = list(set([get_file_extension(u) for u in urls]))
-        file_types = [t for t in file_types if t != ""]
-        logging.info(f"Note: file types = {file_types}")
+    def start_ray_workers(self, ray_workers: int, num_per_second: int, host_scheduler: HostScheduler) -> list:
+        logging.info(f"Using {ray_workers} ray workers")
+        # the playwright objects can't be pickled; the driver keeps them, since discovery may still need to render pages
+        self.indexer.close_browser_contexts()
+        browsers = (self.indexer.p, self.indexer.browser, self.indexer.pdf_browser)
+        self.indexer.p = self.indexer.browser = self.indexer.pdf_browser = None
+        ray.init(num_cpus=ray_workers, log_to_driver=True, include_dashboard=False)
+        rate_backend = create_shared_backend(num_per_second)     # so num_per_second holds across all actors
+        host_scheduler.share()                                   # and so do the per-host limits
+        if self.indexer.near_duplicates:
+            self.indexer.near_duplicates.share()
+        if self.indexer.canonicalizer:
+            self.indexer.indexed_urls.share()
+        actors = [ray.remote(PageCrawlWorker).remote(self.indexer, self, num_per_second, host_scheduler, rate_backend)
+                  for _ in range(ray_workers)]
+        self.indexer.p, self.indexer.browser, self.indexer.pdf_browser = browsers
+        for a in actors:
+            a.setup.remote()
+        return actors
+
+    def crawl_and_index(self, ray_workers: int, num_per_second: int, source: str, mark: Callable[[str, int], None],
+                        checkpoint: Optional[CrawlCheckpoint]) -> Tuple[List[str], List[dict]]:
+        """
+        Single-pass mode: crawl the website and index each page from the same render that discovers its links,
+        so every URL is fetched once and indexing starts right away.
+        Returns the collected URLs and the tripped hosts report.
+        """
+        # pages indexed by a previous (interrupted) run are only rendered for their links
+        completed = checkpoint.completed() if checkpoint else set()
+        n_skipped = 0
+        if ray_workers > 0:
+            actors = self.start_ray_workers(ray_workers, num_per_second, HostScheduler())
+            idle: queue.Queue = queue.Queue()
+            for a in actors:
+                idle.put(a)
+
+            def run_page(url: str) -> Tuple[Optional[int], List[str], str]:
+                actor = idle.get()
+                try:
+                    if url in completed:
+                        links, page_url = ray.get(actor.page_links.remote(url))
+                        return None, links, page_url
+                    return ray.get(actor.crawl_and_index.remote(url, source))
+                finally:
+                    idle.put(actor)
+            num_fetchers = ray_workers
+        else:
+            crawl_worker = PageCrawlWorker(self.indexer, self, num_per_second)
+
+            def run_page(url: str) -> Tuple[Optional[int], List[str], str]:
+                if url in completed:
+                    return (None,) + crawl_worker.page_links(url)
+                return crawl_worker.crawl_and_index(url, source)
+            num_fetchers = 1
+
+        def index_page(url: str) -> Tuple[List[str], str]:
+            nonlocal n_skipped
+            res, links, page_url = run_page(url)
+            if res is None:     # not indexed again
+                n_skipped += 1
+            else:
+                mark(url, res)
+            return links, page_url
+
+        # without a canonicalizer, links are normalized like the URLs collected in two-pass mode
+        keep_query_params = self.cfg.website_crawler.get('keep_query_params', False)
+        normalize = None if self.indexer.canonicalizer else (lambda u: normalize_url(u, keep_query_params))
+        all_urls = []
+        for homepage in self.cfg.website_crawler.urls:
+            frontier = self.make_frontier(checkpoint, page_fn=index_page, page_fn_threadsafe=ray_workers > 0,
+                                          num_fetchers=num_fetchers, normalize=normalize)
+            urls_set = frontier.crawl([homepage])
+            all_urls += list(urls_set)
+            urls_set.close()
+        urls = list(set(all_urls))
+        if n_skipped > 0:
+            logging.info(f"Skipped indexing {n_skipped} URLs already indexed in a previous run")
+
+        if ray_workers > 0:
+            tripped = merge_host_reports(ray.get([a.host_health_report.remote() for a in actors]))
+        else:
+            tripped = self.indexer.host_health.tripped_hosts()
+        self.report_revalidation(actors if ray_workers > 0 else None)
+        return urls, tripped
+
+    def crawl(self) -> None:
+        self.pos_regex = [re.compile(r) for r in self.cfg.website_crawler.get("pos_regex", [])]
+        self.neg_regex = [re.compile(r) for r in self.cfg.website_crawler.get("neg_regex", [])]
+        self.html_processing = self.cfg.website_crawler.get('html_processing', {})
+        self.indexer.canonicalizer = self.get_canonicalizer()
+        replay = self.indexer.warc_archive is not None
+        # robots.txt was already applied when the pages were captured
+        self.robots = RobotsCache() if self.cfg.website_crawler.get("respect_robots_txt", False) and not replay else None
+        self.validators = self.open_validator_store()
+        self.indexer.validators = self.validators
 
         num_per_second = max(self.cfg.website_crawler.get("num_per_second", 10), 1)
         extraction = self.cfg.website_crawler.get("extraction", "playwright")   # "playwright" or "pdf"
         ray_workers = self.cfg.website_crawler.get("ray_workers", 0)            # -1: use ray with ALL cores, 0: dont use ray
         source = self.cfg.website_crawler.get("source", "website")
-
         if ray_workers == -1:
             ray_workers = psutil.cpu_count(logical=True)
 
+        # in a sharded job, the shared work queue keeps the progress instead of the checkpoint
+        work_queue = self.open_work_queue()
+        # if resuming from a checkpoint where URL collection completed, reuse the collected URLs
+        checkpoint = self.open_checkpoint() if not work_queue else None
+        recrawl_state = self.open_recrawl_state()
+        full_refresh = True
+        if recrawl_state:
+            full_refresh = recrawl_state.start_run(self.cfg.website_crawler.get('full_refresh_every', 0),
+                                                   resume=self.cfg.crawling.get('resume', False))
+
+        def mark(url: str, res: int) -> None:
+            if checkpoint and res != DEFERRED:
+                checkpoint.mark(url, DONE if res in (0, DUPLICATE) else ERROR)
+            if recrawl_state and res == 0:
+                recrawl_state.mark_indexed(url)
+            if self.validators and res == 0:
+                self.validators.mark_indexed(url)
+
+        single_pass = self.cfg.website_crawler.get("single_pass", False) and self.cfg.website_crawler.pages_source == "crawl" and not replay
+        if single_pass and extraction != "playwright":
+            logging.warning("single_pass requires extraction: playwright, crawling and indexing in two passes instead")
+            single_pass = False
+        if single_pass and work_queue:
+            logging.warning("single_pass is not supported with crawling.shard_queue, crawling and indexing in two passes instead")
+            single_pass = False
+        if single_pass:
+            if self.make_crawl_scheduler() is not None:
+                logging.warning("prioritize, deadline_minutes and max_indexed_pages are not supported with single_pass, ignoring them")
+            urls, tripped = self.crawl_and_index(ray_workers, num_per_second, source, mark, checkpoint)
+            self.write_crawl_report(urls)
+            self.finish_crawl(urls, tripped, checkpoint, recrawl_state)
+            return
+
+        if self.cfg.website_crawler.pages_source not in ["sitemap", "crawl"]:
+            logging.info(f"Unknown pages_source: {self.cfg.website_crawler.pages_source}")
+            return
+
+        host_scheduler = HostScheduler(
+            self.robots,
+            max_host_connections=self.cfg.website_crawler.get("max_host_connections", 4),
+            max_host_rate=self.cfg.website_crawler.get("max_host_rate", 0.0),
+            min_host_delay=self.cfg.website_crawler.get("min_host_delay", 0.0),
+        )
+        deferred: List[str] = []
+        crawl_scheduler = self.make_crawl_scheduler()
+
+        def on_result(url: str, res) -> None:
+            if isinstance(res, list):       # the PDFs indexed so far (see PageCrawlWorker.process)
+                for pdf_url, pdf_res in res:
+                    on_result(pdf_url, pdf_res)
+                return
+            mark(url, res)
+            if crawl_scheduler:
+                crawl_scheduler.budget.record(res == 0)
+            if res == DEFERRED:
+                deferred.append(url)
+            elif work_queue:
+                work_queue.ack(url, res in (0, DUPLICATE))
+
         if ray_workers > 0:
-            logging.info(f"Using {ray_workers} ray workers")
-            self.indexer.p = self.indexer.browser = None
-            ray.init(num_cpus=ray_workers, log_to_driver=True, include_dashboard=False)
-            actors = [ray.remote(PageCrawlWorker).remote(self.indexer, self, num_per_second) for _ in range(ray_workers)]
-            for a in actors:
-                a.setup.remote()
-            pool = ray.util.ActorPool(actors)
-            _ = list(pool.map(lambda a, u: a.process.remote(u, extraction=extraction, source=source), urls))
-                
+            actors = self.start_ray_workers(ray_workers, num_per_second, host_scheduler)
+
+            def make_queue(defer: bool) -> IndexQueue:
+                return self.make_ray_queue(actors, lambda a, u: a.process.remote(u, extraction=extraction, source=source, defer=defer,
+                                                                                  wait=work_queue is not None),
+                                           on_result, host_of=lambda u: urlparse(u).netloc)
         else:
-            crawl_worker = PageCrawlWorker(self.indexer, self, num_per_second)
-            for inx, url in enumerate(urls):
-                if inx % 100 == 0:
-                    logging.info(f"Crawling URL number {inx+1} out of {len(urls)}")
-                crawl_worker.process(url, extraction=extraction, source=source)
+            crawl_worker = PageCrawlWorker(self.indexer, self, num_per_second, host_scheduler)
+
+            def make_queue(defer: bool) -> IndexQueue:
+                return IndexQueue([crawl_worker], lambda w, u: w.process(u, extraction=extraction, source=source, defer=defer,
+                                                                            wait=work_queue is not None),
+                                  on_result)
+
+        def finish_workers() -> List[dict]:
+            # PDFs still converting are indexed now, and their results recorded
+            if ray_workers > 0:
+                for results in ray.get([a.finish.remote() for a in actors]):
+                    on_result('', results)
+                tripped = merge_host_reports(ray.get([a.host_health_report.remote() for a in actors]))
+            else:
+                on_result('', crawl_worker.finish())
+                tripped = self.indexer.host_health.tripped_hosts()
+            self.report_revalidation(actors if ray_workers > 0 else None)
+            return tripped
+
+        if work_queue:
+            while not work_queue.claim_producer():
+                # another process discovers the URLs: index the URLs it adds to the shared queue until they are all done,
+                # or take over discovery if that process died
+                if work_queue.consume(make_queue(defer=False)):
+                    work_queue.close()
+                    self.finish_crawl([], finish_workers(), checkpoint, recrawl_state, discovered=False)
+                    return
+
+        # URLs are indexed as soon as they are discovered and pass the checks below, while discovery continues.
+        # The index queue blocks when all workers are busy, which slows discovery down to the pace of indexing.
+        # With a crawl scheduler, URLs are held back in a priority window first, and released within the crawl budget.
+        # In a sharded job, URLs are added to the shared work queue instead, and indexed by all processes from there.
+        index_queue = work_queue or make_queue(defer=True)
+        stopped = None      # why the crawl budget stopped the crawl, if it did
+        urls = checkpoint.get_urls() if checkpoint else None
+        collecting = urls is None
+        completed = checkpoint.completed() if checkpoint else set()
+        queued = UrlSet()
+        skipped = {'completed': 0, 'unchanged': 0, 'not_modified': 0, 'disallowed': 0}
+        pending: List[Tuple[str, Optional[str], Optional[float], Optional[int]]] = []
+        # in incremental mode, sitemap lastmods are recorded in batches, before checking which URLs changed
+        batch_size = 500 if recrawl_state and self.cfg.website_crawler.pages_source == "sitemap" else 1
+        if recrawl_state:
+            logging.info("Incremental crawl: " + ("full refresh, indexing all URLs" if full_refresh else "only indexing new or changed URLs"))
+
+        def dispatch(url: str, lastmod: Optional[str], priority: Optional[float], depth: Optional[int]) -> None:
+            if crawl_scheduler is None:
+                index_queue.put(url)
+                return
+            crawl_scheduler.push(url, priority, lastmod, depth)
+            for u in crawl_scheduler.ready(extra=index_queue.idle_slots()):
+                index_queue.put(u)
+
+        def flush() -> None:
+            if recrawl_state and collecting:
+                recrawl_state.update_sitemap((url, lastmod) for url, lastmod, _, _ in pending)
+            for url, lastmod, priority, depth in pending:
+                if url in completed:                    # already indexed by a previous (interrupted) run
+                    skipped['completed'] += 1
+                elif recrawl_state and not full_refresh and not recrawl_state.needs_index(url):
+                    skipped['unchanged'] += 1
+                elif self.validators and self.validators.unchanged(url):    # got a 304 during discovery
+                    skipped['not_modified'] += 1
+                elif self.robots and not self.robots.allowed(url):
+                    skipped['disallowed'] += 1
+                else:
+                    dispatch(url, lastmod, priority, depth)
+            pending.clear()
+
+        def on_url(url: str, lastmod: Optional[str] = None, priority: Optional[float] = None, depth: Optional[int] = None) -> None:
+            reason = crawl_scheduler.budget.exhausted() if crawl_scheduler else None
+            if reason:
+                raise CrawlBudgetExhausted(reason)      # stops discovery too
+            if url in queued:
+                return
+            queued.add(url)
+            pending.append((url, lastmod, priority, depth))
+            if len(pending) >= batch_size:
+                flush()
+
+        try:
+            if collecting:
+                urls = self.collect_urls(checkpoint, on_url)
+                if checkpoint and urls is not None:
+                    checkpoint.set_urls(urls)
+            else:
+                # spread consecutive requests over hosts, each with its own politeness budget
+                for url in interleave_by_host(urls):
+                    on_url(url)
+            flush()
+            if crawl_scheduler:
+                for url in crawl_scheduler.ready(flush=True):
+                    index_queue.put(url)
+        except CrawlBudgetExhausted as e:
+            stopped = str(e)
+        discovery_complete = urls is not None
+        if not discovery_complete:
+            urls = list(queued)
+        queued.close()
+
+        self.write_crawl_report(urls)
+        # print some file types
+        file_types = list(set([get_file_extension(u) for u in urls]))
+        file_types = [t for t in file_types if t != ""]
+        logging.info(f"Note: file types = {file_types}")
+        if skipped['completed'] > 0:
+            logging.info(f"Skipped {skipped['completed']} URLs already indexed in a previous run")
+        if skipped['unchanged'] > 0:
+            logging.info(f"Incremental crawl: skipped {skipped['unchanged']} URLs that did not change since they were last indexed")
+        if skipped['not_modified'] > 0:
+            logging.info(f"Skipped {skipped['not_modified']} URLs that were not modified since they were last indexed")
+        if skipped['disallowed'] > 0:
+            logging.info(f"Skipped {skipped['disallowed']} URLs disallowed by robots.txt")
+
+        index_queue.join()
+        if work_queue:
+            work_queue.seal()
+            work_queue.consume(make_queue(defer=False))
+            work_queue.close()
+        if stopped:
+            # URLs deferred due to failing hosts come first, since they were released earlier
+            self.write_deferred_report(stopped, deferred + [u for u, _ in crawl_scheduler.deferred()], discovery_complete)
+        elif len(deferred) > 0:
+            logging.info(f"Retrying {len(deferred)} URLs that were deferred due to failing hosts")
+            retry_queue, retry_urls = make_queue(defer=False), list(deferred)
+            for url in retry_urls:
+                retry_queue.put(url)
+            retry_queue.join()
+
+        self.finish_crawl(urls, finish_workers(), checkpoint, recrawl_state, discovery_complete)
+
+    def finish_crawl(self, urls: List[str], tripped: List[dict], checkpoint: Optional[CrawlCheckpoint],
+                     recrawl_state: Optional[RecrawlState], discovery_complete: bool = True, discovered: bool = True) -> None:
+        """
+        Report on the crawl, close its stores, and remove content that is no longer on the site.
+        discovered is False in the processes of a sharded job that only indexed URLs discovered by another process,
+        which leaves the removals to that process.
+        """
+        self.indexer.host_health.report(tripped)
+        if self.indexer.near_duplicates:
+            crawl_report = self.cfg.website_crawler.get("crawl_report", False)
+            self.indexer.near_duplicates.report('/home/vectara/env/near_duplicates.txt' if crawl_report else None)
+        if checkpoint:
+            checkpoint.close()
+        if self.validators:
+            self.validators.close()
+        if recrawl_state:
+            if discovery_complete and discovered:
+                recrawl_state.remove_vanished()
+            recrawl_state.close()
 
         # If remove_old_content is set to true:
         # remove from corpus any document previously indexed that is NOT in the crawl list
-        if self.cfg.website_crawler.get("remove_old_content", False):
+        # (only if the crawl list is complete, otherwise pages that were not discovered yet would be removed)
+        remove_old_content = self.cfg.website_crawler.get("remove_old_content", False) and discovered
+        if remove_old_content and not discovery_complete:
+            logging.warning("URL discovery did not complete, not removing old content")
+        elif remove_old_content:
+            crawled_urls = set(urls)
             existing_docs = self.indexer._list_docs()
-            docs_to_remove = [t for t in existing_docs if t['url'] and t['url'] not in urls]
+            docs_to_remove = [t for t in existing_docs if t['url'] and t['url'] not in crawled_urls]
             for doc in docs_to_remove:
                 if doc['url']:
                     self.indexer.delete_doc(doc['doc_id'])
@@ -145,5 +655,3 @@ class WebsiteCrawler(Crawler):
                 with open('/home/vectara/env/urls_removed.txt', 'w') as f:
                     for url in sorted([t['url'] for t in docs_to_remove if t['url']]):
                         f.write(url + '\n')
-
-
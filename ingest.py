@@ -69,8 +69,8 @@ def reset_corpus(endpoint: str, customer_id: str, corpus_id: int, auth_url: str,
         logging.error(f"Error resetting corpus: {response.status_code} {response.text}")
 
 def main() -> None:
-    if len(sys.argv) != 3:
-        logging.info("Usage: python ingest.py <config_file> <secrets-profile>")
+    if len(sys.argv) not in [3, 4] or (len(sys.argv) == 4 and sys.argv[3] != '--resume'):
+        logging.info("Usage: python ingest.py <config_file> <secrets-profile> [--resume]")
         return
 
     logging.info("Starting the Crawler...")
@@ -78,6 +78,9 @@ def main() -> None:
     profile_name = sys.argv[2]
 
     cfg: DictConfig = DictConfig(OmegaConf.load(config_name))
+    if len(sys.argv) == 4:
+        logging.info("Resuming from the last checkpoint (if available)")
+        OmegaConf.update(cfg, 'crawling.resume', True)
 
     # Load secrets from .toml file
     volume = '/home/vectara/env'
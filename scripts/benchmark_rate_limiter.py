@@ -0,0 +1,85 @@
+"""
+Check the accuracy of core.rate_limit.RateLimiter under concurrency: many threads (and, if ray is installed,
+several Ray actors sharing one backend) hammer a limiter, and the achieved rate is compared to the configured one.
+
+Usage: python scripts/benchmark_rate_limiter.py [rate] [seconds] [num_threads]
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core.rate_limit import RateLimiter, create_shared_backend     # noqa: E402
+
+def hammer(limiter: RateLimiter, seconds: float, num_threads: int, key: str = '') -> int:
+    count = 0
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def work():
+        nonlocal count
+        while True:
+            limiter.acquire(key)
+            if time.monotonic() >= deadline:
+                return
+            with lock:
+                count += 1
+
+    threads = [threading.Thread(target=work) for _ in range(num_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return count
+
+def report(name: str, count: int, rate: float, burst: float, seconds: float) -> bool:
+    expected = rate * seconds + burst
+    ok = abs(count - expected) <= max(2, 0.05 * expected)
+    print(f"{name:<40} {count:>6} ops in {seconds:.0f}s, expected {expected:.0f} ({'ok' if ok else 'MISMATCH'})")
+    return ok
+
+class Worker:
+    def __init__(self, rate: float, backend):
+        self.limiter = RateLimiter(rate, backend=backend)
+
+    def run(self, seconds: float, num_threads: int) -> int:
+        return hammer(self.limiter, seconds, num_threads)
+
+def main():
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    num_threads = int(sys.argv[3]) if len(sys.argv) > 3 else 32
+    ok = True
+
+    ok &= report(f"{num_threads} threads, one bucket", hammer(RateLimiter(rate), seconds, num_threads), rate, rate, seconds)
+    ok &= report(f"{num_threads} threads, burst=1", hammer(RateLimiter(rate, burst=1), seconds, num_threads), rate, 1, seconds)
+
+    # per-key buckets are independent
+    limiter = RateLimiter(rate, key_rates={'slow': rate / 4})
+    counts = {}
+    threads = [threading.Thread(target=lambda k=k: counts.__setitem__(k, hammer(limiter, seconds, num_threads // 2, k)))
+               for k in ['fast', 'slow']]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    ok &= report("per-key bucket 'fast'", counts['fast'], rate, rate, seconds)
+    ok &= report("per-key bucket 'slow'", counts['slow'], rate / 4, max(rate / 4, 1), seconds)
+
+    try:
+        import ray
+    except ImportError:
+        print("ray is not installed, skipping the shared backend check")
+    else:
+        ray.init(num_cpus=4, include_dashboard=False, log_to_driver=False)
+        backend = create_shared_backend(rate)
+        actors = [ray.remote(Worker).remote(rate, backend) for _ in range(4)]
+        counts = ray.get([a.run.remote(seconds, num_threads // 4) for a in actors])
+        ok &= report("4 ray actors, shared backend", sum(counts), rate, rate, seconds)
+        ray.shutdown()
+
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
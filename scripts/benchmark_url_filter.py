@@ -0,0 +1,61 @@
+"""
+Micro-benchmark of core.url_filter.UrlFilter against the per-URL list comprehensions it replaced,
+on a realistic set of links (a docs site with nav links, assets, external links and API reference pages).
+
+Usage: python scripts/benchmark_url_filter.py [num_links]
+"""
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core.url_filter import UrlFilter       # noqa: E402
+from core.utils import binary_extensions    # noqa: E402
+
+POS_REGEX = [r'https://docs\.vectara\.com/docs/.*', '.*vectara.com/blog/.*', '.*vectara.com/changelog.*']
+NEG_REGEX = ['.*vectara.com/docs/rest-api/.*', '.*/tags/.*', r'.*\?.*page=\d+']
+EXTENSIONS = ['.php', '.java', '.py', '.js'] + binary_extensions
+
+def make_links(n: int):
+    rnd = random.Random(0)
+    templates = [
+        'https://docs.vectara.com/docs/{a}/{b}',
+        'https://docs.vectara.com/docs/rest-api/{a}',
+        'https://vectara.com/blog/{a}-{b}',
+        'https://vectara.com/tags/{a}',
+        'https://docs.vectara.com/assets/{a}.js',
+        'https://docs.vectara.com/img/{a}.png',
+        'https://github.com/vectara/{a}/blob/main/{b}.py',
+        'https://twitter.com/{a}',
+        'https://www.youtube.com/watch?v={a}',
+        'https://vectara.com/changelog?page={b}',
+    ]
+    return [rnd.choice(templates).format(a=rnd.randint(1, 500), b=rnd.randint(1, 500)) for _ in range(n)]
+
+def old_accept(u, pos_regex, neg_regex):
+    return ((any([r.match(u) for r in pos_regex])) and
+            (not any([r.match(u) for r in neg_regex])) and
+            (u.startswith("http")) and
+            (not any([u.endswith(ext) for ext in EXTENSIONS])))
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    links = make_links(n)
+    pos_regex = [re.compile(r) for r in POS_REGEX]
+    neg_regex = [re.compile(r) for r in NEG_REGEX]
+
+    st = time.time()
+    old = [old_accept(u, pos_regex, neg_regex) for u in links]
+    old_time = time.time() - st
+
+    url_filter = UrlFilter(pos_regex, neg_regex, EXTENSIONS, empty_pos_matches_all=False)
+    st = time.time()
+    new = [url_filter.accept(u) for u in links]
+    new_time = time.time() - st
+
+    assert old == new, "UrlFilter results differ from the reference implementation"
+    print(f"{n:,} links, {sum(new):,} accepted")
+    print(f"list comprehensions: {n/old_time:12,.0f} links/sec")
+    print(f"UrlFilter:           {n/new_time:12,.0f} links/sec ({old_time/new_time:.1f}x)")
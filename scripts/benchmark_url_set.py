@@ -0,0 +1,56 @@
+"""
+Benchmark memory use and add/lookup throughput of core.url_set.UrlSet against a built-in Python set.
+
+Usage: python scripts/benchmark_url_set.py [num_urls]
+"""
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core.url_set import UrlSet     # noqa: E402
+
+SECTIONS = ['docs', 'blog', 'api', 'guides', 'reference', 'community']
+
+def gen_urls(n: int, seed: int = 0):
+    rnd = random.Random(seed)
+    for i in range(n):
+        yield f"https://www.example{rnd.randint(1, 20)}.com/{rnd.choice(SECTIONS)}/{rnd.randint(1, 10**6)}/page-{i}.html"
+
+def bench(name: str, factory, n: int, probes):
+    # memory: the URL strings are created while building the set, so they are counted for the built-in set
+    tracemalloc.start()
+    s = factory()
+    for u in gen_urls(n):
+        s.add(u)
+    if hasattr(s, 'flush'):
+        s.flush()
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    if hasattr(s, 'close'):
+        s.close()
+
+    # throughput (measured without tracemalloc)
+    urls = list(gen_urls(n))
+    st = time.time()
+    s = factory()
+    for u in urls:
+        s.add(u)
+    add_time = time.time() - st
+    st = time.time()
+    hits = sum(1 for u in probes if u in s)
+    lookup_time = time.time() - st
+    print(f"{name:8s} n={n:,}  memory={mem/2**20:8.1f}MB  adds/sec={n/add_time:12,.0f}  "
+          f"lookups/sec={len(probes)/lookup_time:12,.0f}  hits={hits:,}/{len(probes):,}")
+    if hasattr(s, 'close'):
+        s.close()
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    # half the probes were added, half are new
+    num_probes = min(n, 200_000) // 2
+    probes = random.Random(1).sample(list(gen_urls(n)), num_probes) + list(gen_urls(num_probes, seed=2))
+    bench('set', set, n, probes)
+    bench('UrlSet', UrlSet, n, probes)
@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+from core.rate_limit import RateLimiter, TokenBuckets
+
+def observed_ops(limiter: RateLimiter, seconds: float, num_threads: int, key: str = '') -> int:
+    # number of operations that several threads get through the limiter in `seconds`
+    count = 0
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def work():
+        nonlocal count
+        while True:
+            limiter.acquire(key)
+            if time.monotonic() >= deadline:
+                return
+            with lock:
+                count += 1
+
+    threads = [threading.Thread(target=work) for _ in range(num_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return count
+
+def test_token_buckets_rate():
+    buckets = TokenBuckets(rate=10, burst=5)
+    waits = [buckets.reserve(now=100.0) for _ in range(25)]
+    # the burst goes through right away, then one request every 1/rate seconds
+    assert waits[:5] == [0.0] * 5
+    assert waits[5:] == pytest.approx([(i + 1) / 10 for i in range(20)])
+
+def test_token_buckets_refill():
+    buckets = TokenBuckets(rate=10, burst=5)
+    for _ in range(5):
+        buckets.reserve(now=100.0)
+    assert buckets.reserve(now=100.0) == pytest.approx(0.1)
+    # refilled up to the burst only, however long the bucket was idle
+    assert [buckets.reserve(now=200.0) for _ in range(6)][-1] == pytest.approx(0.1)
+
+def test_token_buckets_key_rates():
+    buckets = TokenBuckets(rate=10, key_rates={'slow': 2, 'bursty': (2, 4)})
+    assert [buckets.reserve('slow', now=0.0) for _ in range(3)] == pytest.approx([0.0, 0.0, 0.5])
+    assert [buckets.reserve('bursty', now=0.0) for _ in range(5)][-1] == pytest.approx(0.5)
+    assert buckets.reserve('other', now=0.0) == 0.0
+
+def test_token_buckets_evicts_least_recently_used():
+    buckets = TokenBuckets(rate=1, max_keys=3)
+    for key in ['a', 'b', 'c', 'a', 'd']:
+        buckets.reserve(key, now=0.0)
+    assert list(buckets.buckets) == ['c', 'a', 'd']
+
+def test_token_buckets_invalid_rate():
+    with pytest.raises(ValueError):
+        TokenBuckets(rate=0)
+
+@pytest.mark.parametrize('rate,burst', [(20, None), (20, 1), (50, 10)])
+def test_rate_limiter_observed_rate(rate, burst):
+    seconds = 1.5
+    count = observed_ops(RateLimiter(rate, burst=burst), seconds, num_threads=16)
+    expected = rate * seconds + (burst if burst is not None else rate)
+    assert abs(count - expected) <= max(2, 0.1 * expected)
+
+def test_rate_limiter_keys_are_independent():
+    seconds = 1.5
+    limiter = RateLimiter(20, burst=1, key_rates={'slow': (5, 1)})
+    counts = {}
+    threads = [threading.Thread(target=lambda k=k: counts.__setitem__(k, observed_ops(limiter, seconds, 8, k)))
+               for k in ['fast', 'slow']]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert abs(counts['fast'] - (20 * seconds + 1)) <= 3
+    assert abs(counts['slow'] - (5 * seconds + 1)) <= 2
+
+def test_rate_limiter_without_limit():
+    limiter = RateLimiter(0)
+    start = time.monotonic()
+    for _ in range(1000):
+        with limiter:
+            pass
+    assert time.monotonic() - start < 0.5